@@ -0,0 +1,1096 @@
+"""Бенчмарк шагов пайплайна на синтетическом корпусе.
+
+corpus  — сгенерировать корпус PDF в духе постановлений (сканы и текстовый
+          слой, таблицы распределения по субъектам);
+serve   — поднять над корпусом локальную заглушку API (/api/Documents, /file/pdf);
+run     — замерить download, OCR, нормализацию, классификацию и весь путь целиком,
+          результат — JSON с хэшем коммита в benchmarks/;
+compare — сравнить два файла результатов (например, до и после изменения).
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from run_metrics import RATES, children_cpu_seconds
+
+# Меняется вместе с генератором: корпус старой версии генерируется заново
+CORPUS_VERSION = 2
+
+BENCHMARKS = ("download", "ocr", "normalize", "normalize_warm", "classify", "e2e")
+
+# Заглушка API не фильтрует по датам — диапазон нужен только для вызова download_documents
+DATE_FROM = "02.01.2026"
+DATE_TO = "09.01.2026"
+AUTHORITY = "Правительство Российской Федерации"
+
+# Страница A4 в пунктах, текст — Courier 10 пт (6 пт на символ)
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 56
+FONT_SIZE = 10
+LEADING = 12
+LINE_CHARS = 78
+LINES_PER_PAGE = 56
+
+SCAN_FONTS = (
+    "DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "arial.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+)
+
+SUBJECTS = [
+    "Белгородская область", "Брянская область", "Владимирская область", "Воронежская область",
+    "Ивановская область", "Калужская область", "Костромская область", "Курская область",
+    "Московская область", "Тверская область", "Тульская область", "Ярославская область",
+    "Республика Карелия", "Республика Коми", "Архангельская область", "Вологодская область",
+    "Ленинградская область", "Мурманская область", "Псковская область", "Краснодарский край",
+    "Астраханская область", "Волгоградская область", "Ростовская область", "Республика Дагестан",
+    "Ставропольский край", "Республика Татарстан", "Пермский край", "Нижегородская область",
+    "Самарская область", "Саратовская область", "Свердловская область", "Челябинская область",
+    "Тюменская область", "Алтайский край", "Красноярский край", "Иркутская область",
+    "Новосибирская область", "Омская область", "Республика Бурятия", "Приморский край",
+    "Хабаровский край", "Амурская область", "Сахалинская область",
+]
+
+BUDGET_TITLES = [
+    "О распределении в 2026 году иных межбюджетных трансфертов из федерального бюджета "
+    "бюджетам субъектов Российской Федерации",
+    "О распределении субсидий из федерального бюджета бюджетам субъектов Российской "
+    "Федерации на софинансирование расходных обязательств",
+    "О выделении бюджетных ассигнований из резервного фонда Правительства Российской Федерации",
+]
+
+OTHER_TITLES = [
+    "О внесении изменений в положение о федеральном государственном контроле",
+    "О награждении почётной грамотой Правительства Российской Федерации",
+    "Об утверждении правил ведения государственного реестра",
+    "О порядке аккредитации организаций, осуществляющих деятельность в области стандартизации",
+]
+
+# Фразы без ключевых слов бюджетной фазы, чтобы не менять результат классификации
+FILLER = [
+    "Правительство Российской Федерации постановляет:",
+    "Настоящее постановление вступает в силу со дня его официального опубликования.",
+    "Федеральным органам исполнительной власти обеспечить реализацию настоящего постановления "
+    "в пределах установленной предельной численности работников.",
+    "Контроль за исполнением настоящего постановления возложить на соответствующее министерство.",
+    "Признать утратившими силу акты Правительства Российской Федерации по перечню согласно приложению.",
+    "Органам исполнительной власти субъектов Российской Федерации рекомендуется привести свои "
+    "нормативные правовые акты в соответствие с настоящим постановлением.",
+    "Министерству предоставлять ежеквартально в Правительство Российской Федерации доклад о ходе "
+    "выполнения мероприятий.",
+    "Разъяснения по применению настоящего постановления даются в установленном порядке.",
+    "Отчёт о достижении значений результатов представляется не позднее 15-го числа месяца, "
+    "следующего за отчётным кварталом.",
+]
+
+BUDGET_CLAUSES = [
+    "Утвердить прилагаемое распределение иных межбюджетных трансфертов из федерального бюджета "
+    "бюджетам субъектов Российской Федерации.",
+    "Предоставление субсидии осуществляется в пределах лимитов бюджетных обязательств, доведённых "
+    "в установленном порядке.",
+    "Источником финансового обеспечения является резервный фонд Правительства Российской Федерации.",
+]
+
+# Кириллица в кодировке шрифта текстового слоя: код 128+ → имя глифа Adobe
+_UPPER = "АБВГДЕЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ"
+_GLYPHS = (
+    [(ch, f"afii{10017 + i + (i >= 6)}") for i, ch in enumerate(_UPPER)]
+    + [(ch, f"afii{10065 + i + (i >= 6)}") for i, ch in enumerate(_UPPER.lower())]
+    + [("Ё", "afii10023"), ("ё", "afii10071"), ("№", "afii61352"),
+       ("«", "guillemotleft"), ("»", "guillemotright"), ("—", "emdash"), ("–", "endash")]
+)
+FONT_CODES = {ch: 128 + i for i, (ch, _) in enumerate(_GLYPHS)}
+
+
+@dataclass
+class CorpusParams:
+    """Параметры синтетического корпуса; корпус с теми же параметрами генерируется одинаково."""
+
+    documents: int = 20
+    min_pages: int = 2
+    max_pages: int = 4
+    scanned_share: float = 0.5
+    budget_share: float = 0.5
+    table_rows: int = 20
+    scan_dpi: int = 150
+    seed: int = 1
+
+
+def page_range(value: str):
+    """'3' или '2-5' -> (min, max)."""
+    try:
+        low, _, high = value.partition("-")
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise argparse.ArgumentTypeError("ожидается число страниц или диапазон, например 2-5")
+    if low < 1 or high < low:
+        raise argparse.ArgumentTypeError("ожидается 1 <= min <= max")
+    return low, high
+
+
+def wrap(text, width=LINE_CHARS):
+    lines = []
+    line = ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def format_amount(value):
+    """1234567.8 -> '1 234 567,8' (как в таблицах постановлений)."""
+    whole, fraction = f"{value:.1f}".split(".")
+    return f"{int(whole):,}".replace(",", " ") + f",{fraction}"
+
+
+def table_line(subject, amount):
+    amount = format_amount(amount)
+    return subject + " " * max(2, LINE_CHARS - len(subject) - len(amount)) + amount
+
+
+def document_pages(rng, number, budget, pages, table_rows):
+    """Название, текст постановления по страницам и число строк таблицы в нём."""
+    head = [
+        "ПРАВИТЕЛЬСТВО РОССИЙСКОЙ ФЕДЕРАЦИИ",
+        "",
+        "ПОСТАНОВЛЕНИЕ",
+        "",
+        f"от {rng.randint(2, 9)} января 2026 г. № {number}",
+        "",
+        "МОСКВА",
+        "",
+    ]
+    title = rng.choice(BUDGET_TITLES if budget else OTHER_TITLES)
+    head += wrap(title) + [""]
+    if budget:
+        for clause in BUDGET_CLAUSES:
+            head += wrap(clause)
+
+    tail = []
+    subjects = []
+    if budget:
+        subjects = rng.sample(SUBJECTS, min(table_rows, len(SUBJECTS)))
+        amounts = [round(rng.uniform(1_000, 5_000_000), 1) for _ in subjects]
+        tail = [
+            "",
+            "РАСПРЕДЕЛЕНИЕ",
+            "иных межбюджетных трансфертов из федерального бюджета",
+            "",
+            "Наименование субъекта Российской Федерации" + " " * 16 + "Размер (тыс. рублей)",
+        ]
+        tail += [table_line(subject, amount) for subject, amount in zip(subjects, amounts)]
+        tail.append(table_line("Итого", sum(amounts)))
+    tail += ["", "Председатель Правительства", "Российской Федерации"]
+
+    body = []
+    paragraphs = 0
+    # Документ добивается типовыми пунктами, пока таблица не окажется на последней странице
+    while len(head) + len(body) + len(tail) <= (pages - 1) * LINES_PER_PAGE:
+        paragraphs += 1
+        body += wrap(f"{paragraphs}. {rng.choice(FILLER)}")
+    lines = head + body + tail
+    return title, [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)], len(subjects)
+
+
+class PdfWriter:
+    """Минимальный писатель PDF 1.4: нумерованные объекты, таблица xref и trailer."""
+
+    def __init__(self):
+        self.objects = []
+
+    def reserve(self) -> int:
+        self.objects.append(None)
+        return len(self.objects)
+
+    def add(self, body) -> int:
+        number = self.reserve()
+        self.set(number, body)
+        return number
+
+    def set(self, number, body):
+        self.objects[number - 1] = body.encode("latin-1") if isinstance(body, str) else body
+
+    def stream(self, data: bytes, **entries) -> int:
+        header = "".join(f" /{key} {value}" for key, value in entries.items())
+        return self.add(f"<<{header} /Length {len(data)} >>\nstream\n".encode("latin-1") + data + b"\nendstream")
+
+    def to_bytes(self, root: int) -> bytes:
+        out = io.BytesIO()
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(self.objects, 1):
+            offsets.append(out.tell())
+            out.write(f"{number} 0 obj\n".encode("latin-1") + body + b"\nendobj\n")
+        xref = out.tell()
+        out.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+        for offset in offsets:
+            out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+        out.write(
+            f"trailer\n<< /Size {len(offsets) + 1} /Root {root} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+        )
+        return out.getvalue()
+
+
+def add_text_font(pdf: PdfWriter) -> int:
+    """Courier с кириллицей в кодах 128+ (Differences) и ToUnicode для извлечения текста."""
+    bfchar = "\n".join(f"<{code:02X}> <{ord(ch):04X}>" for ch, code in FONT_CODES.items())
+    cmap = (
+        "/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+        "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+        "1 begincodespacerange\n<00> <FF>\nendcodespacerange\n"
+        "1 beginbfrange\n<20> <7E> <0020>\nendbfrange\n"
+        f"{len(FONT_CODES)} beginbfchar\n{bfchar}\nendbfchar\n"
+        "endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend\n"
+    )
+    to_unicode = pdf.stream(cmap.encode("latin-1"))
+    differences = " ".join(f"/{glyph}" for _, glyph in _GLYPHS)
+    widths = " ".join(["600"] * (256 - 32))
+    return pdf.add(
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Courier "
+        f"/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding /Differences [128 {differences}] >> "
+        f"/FirstChar 32 /LastChar 255 /Widths [{widths}] /ToUnicode {to_unicode} 0 R >>"
+    )
+
+
+def encode_line(line: str) -> str:
+    codes = bytes(FONT_CODES.get(ch, ord(ch) if 32 <= ord(ch) < 127 else ord("?")) for ch in line)
+    return codes.hex().upper()
+
+
+def text_page_content(lines) -> bytes:
+    content = [f"BT /F1 {FONT_SIZE} Tf {LEADING} TL {MARGIN} {PAGE_HEIGHT - MARGIN} Td"]
+    content += [f"<{encode_line(line)}> Tj T*" for line in lines]
+    content.append("ET")
+    return "\n".join(content).encode("latin-1")
+
+
+def load_scan_font(size, font_path=None):
+    from PIL import ImageFont
+
+    for name in ([font_path] if font_path else []) + list(SCAN_FONTS):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    raise SystemExit("Не найден шрифт с кириллицей для сканов (DejaVuSans, Arial) — укажите --font")
+
+
+def render_scan(lines, font, dpi, rng):
+    """Страница-скан: текст, отрисованный в градациях серого, с лёгким перекосом; JPEG."""
+    from PIL import Image, ImageDraw
+
+    scale = dpi / 72
+    width, height = round(PAGE_WIDTH * scale), round(PAGE_HEIGHT * scale)
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((MARGIN * scale, (MARGIN + i * LEADING) * scale), line, fill=rng.randint(0, 60), font=font)
+    image = image.rotate(rng.uniform(-0.5, 0.5), fillcolor=255)
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=75)
+    return out.getvalue(), width, height
+
+
+def build_pdf(pages, scanned, dpi, rng, font=None) -> bytes:
+    pdf = PdfWriter()
+    catalog = pdf.reserve()
+    pages_root = pdf.reserve()
+    text_font = None
+    kids = []
+    for lines in pages:
+        if scanned:
+            jpeg, width, height = render_scan(lines, font, dpi, rng)
+            image = pdf.stream(
+                jpeg, Type="/XObject", Subtype="/Image", Width=width, Height=height,
+                ColorSpace="/DeviceGray", BitsPerComponent=8, Filter="/DCTDecode",
+            )
+            content = pdf.stream(f"q {PAGE_WIDTH} 0 0 {PAGE_HEIGHT} 0 0 cm /Im0 Do Q".encode("latin-1"))
+            resources = f"<< /XObject << /Im0 {image} 0 R >> >>"
+        else:
+            if text_font is None:
+                text_font = add_text_font(pdf)
+            content = pdf.stream(text_page_content(lines))
+            resources = f"<< /Font << /F1 {text_font} 0 R >> >>"
+        kids.append(pdf.add(
+            f"<< /Type /Page /Parent {pages_root} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources {resources} /Contents {content} 0 R >>"
+        ))
+    pdf.set(pages_root, f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>")
+    pdf.set(catalog, f"<< /Type /Catalog /Pages {pages_root} 0 R >>")
+    return pdf.to_bytes(catalog)
+
+
+class Corpus:
+    """Корпус на диске: pdf/<eoNumber>.pdf, text/<eoNumber>.txt (эталонный текст) и corpus.json."""
+
+    def __init__(self, corpus_dir):
+        self.dir = Path(corpus_dir)
+        meta = json.loads((self.dir / "corpus.json").read_text(encoding="utf-8"))
+        self.params = meta["params"]
+        self.documents = meta["documents"]
+
+    @property
+    def items(self):
+        """Элементы выдачи API (без эталонных полей)."""
+        return [document["item"] for document in self.documents]
+
+    def pdf_path(self, document):
+        return self.dir / "pdf" / f"{document['item']['eoNumber']}.pdf"
+
+    def text_path(self, document):
+        return self.dir / "text" / f"{document['item']['eoNumber']}.txt"
+
+    def total(self, key):
+        return sum(document[key] for document in self.documents)
+
+    @property
+    def total_bytes(self):
+        return sum(self.pdf_path(document).stat().st_size for document in self.documents)
+
+
+def build_corpus(corpus_dir, params: CorpusParams, font_path=None) -> Corpus:
+    """Генерирует корпус или берёт уже сгенерированный с теми же параметрами."""
+    from minepdf_cli import format_page
+
+    corpus_dir = Path(corpus_dir)
+    meta_path = corpus_dir / "corpus.json"
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta["version"] == CORPUS_VERSION and meta["params"] == asdict(params):
+            return Corpus(corpus_dir)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    for name in ("pdf", "text"):
+        shutil.rmtree(corpus_dir / name, ignore_errors=True)
+        (corpus_dir / name).mkdir(parents=True)
+    rng = random.Random(params.seed)
+    font = load_scan_font(round(FONT_SIZE * params.scan_dpi / 72), font_path) if params.scanned_share > 0 else None
+
+    documents = []
+    started = time.perf_counter()
+    for i in range(1, params.documents + 1):
+        budget = rng.random() < params.budget_share
+        scanned = rng.random() < params.scanned_share
+        number = 1000 + i
+        title, pages, table_rows = document_pages(
+            rng, number, budget, rng.randint(params.min_pages, params.max_pages), params.table_rows
+        )
+        eo_number = f"000120260105{i:04d}"
+        item = {
+            "eoNumber": eo_number,
+            "title": f"Постановление Правительства Российской Федерации от 05.01.2026 № {number} «{title}»",
+            "number": str(number),
+            "documentDate": "2026-01-05T00:00:00",
+            "signatoryAuthority": {"name": AUTHORITY},
+        }
+        (corpus_dir / "pdf" / f"{eo_number}.pdf").write_bytes(build_pdf(pages, scanned, params.scan_dpi, rng, font))
+        (corpus_dir / "text" / f"{eo_number}.txt").write_text(
+            "".join(format_page(n, "\n".join(lines)) for n, lines in enumerate(pages, 1)), encoding="utf-8"
+        )
+        documents.append({
+            "item": item,
+            "budget": budget,
+            "scanned": scanned,
+            "pages": len(pages),
+            "scanned_pages": len(pages) if scanned else 0,
+            "table_rows": table_rows,
+        })
+
+    meta_path.write_text(
+        json.dumps({"version": CORPUS_VERSION, "params": asdict(params), "documents": documents}, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    corpus = Corpus(corpus_dir)
+    print(
+        f"Корпус: {len(documents)} документов, {corpus.total('pages')} страниц "
+        f"(сканов {corpus.total('scanned_pages')}), {corpus.total_bytes / 1024 ** 2:.1f} МБ "
+        f"за {time.perf_counter() - started:.1f} сек -> {corpus_dir}"
+    )
+    return corpus
+
+
+class CorpusServer:
+    """Локальная заглушка publication.pravo.gov.ru над корпусом.
+
+    /api/Documents — постраничная выдача (PageSize, index) в формате API,
+    /file/pdf?eoNumber= — PDF с поддержкой Range. latency — задержка ответа (сек).
+    """
+
+    def __init__(self, corpus: Corpus, host="127.0.0.1", port=0, latency=0.0):
+        self.corpus = corpus
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stand_in = self
+        items = {item["eoNumber"]: item for item in self.corpus.items}
+        ordered = list(items.values())
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_body(self, body, content_type, status=200, headers=()):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.requests += 1
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == "/api/Documents":
+                    page_size = max(1, int(query.get("PageSize", 30)))
+                    index = max(1, int(query.get("index", 1)))
+                    payload = {
+                        "items": ordered[(index - 1) * page_size:index * page_size],
+                        "totalCount": len(ordered),
+                        "pageSize": page_size,
+                        "currentPage": index,
+                        "pagesTotalCount": max(1, -(-len(ordered) // page_size)),
+                    }
+                    self.send_body(json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+                elif url.path == "/file/pdf" and query.get("eoNumber") in items:
+                    data = (stand_in.corpus.dir / "pdf" / f"{query['eoNumber']}.pdf").read_bytes()
+                    match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+                    if match and int(match.group(1)) >= len(data):
+                        self.send_body(b"", "application/pdf", 416)
+                    elif match:
+                        offset = int(match.group(1))
+                        content_range = f"bytes {offset}-{len(data) - 1}/{len(data)}"
+                        self.send_body(data[offset:], "application/pdf", 206, [("Content-Range", content_range)])
+                    else:
+                        self.send_body(data, "application/pdf")
+                else:
+                    self.send_body(b"not found", "text/plain", 404)
+
+        return Handler
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Глушит stdout шагов (в том числе дочерних процессов), чтобы вывод не влиял на замер."""
+    if not enabled:
+        yield
+        return
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            with contextlib.redirect_stdout(devnull):
+                yield
+        finally:
+            os.dup2(saved, 1)
+            os.close(saved)
+
+
+def measure(run, repeat, setup=None):
+    """repeat раз: setup() вне замера, run(подготовленное) — с замером. Возвращает (последний результат, замеры)."""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        prepared = setup() if setup else None
+        cpu = time.process_time()
+        children_cpu = children_cpu_seconds()
+        wall = time.perf_counter()
+        result = run(prepared)
+        runs.append({
+            "wall_s": time.perf_counter() - wall,
+            "cpu_s": time.process_time() - cpu,
+            "cpu_children_s": children_cpu_seconds() - children_cpu,
+        })
+    return result, runs
+
+
+def summarize(runs, **counters):
+    """Медианы замеров, счётчики и скорости (как в run_metrics: pages_per_s, tokens_per_s, ...)."""
+    wall = statistics.median(run["wall_s"] for run in runs)
+    record = {
+        "wall_s": round(wall, 4),
+        "wall_min_s": round(min(run["wall_s"] for run in runs), 4),
+        "cpu_s": round(statistics.median(run["cpu_s"] for run in runs), 4),
+        "cpu_children_s": round(statistics.median(run["cpu_children_s"] for run in runs), 4),
+        "runs": [round(run["wall_s"], 4) for run in runs],
+        **counters,
+    }
+    for counter, rate in RATES.items():
+        if isinstance(counters.get(counter), (int, float)) and wall > 0:
+            record[rate] = round(counters[counter] / wall, 2)
+    return record
+
+
+def progressive_options(args):
+    """Настройки прогрессивного OCR из правил бенчмарка или None."""
+    if not args.progressive:
+        return None
+    from classifier_cli import load_rules
+    from progressive import progressive_settings
+
+    return progressive_settings(load_rules(args.rules))
+
+
+def ocr_unavailable(render="pdf2image"):
+    """Причина, по которой OCR не запустить, или None."""
+    from minepdf_cli import tesseract_version
+
+    if render == "pdf2image" and shutil.which("pdfinfo") is None:
+        return "не найден Poppler (pdfinfo)"
+    if tesseract_version() == "unknown":
+        return "не найден Tesseract"
+    return None
+
+
+def word_accuracy(corpus: Corpus, text_paths: dict):
+    """Доля слов эталонного текста, найденных в распознанном (по всем документам)."""
+    found = expected = 0
+    for document in corpus.documents:
+        truth = Counter(re.findall(r"\w+", corpus.text_path(document).read_text(encoding="utf-8").lower()))
+        path = text_paths.get(document["item"]["eoNumber"])
+        text = path.read_text(encoding="utf-8").lower() if path and path.exists() else ""
+        found += sum((truth & Counter(re.findall(r"\w+", text))).values())
+        expected += sum(truth.values())
+    return round(found / expected, 4) if expected else None
+
+
+def classification_accuracy(corpus: Corpus, summary_path):
+    """Доля документов с верным решением бюджетной фазы и число найденных строк таблиц."""
+    expected = {document["item"]["eoNumber"]: document for document in corpus.documents}
+    documents = json.loads(Path(summary_path).read_text(encoding="utf-8"))["documents"]
+    correct = sum(
+        1 for document in documents
+        if document.get("eoNumber") in expected and document["budget"] == expected[document["eoNumber"]]["budget"]
+    )
+    return {
+        "budget_accuracy": round(correct / len(expected), 4) if expected else None,
+        "table_rows": sum(document.get("table_rows", 0) for document in documents),
+        "expected_table_rows": corpus.total("table_rows"),
+    }
+
+
+def fresh_dir(path: Path) -> Path:
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+    return path
+
+
+def bench_download(corpus, work_dir, args):
+    from download_pdf_cli import download_documents
+
+    with CorpusServer(corpus, latency=args.latency_ms / 1000) as server:
+        def run(download_dir):
+            return download_documents(
+                DATE_FROM, DATE_TO, str(download_dir), page_size=args.page_size,
+                workers=args.download_workers, rate=args.download_rate, base_url=server.url,
+                triage=make_triage(args, download_dir / "triage.jsonl"),
+            )
+
+        download_dir = work_dir / "download"
+        (total, ok, failed), runs = measure(run, args.repeat, lambda: fresh_dir(download_dir))
+    return summarize(
+        runs, documents=ok, failed=failed, workers=args.download_workers,
+        bytes=sum(path.stat().st_size for path in download_dir.glob("*.pdf")),
+        **triage_counts(corpus, download_dir / "triage.jsonl"),
+    )
+
+
+def make_triage(args, log_path):
+    if args.triage == "off":
+        return None
+    from classifier_cli import load_rules
+    from triage import MetadataTriage
+
+    return MetadataTriage(load_rules(args.rules), args.triage, log_path)
+
+
+def triage_counts(corpus, log_path):
+    """Сколько документов отложено триажем и сколько из них бюджетных (по эталону корпуса)."""
+    if not log_path.exists():
+        return {}
+    from triage import read_decisions
+
+    decisions = read_decisions(log_path)
+    budget = {document["item"]["eoNumber"] for document in corpus.documents if document["budget"]}
+    irrelevant = [eo for eo, decision in decisions.items() if decision["decision"] == "irrelevant"]
+    return {
+        "triage_irrelevant": len(irrelevant),
+        "triage_deferred": sum(1 for decision in decisions.values() if decision["action"] == "deferred"),
+        "triage_recall": round(1 - len(budget & set(irrelevant)) / len(budget), 4) if budget else None,
+    }
+
+
+def bench_ocr(corpus, work_dir, args):
+    import minepdf_cli
+
+    render = minepdf_cli.resolve_render_backend(args.render_backend)
+    reason = ocr_unavailable(render)
+    if reason:
+        return {"skipped": reason}
+    options = minepdf_cli.OcrOptions(
+        dpi=args.dpi,
+        text_layer=not args.no_text_layer,
+        backend=minepdf_cli.resolve_ocr_backend(args.ocr_backend),
+        render=render,
+        adaptive_dpi=args.adaptive_dpi,
+        min_confidence=args.min_confidence,
+        progressive=progressive_options(args),
+    )
+
+    def run(output_dir):
+        if args.ocr_workers > 1:
+            return minepdf_cli.process_pdf_folder(str(corpus.dir / "pdf"), str(output_dir), options, args.ocr_workers)[0]
+        return sum(
+            minepdf_cli.ocr_pdf_to_text(str(corpus.pdf_path(document)), str(output_dir / f"{eo}.txt"), options)
+            for document in corpus.documents
+            for eo in [document["item"]["eoNumber"]]
+        )
+
+    output_dir = work_dir / "ocr"
+    ok, runs = measure(run, args.repeat, lambda: fresh_dir(output_dir))
+    extra = {}
+    if args.adaptive_dpi:
+        extra["rescanned_pages"] = sum(
+            json.loads(path.read_text(encoding="utf-8")).get("rescanned_pages", 0)
+            for path in output_dir.glob("*.ocr.json")
+        )
+    if args.progressive:
+        from progressive import progressive_summary
+
+        progress = progressive_summary(output_dir)
+        extra.update(stopped_documents=len(progress["stopped"]), skipped_pages=progress["skipped_pages"])
+    return summarize(
+        runs,
+        documents=ok,
+        pages=corpus.total("pages"),
+        scanned_pages=corpus.total("scanned_pages"),
+        word_accuracy=word_accuracy(corpus, {path.stem: path for path in output_dir.glob("*.txt")}),
+        dpi=args.dpi,
+        workers=args.ocr_workers,
+        **extra,
+    )
+
+
+def bench_normalize(corpus, work_dir, args, warm=False):
+    from morphy_cli import TextNormalizer
+
+    texts = [corpus.text_path(document).read_text(encoding="utf-8") for document in corpus.documents]
+
+    def setup():
+        # Загрузка словарей pymorphy3 — вне замера; warm — кэш лемм уже заполнен
+        normalizer = TextNormalizer()
+        if warm:
+            for text in texts:
+                normalizer.normalize_text(text)
+        return normalizer
+
+    def run(normalizer):
+        return sum(len(normalizer.normalize_text(text).split()) for text in texts)
+
+    tokens, runs = measure(run, args.repeat, setup)
+    return summarize(runs, documents=len(texts), tokens=tokens, input_bytes=sum(len(text.encode()) for text in texts))
+
+
+def bench_classify(corpus, work_dir, args):
+    from classifier_cli import DocumentFilter, load_rules
+    from morphy_cli import TextNormalizer
+
+    # Нормализованные эталонные тексты готовятся один раз, вне замера
+    normalized_dir = fresh_dir(work_dir / "classify_normalized")
+    normalizer = TextNormalizer()
+    for document in corpus.documents:
+        normalizer.normalize_file(corpus.text_path(document), normalized_dir / corpus.text_path(document).name)
+    rules = load_rules(args.rules)
+    manifest = {
+        document["item"]["eoNumber"]: {"eoNumber": document["item"]["eoNumber"], "pdf": corpus.pdf_path(document).name}
+        for document in corpus.documents
+    }
+    run_dir = work_dir / "classify"
+
+    def run(run_dir):
+        flt = DocumentFilter(
+            corpus.dir / "text",
+            normalized_dir,
+            run_dir / "бюджетные_документы",
+            rules=rules,
+            manifest=manifest,
+            link_mode=args.link_mode,
+            tables_csv=run_dir / "table_rows.csv",
+        )
+        return flt.process_documents()
+
+    _, runs = measure(run, args.repeat, lambda: fresh_dir(run_dir))
+    return summarize(
+        runs,
+        documents=len(corpus.documents),
+        **classification_accuracy(corpus, run_dir / "classification_summary.json"),
+    )
+
+
+def bench_end_to_end(corpus, work_dir, args):
+    """Все четыре шага подряд (или потоково с --streaming) над заглушкой API."""
+    import download_pdf_cli
+    import minepdf_cli
+    import morphy_cli
+    from classifier_cli import DocumentFilter, load_manifest, load_rules
+
+    reason = ocr_unavailable(minepdf_cli.resolve_render_backend(args.render_backend))
+    if reason:
+        return {"skipped": reason}
+
+    def week_paths(run_dir):
+        return {
+            "pdf": run_dir / "downloaded_documents",
+            "ocr": run_dir / "text_output_ocr",
+            "norm": run_dir / "text_output_ocr_normalized",
+            "budget": run_dir / "бюджетные_документы",
+            "cfo": run_dir / "документы_цфо",
+            "summary": run_dir / "classification_summary.json",
+            "manifest": run_dir / "manifest.json",
+            "tables": run_dir / "table_rows.csv",
+            "triage": run_dir / "triage.jsonl",
+        }
+
+    with CorpusServer(corpus, latency=args.latency_ms / 1000) as server:
+        def run(run_dir):
+            paths = week_paths(run_dir)
+            if args.streaming:
+                from stream_pipeline import run_streaming
+
+                logger = logging.getLogger("benchmark")
+                logger.addHandler(logging.NullHandler())
+                logger.propagate = args.verbose
+                stream_args = argparse.Namespace(
+                    rules=args.rules, regions=None, dpi=args.dpi, ocr_cache=False, ocr_cache_max_mb=0,
+                    link_mode=args.link_mode, extract_tables=True, page_size=args.page_size,
+                    download_workers=args.download_workers, download_rate=args.download_rate,
+                    ocr_workers=args.ocr_workers, morph_workers=args.morph_workers, base_url=server.url,
+                    triage=args.triage, ocr_backend=args.ocr_backend, render_backend=args.render_backend,
+                    adaptive_dpi=args.adaptive_dpi, min_confidence=args.min_confidence, progressive=args.progressive,
+                )
+                run_streaming(stream_args, DATE_FROM, DATE_TO, run_dir, paths, logger)
+                return
+            download_pdf_cli.download_documents(
+                DATE_FROM, DATE_TO, str(paths["pdf"]), page_size=args.page_size, workers=args.download_workers,
+                rate=args.download_rate, base_url=server.url, manifest_path=str(paths["manifest"]),
+                triage=make_triage(args, paths["triage"]),
+            )
+            ocr_options = minepdf_cli.OcrOptions(
+                dpi=args.dpi,
+                backend=minepdf_cli.resolve_ocr_backend(args.ocr_backend),
+                render=minepdf_cli.resolve_render_backend(args.render_backend),
+                adaptive_dpi=args.adaptive_dpi,
+                min_confidence=args.min_confidence,
+                progressive=progressive_options(args),
+            )
+            minepdf_cli.process_pdf_folder(str(paths["pdf"]), str(paths["ocr"]), ocr_options, args.ocr_workers)
+            normalizer = morphy_cli.TextNormalizer()
+            paths["norm"].mkdir(parents=True, exist_ok=True)
+            if args.morph_workers > 1:
+                morphy_cli.process_files_parallel(paths["ocr"], paths["norm"], normalizer, args.morph_workers)
+            else:
+                morphy_cli.process_files(paths["ocr"], paths["norm"], normalizer)
+            DocumentFilter(
+                paths["ocr"], paths["norm"], paths["budget"], paths["cfo"],
+                rules=load_rules(args.rules), summary_path=paths["summary"],
+                manifest=load_manifest(paths["manifest"]), link_mode=args.link_mode, tables_csv=paths["tables"],
+            ).process_documents()
+
+        run_dir = work_dir / "e2e"
+        _, runs = measure(run, args.repeat, lambda: fresh_dir(run_dir))
+    return summarize(
+        runs,
+        documents=len(corpus.documents),
+        pages=corpus.total("pages"),
+        bytes=corpus.total_bytes,
+        mode="streaming" if args.streaming else "sequential",
+        **classification_accuracy(corpus, run_dir / "classification_summary.json"),
+        **triage_counts(corpus, run_dir / "triage.jsonl"),
+    )
+
+
+def git_revision(base_dir):
+    """(хэш HEAD, есть ли незакоммиченные изменения) или (None, None) вне git."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=base_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=base_dir, capture_output=True, text=True, check=True,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def environment():
+    from minepdf_cli import tesseract_version
+
+    return {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "cpus": os.cpu_count(),
+        "tesseract": tesseract_version(),
+    }
+
+
+def corpus_params(args) -> CorpusParams:
+    return CorpusParams(
+        documents=args.documents,
+        min_pages=args.pages[0],
+        max_pages=args.pages[1],
+        scanned_share=args.scanned_share,
+        budget_share=args.budget_share,
+        table_rows=args.table_rows,
+        scan_dpi=args.scan_dpi,
+        seed=args.seed,
+    )
+
+
+def print_result(name, record):
+    if "skipped" in record:
+        print(f"{name:<16} пропущен: {record['skipped']}")
+        return
+    rates = ", ".join(f"{key} {value}" for key, value in record.items() if key.endswith("_per_s"))
+    extra = ", ".join(
+        f"{key} {record[key]}" for key in ("word_accuracy", "budget_accuracy", "triage_recall")
+        if record.get(key) is not None
+    )
+    print(f"{name:<16} {record['wall_s']:>9.3f} сек  {rates}{'  ' + extra if extra else ''}")
+
+
+def run_benchmarks(args, base_dir: Path):
+    only = [name.strip() for name in args.only.split(",")] if args.only else list(BENCHMARKS)
+    unknown = [name for name in only if name not in BENCHMARKS]
+    if unknown:
+        raise SystemExit(f"Неизвестные бенчмарки: {', '.join(unknown)} (есть: {', '.join(BENCHMARKS)})")
+
+    corpus = build_corpus(args.corpus_dir or base_dir / "benchmarks" / "corpus", corpus_params(args), args.font)
+    benches = {
+        "download": bench_download,
+        "ocr": bench_ocr,
+        "normalize": bench_normalize,
+        "normalize_warm": lambda corpus, work_dir, args: bench_normalize(corpus, work_dir, args, warm=True),
+        "classify": bench_classify,
+        "e2e": bench_end_to_end,
+    }
+    commit, dirty = git_revision(base_dir)
+    results = {
+        "schema": 1,
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "corpus": corpus.params,
+        "settings": {
+            key: getattr(args, key)
+            for key in (
+                "repeat", "page_size", "download_workers", "download_rate", "latency_ms", "dpi", "adaptive_dpi",
+                "min_confidence", "progressive",
+                "no_text_layer", "ocr_backend", "render_backend", "ocr_workers", "morph_workers", "link_mode",
+                "streaming", "rules", "triage",
+            )
+        },
+        "benchmarks": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="federal_mbt_bench_") as tmp:
+        work_dir = Path(args.work_dir) if args.work_dir else Path(tmp)
+        for name in only:
+            with quiet(not args.verbose):
+                try:
+                    record = benches[name](corpus, work_dir, args)
+                except Exception as e:
+                    record = {"error": f"{type(e).__name__}: {e}"}
+            results["benchmarks"][name] = record
+            if "error" in record:
+                print(f"{name:<16} ошибка: {record['error']}")
+            else:
+                print_result(name, record)
+
+    output = Path(args.output) if args.output else (
+        base_dir / "benchmarks" / f"{(commit or 'nogit')[:10]}{'-dirty' if dirty else ''}"
+                                  f"_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты: {output}")
+    return results
+
+
+def compare_results(old, new, threshold=5.0):
+    """Печатает изменения времени, скоростей и точности; возвращает список регрессий."""
+    print(f"Было:  {old.get('commit') or '?'}{' (dirty)' if old.get('dirty') else ''}  {old.get('created_at')}")
+    print(f"Стало: {new.get('commit') or '?'}{' (dirty)' if new.get('dirty') else ''}  {new.get('created_at')}")
+    if old.get("corpus") != new.get("corpus"):
+        print("Внимание: корпуса различаются, сравнение может быть некорректным")
+    if old.get("settings") != new.get("settings"):
+        print("Внимание: настройки запуска различаются")
+
+    regressions = []
+    print(f"\n{'бенчмарк':<16} {'метрика':<22} {'было':>12} {'стало':>12} {'изм.':>8}")
+    for name, new_record in new.get("benchmarks", {}).items():
+        old_record = old.get("benchmarks", {}).get(name)
+        if old_record is None:
+            continue
+        if any(key in record for record in (old_record, new_record) for key in ("skipped", "error")):
+            print(f"{name:<16} пропущен или с ошибкой в одном из запусков")
+            continue
+        for key, new_value in new_record.items():
+            old_value = old_record.get(key)
+            if key == "wall_s":
+                higher_is_better = False
+            elif key.endswith(("_per_s", "_accuracy", "_recall")):
+                higher_is_better = True
+            else:
+                continue
+            if not isinstance(old_value, (int, float)) or not isinstance(new_value, (int, float)) or not old_value:
+                continue
+            change = (new_value - old_value) / old_value * 100
+            worse = change < -threshold if higher_is_better else change > threshold
+            if worse:
+                regressions.append((name, key, change))
+            print(
+                f"{name:<16} {key:<22} {old_value:>12.3f} {new_value:>12.3f} {change:>+7.1f}%"
+                f"{'  ⚠ регрессия' if worse else ''}"
+            )
+    print(f"\nРегрессий (порог {threshold:.0f}%): {len(regressions)}")
+    return regressions
+
+
+def add_corpus_arguments(parser):
+    parser.add_argument("--corpus-dir", help="Папка корпуса (по умолчанию benchmarks/corpus)")
+    parser.add_argument("--documents", type=int, default=20, help="Число документов")
+    parser.add_argument("--pages", type=page_range, default=(2, 4), help="Страниц в документе: N или MIN-MAX")
+    parser.add_argument("--scanned-share", type=float, default=0.5, help="Доля документов-сканов (без текстового слоя)")
+    parser.add_argument("--budget-share", type=float, default=0.5, help="Доля бюджетных документов с таблицей распределения")
+    parser.add_argument("--table-rows", type=int, default=20, help="Строк в таблице распределения")
+    parser.add_argument("--scan-dpi", type=int, default=150, help="Разрешение сканов")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно генератора (тот же seed — тот же корпус)")
+    parser.add_argument("--font", help="TTF-шрифт с кириллицей для сканов")
+
+
+def main():
+    base_dir = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser(description="Бенчмарк шагов пайплайна на синтетическом корпусе")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    corpus_parser = commands.add_parser("corpus", help="Сгенерировать корпус")
+    add_corpus_arguments(corpus_parser)
+
+    serve_parser = commands.add_parser("serve", help="Заглушка API над корпусом (для pipeline.py --base-url)")
+    add_corpus_arguments(serve_parser)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument("--latency-ms", type=float, default=0, help="Задержка каждого ответа (мс)")
+
+    run_parser = commands.add_parser("run", help="Запустить бенчмарки")
+    add_corpus_arguments(run_parser)
+    run_parser.add_argument("--only", help=f"Через запятую: {','.join(BENCHMARKS)} (по умолчанию все)")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Повторов каждого замера (в результат — медиана)")
+    run_parser.add_argument("--output", help="Файл результатов (по умолчанию benchmarks/<коммит>_<время>.json)")
+    run_parser.add_argument("--work-dir", help="Рабочая папка (по умолчанию временная)")
+    run_parser.add_argument("--page-size", type=int, default=30, help="PageSize для API")
+    run_parser.add_argument("--download-workers", type=int, default=4)
+    run_parser.add_argument("--download-rate", type=float, default=1000.0, help="Лимит запросов в секунду")
+    run_parser.add_argument("--latency-ms", type=float, default=0, help="Задержка каждого ответа заглушки (мс)")
+    run_parser.add_argument("--dpi", type=int, default=300)
+    run_parser.add_argument("--adaptive-dpi", type=int, default=0, help="Первый проход OCR с этим DPI (0 — выкл.)")
+    run_parser.add_argument("--min-confidence", type=float, default=70.0)
+    run_parser.add_argument("--progressive", action="store_true", help="Прогрессивный OCR (см. progressive.py)")
+    run_parser.add_argument("--no-text-layer", action="store_true", help="Распознавать OCR и страницы с текстовым слоем")
+    run_parser.add_argument("--ocr-workers", type=int, default=1)
+    run_parser.add_argument("--ocr-backend", choices=["pytesseract", "tesserocr"], default="pytesseract")
+    run_parser.add_argument("--render-backend", choices=["pdf2image", "pymupdf"], default="pdf2image")
+    run_parser.add_argument("--morph-workers", type=int, default=1)
+    run_parser.add_argument("--link-mode", choices=["copy", "hardlink", "list"], default="copy")
+    run_parser.add_argument("--rules", help="JSON с правилами классификации")
+    run_parser.add_argument("--streaming", action="store_true", help="e2e в потоковом режиме пайплайна")
+    run_parser.add_argument(
+        "--triage", choices=["off", "log", "defer"], default="off", help="Триаж по метаданным в download и e2e"
+    )
+    run_parser.add_argument("--verbose", action="store_true", help="Не глушить вывод шагов")
+
+    compare_parser = commands.add_parser("compare", help="Сравнить два файла результатов")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=5.0, help="Порог регрессии, %%")
+    compare_parser.add_argument("--fail-on-regression", action="store_true", help="Код возврата 1 при регрессиях")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        old, new = (json.loads(Path(path).read_text(encoding="utf-8")) for path in (args.old, args.new))
+        regressions = compare_results(old, new, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+        return
+
+    if args.command == "run":
+        run_benchmarks(args, base_dir)
+        return
+
+    corpus = build_corpus(args.corpus_dir or base_dir / "benchmarks" / "corpus", corpus_params(args), args.font)
+    if args.command == "serve":
+        with CorpusServer(corpus, args.host, args.port, args.latency_ms / 1000) as server:
+            print(f"Заглушка API: {server.url} (документов: {len(corpus.documents)}), Ctrl+C — остановить")
+            print(f"  python pipeline.py --base-url {server.url} --date-from {DATE_FROM} --date-to {DATE_TO}")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+    main()
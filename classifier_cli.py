@@ -1,51 +1,314 @@
+import io
+import os
 import re
+import csv
+import json
 import shutil
+from datetime import datetime
 from pathlib import Path
+
+from run_metrics import StageMetrics
+from stage_state import StageState
 import argparse
 
 
+def _trie_regex(keywords) -> str:
+    """Собирает из слов регулярное выражение-префиксное дерево (без возвратов по альтернативам)."""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node) -> str:
+        is_end = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if is_end:
+            # Жадный необязательный хвост: из слов с общим началом берётся самое длинное
+            return "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Ищет все ключевые слова всех наборов правил за один проход по тексту.
+
+    Слова всех наборов собираются в одно префиксное дерево и компилируются
+    в регулярное выражение; опережающая проверка (?=...) находит самое
+    длинное слово, начинающееся в каждой позиции, поэтому пересекающиеся
+    вхождения не теряются. Более короткие слова, являющиеся началом
+    найденного, учитываются по заранее построенной таблице.
+    Сравнение без учёта регистра, как у `keyword.lower() in text.lower()`.
+    """
+
+    def __init__(self, rule_sets):
+        self.rule_sets = {name: list(keywords) for name, keywords in rule_sets.items()}
+        # слово в нижнем регистре -> [(набор, слово как в правилах)]
+        self.owners = {}
+        for name, keywords in self.rule_sets.items():
+            for keyword in keywords:
+                self.owners.setdefault(keyword.lower(), []).append((name, keyword))
+
+        words = sorted(self.owners)
+        # слово -> все слова-правила, которые являются его началом (включая его самого)
+        self.prefixes = {
+            word: [other for other in words if word.startswith(other)]
+            for word in words
+        }
+        self.pattern = re.compile("(?=(" + _trie_regex(words) + "))") if words else None
+
+    def scan(self, text: str):
+        """Возвращает {набор: {слово: [позиции вхождений]}} для всех наборов правил."""
+        matches = {name: {} for name in self.rule_sets}
+        if self.pattern is None:
+            return matches
+
+        for match in self.pattern.finditer(text.lower()):
+            found = match.group(1)
+            if not found:
+                continue
+            position = match.start()
+            for word in self.prefixes[found]:
+                for name, keyword in self.owners[word]:
+                    matches[name].setdefault(keyword, []).append(position)
+        return matches
+
+    @staticmethod
+    def counts(matches_for_set) -> dict:
+        return {keyword: len(positions) for keyword, positions in matches_for_set.items()}
+
+
+_matchers = {}
+
+
+def keyword_matcher(rule_sets) -> KeywordMatcher:
+    """KeywordMatcher для наборов слов; одинаковые наборы компилируются один раз за процесс."""
+    key = json.dumps(rule_sets, sort_keys=True, ensure_ascii=False)
+    matcher = _matchers.get(key)
+    if matcher is None:
+        matcher = _matchers[key] = KeywordMatcher(rule_sets)
+    return matcher
+
+
+BUDGET_KEYWORDS = [
+    "резервный фонд",
+    "бюджетный ассигнование",
+    "субсидия",
+    "межбюджетный трансферт",
+    "дотация",
+]
+
+CFO_KEYWORDS = [
+    "белгородский область",
+    "брянский область",
+    "владимирский область",
+    "воронежский область",
+    "ивановский область",
+    "калужский область",
+    "костромской область",
+    "курский область",
+    "липецкий область",
+    "московский область",
+    "орловский область",
+    "рязанский область",
+    "смоленский область",
+    "тамбовский область",
+    "тверской область",
+    "тульский область",
+    "ярославский область",
+    "г. москва",
+]
+
+# Правила по умолчанию (без --rules): бюджетная фаза + ЦФО
+DEFAULT_RULES = {
+    "version": "builtin",
+    "budget": {"output": "бюджетные_документы", "keywords": BUDGET_KEYWORDS},
+    "regions": {"ЦФО": {"output": "документы_цфо", "keywords": CFO_KEYWORDS}},
+}
+
+
+def load_rules(path=None) -> dict:
+    """Загружает наборы правил из JSON (см. classifier_rules.json) или возвращает правила по умолчанию.
+
+    Формат: {"version": str, "budget": {"output", "keywords"},
+    "regions": {<название>: {"output", "keywords"}}}. Необязательные секции:
+    "triage": {"irrelevant", "keep"} — слова для отбора по метаданным (см. triage.py),
+    "progressive": {"batch_pages", "stop_after_pages", "defer_qualified", "signal"} —
+    прогрессивный OCR (см. progressive.py).
+    """
+    if path is None:
+        return json.loads(json.dumps(DEFAULT_RULES))
+
+    rules = json.loads(Path(path).read_text(encoding="utf-8"))
+    budget = rules.get("budget")
+    if not isinstance(budget, dict) or not budget.get("keywords"):
+        raise ValueError(f"{path}: нет ключевых слов бюджетной фазы (budget.keywords)")
+    budget.setdefault("output", DEFAULT_RULES["budget"]["output"])
+
+    regions = rules.setdefault("regions", {})
+    for name, spec in regions.items():
+        if name == "budget":
+            raise ValueError(f"{path}: регион не может называться 'budget'")
+        if not spec.get("keywords") or not spec.get("output"):
+            raise ValueError(f"{path}: у региона {name} должны быть keywords и output")
+    rules.setdefault("version", Path(path).stem)
+    return rules
+
+
+def parse_amount(value: str):
+    """Число из ячейки суммы: «1 234 567,8» → 1234567.8; None, если не разобрать."""
+    value = re.sub(r"\s+", "", value).replace(",", ".").strip(".")
+    if value.count(".") > 1:
+        integer, _, fraction = value.rpartition(".")
+        value = integer.replace(".", "") + "." + fraction
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class TableScanner:
+    """Построчный разбор таблиц распределения «наименование субъекта / размер (тыс. руб.)».
+
+    Заголовки ищутся в пределах строки, как и в прежних регулярных
+    выражениях; строка таблицы — текст и число в конце строки.
+    has_table останавливается, как только набрано достаточно признаков.
+    """
+
+    SUBJECT_TITLE_RE = re.compile(r"наименование.*субъекта", re.IGNORECASE)
+    SUM_TITLE_RE = re.compile(r"(размер|сумма|тыс.*руб)", re.IGNORECASE)
+    ROW_RE = re.compile(r"^(.*?)\s+(\d[\d\s,.]*?)\s*$")
+    LETTER_RE = re.compile(r"[^\W\d_]")
+    TOTAL_RE = re.compile(r"^(итого|всего)\b", re.IGNORECASE)
+
+    def __init__(self, min_rows: int = 4):
+        self.min_rows = min_rows
+
+    def has_table(self, text: str) -> bool:
+        has_subject_title = False
+        has_sum_title = False
+        rows = 0
+        for line in io.StringIO(text):
+            line = line.rstrip("\n")
+            if not has_subject_title and self.SUBJECT_TITLE_RE.search(line):
+                has_subject_title = True
+            if not has_sum_title and self.SUM_TITLE_RE.search(line):
+                has_sum_title = True
+            if rows < self.min_rows and self.ROW_RE.match(line):
+                rows += 1
+            if has_subject_title and has_sum_title and rows >= self.min_rows:
+                return True
+        return False
+
+    def extract_rows(self, text: str):
+        """Строки (субъект, сумма) из таблиц, начинающихся с заголовка «наименование … субъекта»."""
+        rows = []
+        in_table = False
+        for line in io.StringIO(text):
+            line = line.rstrip("\n")
+            if self.SUBJECT_TITLE_RE.search(line):
+                in_table = True
+                continue
+            if not in_table or line.startswith("--- Страница "):
+                continue
+            match = self.ROW_RE.match(line)
+            if not match:
+                continue
+            subject = match.group(1).strip(" \t.:;|-–—")
+            amount = parse_amount(match.group(2))
+            if amount is None or not self.LETTER_RE.search(subject) or self.TOTAL_RE.match(subject):
+                continue
+            rows.append((subject, amount))
+        return rows
+
+
+def classification_params(rules, regions=None, tables=False) -> dict:
+    """От чего зависит результат классификации (для инкрементальных перезапусков)."""
+    return {
+        "rules": rules,
+        "regions": sorted(regions) if regions else sorted(rules["regions"]),
+        "tables": bool(tables),
+    }
+
+
+def load_manifest(path) -> dict:
+    """Читает манифест запуска (download_pdf_cli --manifest): {имя без расширения: запись}."""
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return {Path(entry["pdf"]).stem: entry for entry in data.get("documents", [])}
+
+
 class DocumentFilter:
-    def __init__(self, source_folder, normalized_folder, output_budget, output_cfo):
+    def __init__(
+        self,
+        source_folder,
+        normalized_folder,
+        output_budget,
+        output_cfo=None,
+        rules=None,
+        regions=None,
+        summary_path=None,
+        manifest=None,
+        link_mode="copy",
+        tables_csv=None,
+        state=None,
+        metrics=None,
+    ):
+        """rules — наборы правил (см. load_rules); regions — ограничить список регионов.
+
+        Папки регионов из правил создаются рядом с output_budget; output_cfo
+        (если задан) переопределяет папку ЦФО. Сводка по документам пишется в
+        summary_path (по умолчанию classification_summary.json рядом с output_budget).
+        manifest — {имя файла без расширения: запись манифеста}, даёт eoNumber документов.
+        link_mode — как раскладывать отобранные файлы: copy, hardlink или list
+        (только список путей files.txt в папке результата).
+        tables_csv — извлекать строки таблиц распределения из исходных txt
+        бюджетных документов в этот CSV (итоги по регионам — в *_totals.csv).
+        state — StageState: для файлов без изменений берётся прошлый результат.
+        metrics — StageMetrics: итоги классификации добавляются в счётчики шага.
+        """
         self.source_folder = Path(source_folder)
         self.normalized_folder = Path(normalized_folder)
         self.output_budget = Path(output_budget)
-        self.output_cfo = Path(output_cfo)
-
-        self.keywords_phase1 = [
-            "резервный фонд",
-            "бюджетный ассигнование",
-            "субсидия",
-            "межбюджетный трансферт",
-            "дотация",
-        ]
-
-        self.subject_pattern = re.compile(r"^(.*?)\s+(\d+[\d\s,.]*)\s*$", re.MULTILINE)
-        self.subject_title_pattern = re.compile(r"наименование.*субъекта", re.IGNORECASE)
-        self.sum_title_pattern = re.compile(r"(размер|сумма|тыс.*руб)", re.IGNORECASE)
-
-        self.cfo_keywords = [
-            "белгородский область",
-            "брянский область",
-            "владимирский область",
-            "воронежский область",
-            "ивановский область",
-            "калужский область",
-            "костромской область",
-            "курский область",
-            "липецкий область",
-            "московский область",
-            "орловский область",
-            "рязанский область",
-            "смоленский область",
-            "тамбовский область",
-            "тверской область",
-            "тульский область",
-            "ярославский область",
-            "г. москва",
-        ]
+        output_root = self.output_budget.parent
+
+        self.rules = rules or load_rules()
+        self.keywords_phase1 = self.rules["budget"]["keywords"]
+        self.regions = {
+            name: spec
+            for name, spec in self.rules["regions"].items()
+            if regions is None or name in regions
+        }
+        self.region_outputs = {name: output_root / spec["output"] for name, spec in self.regions.items()}
+        if output_cfo is not None and "ЦФО" in self.region_outputs:
+            self.region_outputs["ЦФО"] = Path(output_cfo)
+        self.output_cfo = self.region_outputs.get("ЦФО")
+        self.cfo_keywords = self.regions.get("ЦФО", {}).get("keywords", [])
+        self.summary_path = Path(summary_path) if summary_path else output_root / "classification_summary.json"
+        self.manifest = manifest or {}
+        self.link_mode = link_mode
+        # Индекс исходных txt по имени, строится один раз на запуск
+        self.source_index = {path.stem: path for path in self.source_folder.glob("*.txt")}
+
+        self.state = state
+        self.metrics = metrics
+        self.table_scanner = TableScanner()
+        self.tables_csv = Path(tables_csv) if tables_csv else None
+        self._normalizer = None
+
+        # Один автомат на весь запуск для всех наборов ключевых слов
+        self.matcher = keyword_matcher({
+            "budget": self.keywords_phase1,
+            **{name: spec["keywords"] for name, spec in self.regions.items()},
+        })
 
         self.output_budget.mkdir(exist_ok=True)
-        self.output_cfo.mkdir(exist_ok=True)
+        for output in self.region_outputs.values():
+            output.mkdir(exist_ok=True)
 
     def read_file_content(self, file_path: Path) -> str:
         encodings = ["utf-8", "cp1251", "iso-8859-1"]
@@ -63,70 +326,288 @@ class DocumentFilter:
         return any(keyword.lower() in text_lower for keyword in keywords)
 
     def contains_table_data(self, text: str) -> bool:
-        has_subject_title = bool(self.subject_title_pattern.search(text))
-        has_sum_title = bool(self.sum_title_pattern.search(text))
-        table_lines = self.subject_pattern.findall(text)
-        return (has_subject_title and has_sum_title and len(table_lines) > 3)
+        return self.table_scanner.has_table(text)
+
+    def subject_region(self, subject: str):
+        """Регион (по правилам) для названия субъекта из таблицы или None."""
+        if self._normalizer is None:
+            # Ключевые слова регионов записаны леммами — названия из OCR приводим так же
+            from morphy_cli import TextNormalizer
+            self._normalizer = TextNormalizer()
+        matches = self.matcher.scan(self._normalizer.normalize_text(subject))
+        for name in self.regions:
+            if matches[name]:
+                return name
+        return None
+
+    def extract_table_rows(self, source_file: Path, entry: dict):
+        rows = []
+        for number, (subject, amount) in enumerate(
+            self.table_scanner.extract_rows(self.read_file_content(source_file)), 1
+        ):
+            rows.append({
+                "document": source_file.name,
+                "eoNumber": entry.get("eoNumber"),
+                "row": number,
+                "subject": subject,
+                "amount": amount,
+                "region": self.subject_region(subject),
+            })
+        return rows
+
+    def write_tables(self, rows):
+        """Строки таблиц в tables_csv и суммы по регионам в <tables_csv>_totals.csv."""
+        self.tables_csv.parent.mkdir(parents=True, exist_ok=True)
+        fields = ["document", "eoNumber", "row", "subject", "amount", "region"]
+        with open(self.tables_csv, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, delimiter=";")
+            writer.writeheader()
+            writer.writerows(rows)
+
+        totals = {}
+        for row in rows:
+            region = row["region"] or "—"
+            total = totals.setdefault(region, {"documents": set(), "rows": 0, "amount": 0.0})
+            total["documents"].add(row["document"])
+            total["rows"] += 1
+            total["amount"] += row["amount"]
+
+        totals_path = self.tables_csv.with_name(f"{self.tables_csv.stem}_totals.csv")
+        with open(totals_path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f, delimiter=";")
+            writer.writerow(["region", "documents", "rows", "amount"])
+            for region, total in sorted(totals.items()):
+                writer.writerow([region, len(total["documents"]), total["rows"], round(total["amount"], 3)])
+        return totals_path
+
+    def classify_text(self, content: str) -> dict:
+        """Один проход по тексту: бюджетная фаза и все регионы сразу.
+
+        Регионы учитываются только для бюджетных документов.
+        """
+        matches = self.matcher.scan(content)
+        has_table = self.contains_table_data(content)
+        budget = bool(matches["budget"]) or has_table
+        return {
+            "budget": budget,
+            "table": has_table,
+            "regions": [name for name in self.regions if budget and matches[name]],
+            "matches": matches,
+        }
 
     def phase1_filter(self, file_path: Path) -> bool:
-        content = self.read_file_content(file_path)
-        return self.contains_keywords(content, self.keywords_phase1) or self.contains_table_data(content)
+        return self.classify_text(self.read_file_content(file_path))["budget"]
 
     def phase2_filter(self, file_path: Path) -> bool:
-        content = self.read_file_content(file_path)
-        return self.contains_keywords(content, self.cfo_keywords)
+        return "ЦФО" in self.classify_text(self.read_file_content(file_path))["regions"]
 
     def find_matching_source_file(self, normalized_file: Path):
-        file_stem = normalized_file.stem
-        for source_file in self.source_folder.glob("*.txt"):
-            if file_stem in source_file.stem or source_file.stem in file_stem:
-                return source_file
-        return None
+        """Исходный txt с тем же именем, что и нормализованный (поиск по индексу)."""
+        return self.source_index.get(normalized_file.stem)
 
-    def process_documents(self):
-        budget_docs = []
-        cfo_docs = []
+    def classify_document(self, normalized_file: Path, source_file=None, entry=None):
+        """Классифицирует один нормализованный файл.
 
-        for normalized_file in self.normalized_folder.glob("*.txt"):
-            print(f"Обработка файла: {normalized_file.name}")
+        source_file — исходный txt (по умолчанию ищется по индексу), entry — запись
+        манифеста (по умолчанию из self.manifest). Возвращает (запись сводки, строки таблиц).
+        """
+        if entry is None:
+            entry = self.manifest.get(normalized_file.stem, {})
+
+        inputs = [normalized_file]
+        if self.tables_csv:
+            # Строки таблиц берутся из исходного txt — он тоже вход документа
+            indexed_source = source_file or self.find_matching_source_file(normalized_file)
+            if indexed_source:
+                inputs.append(indexed_source)
+        if self.state is not None and self.state.skip(normalized_file.stem, inputs, None):
+            previous = self.state.get(normalized_file.stem)
+            document = dict(previous["document"], eoNumber=entry.get("eoNumber"), pdf=entry.get("pdf"))
+            return document, previous["rows"]
+
+        print(f"Обработка файла: {normalized_file.name}")
 
-            if self.phase1_filter(normalized_file):
-                source_file = self.find_matching_source_file(normalized_file)
-                if source_file:
-                    budget_docs.append(source_file)
-                    if self.phase2_filter(normalized_file):
-                        cfo_docs.append(source_file)
+        result = self.classify_text(self.read_file_content(normalized_file))
+        found = {
+            keyword: count
+            for matches_for_set in result["matches"].values()
+            for keyword, count in self.matcher.counts(matches_for_set).items()
+        }
+        if found:
+            print("  Найдено: " + ", ".join(f"{keyword} ×{count}" for keyword, count in found.items()))
+
+        if not result["budget"]:
+            source_file = None
+        elif source_file is None:
+            source_file = self.find_matching_source_file(normalized_file)
+
+        rows = []
+        if self.tables_csv and source_file:
+            rows = self.extract_table_rows(source_file, entry)
+        document = {
+            "eoNumber": entry.get("eoNumber"),
+            "pdf": entry.get("pdf"),
+            "document": normalized_file.name,
+            "source": source_file.name if source_file else None,
+            "budget": result["budget"],
+            "table": result["table"],
+            "regions": result["regions"],
+            "table_rows": len(rows),
+            "keywords": {
+                name: self.matcher.counts(matches_for_set)
+                for name, matches_for_set in result["matches"].items()
+                if matches_for_set
+            },
+        }
+        if self.state is not None:
+            self.state.record(normalized_file.stem, inputs, document=document, rows=rows)
+        return document, rows
+
+    def finish(self, summary, table_rows):
+        """Раскладывает отобранные документы по папкам, пишет сводку и таблицы.
+
+        Возвращает (число бюджетных документов, {регион: число документов}).
+        """
+        summary = sorted(summary, key=lambda document: document["document"])
+        budget_docs = []
+        region_docs = {name: [] for name in self.regions}
+        for document in summary:
+            if document["budget"] and document["source"]:
+                source_file = self.source_folder / document["source"]
+                budget_docs.append(source_file)
+                for name in document["regions"]:
+                    region_docs[name].append(source_file)
 
         self.copy_files(budget_docs, self.output_budget)
-        self.copy_files(cfo_docs, self.output_cfo)
+        for name, docs in region_docs.items():
+            self.copy_files(docs, self.region_outputs[name])
+        self.write_summary(summary, budget_docs, region_docs)
+        if self.tables_csv:
+            totals_path = self.write_tables(table_rows)
+            print(f"Строк таблиц распределения: {len(table_rows)} -> {self.tables_csv}, итоги: {totals_path}")
 
         print("\nРезультаты обработки:")
         print(f"Найдено бюджетных документов: {len(budget_docs)}")
-        print(f"Найдено документов ЦФО: {len(cfo_docs)}")
+        for name, docs in region_docs.items():
+            print(f"Найдено документов {name}: {len(docs)}")
         print(f"Скопировано в {self.output_budget}: {len(budget_docs)}")
-        print(f"Скопировано в {self.output_cfo}: {len(cfo_docs)}")
+        for name, docs in region_docs.items():
+            print(f"Скопировано в {self.region_outputs[name]}: {len(docs)}")
+        print(f"Сводка: {self.summary_path}")
+        if self.state is not None:
+            self.state.save()
+            print(f"Без изменений (результат из прошлого запуска): {self.state.skipped}")
+        if self.metrics is not None:
+            self.metrics.add(
+                documents=len(summary),
+                budget=len(budget_docs),
+                table_rows=len(table_rows),
+                skipped=self.state.skipped if self.state is not None else 0,
+            )
+            self.metrics.counters["regions"] = {name: len(docs) for name, docs in region_docs.items()}
 
-        return len(budget_docs), len(cfo_docs)
+        return len(budget_docs), {name: len(docs) for name, docs in region_docs.items()}
+
+    def process_documents(self):
+        """Классифицирует все нормализованные файлы за один проход.
+
+        Возвращает (число бюджетных документов, {регион: число документов}).
+        """
+        summary = []
+        table_rows = []
+        for normalized_file in self.normalized_folder.glob("*.txt"):
+            document, rows = self.classify_document(normalized_file)
+            summary.append(document)
+            table_rows.extend(rows)
+        return self.finish(summary, table_rows)
+
+    def write_summary(self, documents, budget_docs, region_docs):
+        payload = {
+            "rules_version": self.rules.get("version"),
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "totals": {
+                "documents": len(documents),
+                "budget": len(budget_docs),
+                "regions": {name: len(docs) for name, docs in region_docs.items()},
+            },
+            "documents": documents,
+        }
+        self.summary_path.parent.mkdir(parents=True, exist_ok=True)
+        self.summary_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
 
     def copy_files(self, files, destination_folder: Path):
+        if self.link_mode == "list":
+            listing = destination_folder / "files.txt"
+            listing.write_text("".join(f"{file_path.resolve()}\n" for file_path in files), encoding="utf-8")
+            return
+
         for file_path in files:
+            target = destination_folder / file_path.name
             try:
-                shutil.copy2(file_path, destination_folder / file_path.name)
+                if self.link_mode == "hardlink":
+                    if target.exists():
+                        target.unlink()
+                    try:
+                        os.link(file_path, target)
+                        continue
+                    except OSError:
+                        pass
+                shutil.copy2(file_path, target)
             except Exception as e:
                 print(f"Ошибка при копировании {file_path.name}: {e}")
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Фильтрация/классификация документов по ключевым словам")
     parser.add_argument("--source-folder", default="text_output_ocr", help="Папка с исходными txt (OCR)")
     parser.add_argument("--normalized-folder", default="text_output_ocr_normalized", help="Папка с нормализованными txt")
     parser.add_argument("--output-budget", default="бюджетные_документы", help="Выходная папка для бюджетных документов")
-    parser.add_argument("--output-cfo", default="документы_цфо", help="Выходная папка для документов ЦФО")
-    args = parser.parse_args()
+    parser.add_argument("--output-cfo", help="Выходная папка для документов ЦФО (по умолчанию из правил)")
+    parser.add_argument("--rules", help="JSON с наборами правил (по умолчанию встроенные: бюджет + ЦФО)")
+    parser.add_argument("--regions", help="Через запятую: какие регионы из правил проверять (по умолчанию все)")
+    parser.add_argument("--summary", help="Куда записать JSON-сводку по документам")
+    parser.add_argument("--manifest", help="Манифест запуска от download_pdf_cli (eoNumber → PDF)")
+    parser.add_argument(
+        "--link-mode", choices=["copy", "hardlink", "list"], default="copy",
+        help="Как раскладывать отобранные файлы: копия, жёсткая ссылка или только список files.txt",
+    )
+    parser.add_argument("--tables-csv", help="Извлечь строки таблиц распределения (субъект, сумма) в CSV")
+    parser.add_argument("--state-dir", help="Папка состояния шагов: не перечитывать документы без изменений")
+    parser.add_argument("--force", action="store_true", help="Классифицировать все документы заново")
+    parser.add_argument("--metrics-file", help="JSONL-файл метрик шага (см. run_metrics)")
+    args = parser.parse_args(argv)
+
+    rules = load_rules(args.rules)
+    regions = [name.strip() for name in args.regions.split(",")] if args.regions else None
+    if regions:
+        unknown = [name for name in regions if name not in rules["regions"]]
+        if unknown:
+            parser.error(f"регионов нет в правилах: {', '.join(unknown)}")
 
-    flt = DocumentFilter(args.source_folder, args.normalized_folder, args.output_budget, args.output_cfo)
+    state = None
+    if args.state_dir:
+        params = classification_params(rules, regions, args.tables_csv)
+        state = StageState(args.state_dir, "classify", params, args.force)
+
+    flt = DocumentFilter(
+        args.source_folder,
+        args.normalized_folder,
+        args.output_budget,
+        args.output_cfo,
+        rules=rules,
+        regions=regions,
+        summary_path=args.summary,
+        manifest=load_manifest(args.manifest) if args.manifest and Path(args.manifest).exists() else None,
+        link_mode=args.link_mode,
+        tables_csv=args.tables_csv,
+        state=state,
+        metrics=StageMetrics(args.metrics_file, "classify"),
+    )
     flt.process_documents()
+    flt.metrics.finish()
 
 
 if __name__ == "__main__":
-    main()
+    from daemon_cli import run_cli
+
+    run_cli(__file__, main)
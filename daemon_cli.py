@@ -0,0 +1,383 @@
+"""Резидентный демон пайплайна: тёплые MorphAnalyzer, правила классификации и пулы OCR.
+
+`python daemon_cli.py serve` запускает демон на Unix-сокете (по умолчанию
+daemon.sock рядом со скриптами). Пока он работает, pipeline.py и *_cli.py
+отправляют шаги ему: main(argv) нужного CLI выполняется в демоне, вывод
+возвращается клиенту через сокет. Задания выполняются по одному (у шагов
+общие глобальные состояния модулей), остальные ждут очереди. Пулы процессов
+создаются через forkserver, а не fork из многопоточного демона. Если демон не
+запущен, код изменился после его старта, у клиента другая рабочая папка или
+скрипт шага не из папки демона (другая копия проекта), шаг выполняется как
+обычно, в своём процессе.
+
+Протокол — JSON построчно. Запрос: {"script": абсолютный путь к *_cli.py, "argv", "cwd"}
+или {"op": "status"|"stop"}.
+Ответы: {"out": текст} ... {"exit": код}, либо {"rejected": причина} — задание не принято.
+"""
+import argparse
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_SOCKET = BASE_DIR / "daemon.sock"
+# Шаги, которые выполняет демон
+SCRIPTS = ("download_pdf_cli", "minepdf_cli", "morphy_cli", "classifier_cli")
+# FEDERAL_MBT_DAEMON=off — не обращаться к демону; FEDERAL_MBT_SOCKET — путь к сокету
+DISABLE_ENV = "FEDERAL_MBT_DAEMON"
+SOCKET_ENV = "FEDERAL_MBT_SOCKET"
+
+
+def socket_path(path=None) -> Path:
+    return Path(path or os.environ.get(SOCKET_ENV) or DEFAULT_SOCKET)
+
+
+def request(message, on_output=None, path=None):
+    """Отправляет запрос демону и возвращает последний ответ; None — демон не запущен.
+
+    on_output(текст) получает вывод задания по мере поступления.
+    """
+    path = socket_path(path)
+    if os.environ.get(DISABLE_ENV) == "off" or not path.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        sock.sendall(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        for line in sock.makefile("rb"):
+            reply = json.loads(line)
+            if "out" not in reply:
+                return reply
+            if on_output is not None:
+                on_output(reply["out"])
+    # Демон завершился посреди задания — повторять его локально нельзя
+    return {"exit": 1, "error": "демон закрыл соединение"}
+
+
+def submit(script, argv, on_output=None, path=None):
+    """Выполняет main(argv) скрипта шага (путь к *_cli.py) в демоне.
+
+    Возвращает код возврата или None — выполнить в своём процессе.
+    """
+    message = {"script": str(Path(script).resolve()), "argv": list(argv), "cwd": os.getcwd()}
+    reply = request(message, on_output, path)
+    if reply is None:
+        return None
+    if "rejected" in reply:
+        print(f"Демон не принял задание ({reply['rejected']}), выполняю в этом процессе", file=sys.stderr)
+        return None
+    if "error" in reply:
+        print(f"Ошибка демона: {reply['error']}", file=sys.stderr)
+    return reply["exit"]
+
+
+def _write_through(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def run_cli(script, main):
+    """Точка входа *_cli.py (script — его __file__): через демон, если он запущен, иначе main() в этом процессе."""
+    code = submit(script, sys.argv[1:], _write_through)
+    if code is None:
+        main()
+    elif code:
+        sys.exit(code)
+
+
+class JobOutput:
+    """Вывод одного задания: каждая запись уходит клиенту строкой JSON."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+        self.connected = True
+
+    def send(self, message):
+        if not self.connected:
+            return
+        data = json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+        try:
+            with self.lock:
+                self.connection.sendall(data)
+        except OSError:
+            # Клиент отключился — задание всё равно доводится до конца
+            self.connected = False
+
+    def write(self, text):
+        if text:
+            self.send({"out": text})
+
+
+class OutputRouter(io.TextIOBase):
+    """sys.stdout/sys.stderr демона: пока выполняется задание, весь вывод —
+    его клиенту (в том числе из потоков, которые задание запустило само)."""
+
+    def __init__(self, daemon, fallback):
+        self.daemon = daemon
+        self.fallback = fallback
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        output = self.daemon.output
+        if output is None:
+            self.fallback.write(text)
+        else:
+            output.write(text)
+        return len(text)
+
+    def flush(self):
+        if self.daemon.output is None:
+            self.fallback.flush()
+
+
+class PipelineDaemon:
+    """Загруженные модули шагов и тёплое состояние, общее для всех заданий."""
+
+    def __init__(self, rules_paths=()):
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        # Задания выполняются по одному: output — вывод текущего задания
+        self.job_lock = threading.Lock()
+        self.output = None
+        self.waiting = 0
+        self.completed = 0
+        self.counters_lock = threading.Lock()
+        self.modules = {script: importlib.import_module(script) for script in SCRIPTS}
+        self.warm_up(rules_paths)
+        # Файлы проекта, загруженные в демон: если какой-то изменился, задания
+        # не принимаются (иначе выполнялся бы старый код)
+        self.sources = {
+            path: os.stat(path).st_mtime_ns
+            for path in (getattr(module, "__file__", None) for module in list(sys.modules.values()))
+            if path and Path(path).resolve().parent == BASE_DIR
+        }
+
+    def warm_up(self, rules_paths):
+        import classifier_cli
+        import minepdf_cli
+        import morphy_cli
+        # Загружаются заранее, чтобы их файлы тоже проверялись на изменения
+        import progressive  # noqa: F401
+        import triage  # noqa: F401
+
+        morphy_cli.morph_analyzer()
+        for path in [None, *rules_paths]:
+            rules = classifier_cli.load_rules(path)
+            classifier_cli.keyword_matcher({
+                "budget": rules["budget"]["keywords"],
+                **{name: spec["keywords"] for name, spec in rules["regions"].items()},
+            })
+        minepdf_cli.keep_ocr_pools()
+
+    def rejection(self, message):
+        """Причина, по которой задание нельзя выполнить в демоне, или None."""
+        script = Path(message.get("script") or "")
+        if script.stem not in self.modules:
+            return f"неизвестный шаг: {script.name}"
+        # Демон выполняет только свои копии шагов, а не одноимённые из другой папки
+        if script.parent != BASE_DIR:
+            return f"{script} не из папки демона {BASE_DIR}"
+        if message.get("cwd") != os.getcwd():
+            return f"другая рабочая папка, демон запущен в {os.getcwd()}"
+        for path, mtime in self.sources.items():
+            try:
+                changed = os.stat(path).st_mtime_ns != mtime
+            except FileNotFoundError:
+                changed = True
+            if changed:
+                return f"{Path(path).name} изменился после запуска демона — перезапустите его"
+        return None
+
+    @contextmanager
+    def job(self, output):
+        """Ждёт очереди и делает output выводом демона на время задания."""
+        if not self.job_lock.acquire(blocking=False):
+            output.write("Демон выполняет другое задание, ожидаю очереди\n")
+            with self.counters_lock:
+                self.waiting += 1
+            self.job_lock.acquire()
+            with self.counters_lock:
+                self.waiting -= 1
+        self.output = output
+        try:
+            yield
+        finally:
+            self.output = None
+            with self.counters_lock:
+                self.completed += 1
+            self.job_lock.release()
+
+    def run(self, script, argv, output):
+        with self.job(output):
+            # sys.argv[0] — имя шага в справке и сообщениях argparse
+            saved_argv, sys.argv = sys.argv, [f"{script}.py", *argv]
+            try:
+                self.modules[script].main(argv)
+                code = 0
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    code = e.code or 0
+                else:
+                    print(e.code, file=sys.stderr)
+                    code = 1
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.argv = saved_argv
+        return code
+
+    def status(self):
+        with self.counters_lock:
+            return {
+                "pid": os.getpid(),
+                "started_at": self.started_at,
+                "cwd": os.getcwd(),
+                "running": int(self.output is not None),
+                "waiting": self.waiting,
+                "completed": self.completed,
+            }
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        daemon = self.server.daemon
+        output = JobOutput(self.connection)
+
+        if message.get("op") == "status":
+            output.send(daemon.status())
+            return
+        if message.get("op") == "stop":
+            output.send({"stopping": True})
+            # shutdown() ждёт выхода из serve_forever — только из другого потока
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+
+        reason = daemon.rejection(message)
+        if reason:
+            output.send({"rejected": reason})
+            return
+        started = datetime.now()
+        script = Path(message["script"]).stem
+        code = daemon.run(script, message["argv"], output)
+        print(f"{started:%H:%M:%S} {script} {' '.join(message['argv'])} -> {code}", file=sys.__stdout__)
+        output.send({"exit": code})
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Потоки заданий не фоновые: при остановке server_close дожидается текущих заданий
+    daemon_threads = False
+
+
+def serve(path, rules_paths=()):
+    path = socket_path(path)
+    if path.exists():
+        if request({"op": "status"}, path=path) is not None:
+            raise SystemExit(f"Демон уже запущен: {path}")
+        path.unlink()  # сокет от упавшего демона
+
+    # Рабочие процессы пулов OCR и нормализации не форкаются от многопоточного
+    # демона (fork копирует захваченные другими потоками блокировки), а
+    # порождаются однопоточным forkserver с заранее загруженными модулями шагов
+    multiprocessing.set_start_method("forkserver")
+    multiprocessing.set_forkserver_preload(list(SCRIPTS))
+
+    print("Загрузка модулей и словарей...")
+    daemon = PipelineDaemon(rules_paths)
+    sys.stdout = OutputRouter(daemon, sys.__stdout__)
+    sys.stderr = OutputRouter(daemon, sys.__stderr__)
+
+    import minepdf_cli
+
+    # Сокет создаётся сразу с правами 0600: chmod после bind оставлял бы окно,
+    # в которое задание мог бы отправить другой пользователь
+    old_umask = os.umask(0o177)
+    try:
+        server = DaemonServer(str(path), JobHandler)
+    finally:
+        os.umask(old_umask)
+
+    with server:
+        server.daemon = daemon
+        print(f"Демон запущен: {path} (pid {os.getpid()}, папка {os.getcwd()})", file=sys.__stdout__)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            minepdf_cli.shutdown_ocr_pools()
+            path.unlink(missing_ok=True)
+    print("Демон остановлен", file=sys.__stdout__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резидентный демон шагов пайплайна")
+    parser.add_argument("--socket", help=f"Путь к Unix-сокету (по умолчанию ${SOCKET_ENV} или {DEFAULT_SOCKET.name})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Запустить демон (в текущей рабочей папке)")
+    serve_parser.add_argument(
+        "--rules", action="append", default=[],
+        help="JSON правил, автоматы ключевых слов которых скомпилировать заранее (можно несколько)",
+    )
+    subparsers.add_parser("status", help="Состояние демона")
+    subparsers.add_parser("stop", help="Остановить демон (после текущих заданий)")
+    run_parser = subparsers.add_parser("run", help="Выполнить шаг через демон: run morphy_cli.py [аргументы]")
+    run_parser.add_argument("script", help="Имя шага: " + ", ".join(f"{script}.py" for script in SCRIPTS))
+    run_parser.add_argument("argv", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.socket, args.rules)
+        return
+
+    if args.command == "run":
+        # Путь к скрипту шага; просто имя — шаг из папки демона
+        script = Path(args.script) if Path(args.script).exists() else BASE_DIR / Path(args.script).name
+        if script.stem not in SCRIPTS:
+            raise SystemExit(f"Неизвестный шаг: {args.script}")
+        code = submit(script, args.argv, _write_through, args.socket)
+        if code is None:
+            # Демон не выполнил шаг — тот же скрипт в этом процессе
+            if script.resolve().parent == BASE_DIR:
+                importlib.import_module(script.stem).main(args.argv)
+                sys.exit(0)
+            os.execve(sys.executable, [sys.executable, str(script), *args.argv], {**os.environ, DISABLE_ENV: "off"})
+        sys.exit(code)
+
+    reply = request({"op": args.command}, path=args.socket)
+    if reply is None:
+        raise SystemExit(f"Демон не запущен: {socket_path(args.socket)}")
+    if args.command == "status":
+        print(json.dumps(reply, ensure_ascii=False, indent=2))
+    else:
+        print("Демон останавливается")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,527 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import os
+import shutil
+import sqlite3
 from tqdm import tqdm
 import time
+import threading
 import argparse
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from run_metrics import StageMetrics
+from stage_state import file_sha256
+
+
+DEFAULT_BASE_URL = "http://publication.pravo.gov.ru"
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Accept": "application/json",
+}
+
+# Коды ответа, при которых сервер просит сбавить темп
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+PDF_MAGIC = b"%PDF-"
+PDF_EOF = b"%%EOF"
+# В конце PDF после %%EOF бывают переводы строк и мусор, поэтому ищем маркер в хвосте
+PDF_TRAILER_WINDOW = 2048
+
+# Через сколько секунд незавершённое скачивание другим процессом считается брошенным
+CLAIM_TIMEOUT = 10 * 60
+
+
+class RateLimiter:
+    """Token bucket: не больше rate запросов в секунду в среднем, всплеск до burst.
+
+    При 429/5xx скорость снижается вдвое (не ниже min_rate) и выдача токенов
+    приостанавливается на retry_after; каждый успешный ответ понемногу
+    возвращает скорость к исходной. Заодно считает запросы, повторы и
+    полученные байты (для метрик шага).
+    """
+
+    def __init__(self, rate=2.0, burst=None, min_rate=0.1):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.bytes_received = 0
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    self.requests += 1
+                    return
+                wait = max(self.paused_until - now, (1.0 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def backoff(self, retry_after=None):
+        with self.lock:
+            self.retries += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def count_bytes(self, size):
+        with self.lock:
+            self.bytes_received += size
+
+
+def make_session(pool_size=8):
+    """Сессия с пулом keep-alive соединений, общая для всех запросов запуска."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+def _retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def request_with_retries(session, limiter, url, retries=5, **kwargs):
+    """GET через общий лимитер; на 429/5xx и сетевые ошибки — замедление и повтор."""
+    kwargs.setdefault("timeout", 30)
+    for attempt in range(1, retries + 1):
+        limiter.acquire()
+        try:
+            response = session.get(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == retries:
+                raise
+            limiter.backoff()
+            continue
+
+        if response.status_code in RETRY_STATUSES and attempt < retries:
+            print(f"Сервер ответил {response.status_code}, замедляемся (попытка {attempt}/{retries})")
+            limiter.backoff(_retry_after_seconds(response))
+            response.close()
+            continue
+
+        response.raise_for_status()
+        limiter.success()
+        return response
+
+
+def is_valid_pdf(path):
+    """Проверяет сигнатуру %PDF- в начале файла и маркер %%EOF в его конце."""
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(PDF_MAGIC)) != PDF_MAGIC:
+                return False
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - PDF_TRAILER_WINDOW))
+            return PDF_EOF in f.read()
+    except OSError:
+        return False
+
+
+def indexed_copy_ok(known):
+    """Файл из записи индекса на месте и цел: размер совпадает с записанным, структура PDF корректна."""
+    path = known["path"]
+    return bool(path) and os.path.exists(path) and os.path.getsize(path) == known["size"] and is_valid_pdf(path)
+
+
+def _content_range_total(response):
+    """Полный размер файла из заголовка Content-Range: bytes a-b/total."""
+    value = response.headers.get("Content-Range", "")
+    try:
+        return int(value.rsplit("/", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def fetch_pdf(session, limiter, url, filepath, show_progress=True, attempts=3):
+    """Качает PDF во временный файл <filepath>.part и атомарно переименовывает его в filepath.
+
+    Если .part уже есть (обрыв соединения, прерванный запуск), докачка идёт
+    с его конца через HTTP Range, когда сервер это поддерживает. Перед
+    переименованием проверяются размер (content-length/Content-Range) и
+    структура PDF. Возвращает False, если получить корректный PDF не удалось.
+    """
+    partial_path = f"{filepath}.part"
+    filename = os.path.basename(filepath)
+
+    for attempt in range(1, attempts + 1):
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        try:
+            response = request_with_retries(session, limiter, url, stream=True, headers=headers)
+        except requests.exceptions.HTTPError as e:
+            # 416: запрошенный диапазон за концом файла — .part, возможно, уже полный
+            if offset and e.response is not None and e.response.status_code == 416:
+                if not is_valid_pdf(partial_path):
+                    os.remove(partial_path)
+                    continue
+                break
+            raise
+
+        with response:
+            content_type = response.headers.get("content-type", "")
+            if "pdf" not in content_type.lower():
+                print(f"Внимание: файл может не быть PDF (Content-Type: {content_type})")
+
+            length = int(response.headers.get("content-length", 0)) or None
+            if response.status_code == 206 and response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                mode = "ab"
+                expected_size = _content_range_total(response)
+                if offset:
+                    print(f"Докачка {filename} с {offset} bytes")
+            else:
+                # Сервер не поддерживает Range — начинаем заново
+                mode = "wb"
+                offset = 0
+                expected_size = length
+
+            received = 0
+            try:
+                with open(partial_path, mode) as f, tqdm(
+                    desc=filename,
+                    total=expected_size or 0,
+                    initial=offset,
+                    unit="B",
+                    unit_scale=True,
+                    unit_divisor=1024,
+                    disable=not expected_size or not show_progress,
+                ) as pbar:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        if chunk:
+                            f.write(chunk)
+                            pbar.update(len(chunk))
+                            received += len(chunk)
+            except requests.exceptions.RequestException as e:
+                print(f"Обрыв при скачивании {filename} (попытка {attempt}/{attempts}): {e}")
+                continue
+            finally:
+                limiter.count_bytes(received)
+
+        size = os.path.getsize(partial_path)
+        if expected_size is not None and size < expected_size:
+            print(f"Недокачано {filename}: {size} из {expected_size} bytes (попытка {attempt}/{attempts})")
+            continue
+        if expected_size is not None and size > expected_size:
+            print(f"Размер {filename} больше ожидаемого ({size} > {expected_size}), качаю заново")
+            os.remove(partial_path)
+            continue
+        break
+    else:
+        return False
+
+    if not is_valid_pdf(partial_path):
+        print(f"✗ Получен не PDF или повреждённый PDF: {filename}")
+        os.remove(partial_path)
+        return False
+
+    os.replace(partial_path, filepath)
+    return True
+
+
+def build_filename(item):
+    """Имя PDF для элемента выдачи API: <номер>_<название>_<дата>.pdf."""
+    title = item.get("title", "document")
+    number = item.get("number", "number")
+    doc_date = item.get("documentDate", "documentDate")
+    doc_date = doc_date[:10] if isinstance(doc_date, str) else "date"
+
+    safe_title = "".join(c for c in title if c.isalnum() or c in (" ", "-", "_")).strip()[:50]
+    return f"{number}_{safe_title}_{doc_date}.pdf".replace(" ", "_")
+
+
+class DocumentIndex:
+    """Локальный SQLite-индекс документов API, ключ — eoNumber.
+
+    Хранит метаданные выдачи, статус скачивания, путь к PDF и его sha256,
+    чтобы повторные запуски и пересекающиеся диапазоны дат не качали
+    известные документы заново, а следующие шаги могли опираться на eoNumber.
+    Одновременные запуски (backfill) делят работу через статус 'downloading':
+    документ качает тот, кто первым его занял (claim), остальные ждут.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS documents (
+            eo_number TEXT PRIMARY KEY,
+            title TEXT,
+            number TEXT,
+            document_date TEXT,
+            authority TEXT,
+            filename TEXT,
+            path TEXT,
+            status TEXT NOT NULL DEFAULT 'new',
+            sha256 TEXT,
+            size INTEGER,
+            first_seen TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            claimed_at TEXT
+        )
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=60)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(self.SCHEMA)
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(documents)")}
+            if "claimed_at" not in columns:
+                # Индексы, созданные до появления claim
+                self.conn.execute("ALTER TABLE documents ADD COLUMN claimed_at TEXT")
+
+    @staticmethod
+    def _now():
+        return datetime.now().isoformat(timespec="seconds")
+
+    def upsert_items(self, items):
+        now = self._now()
+        rows = [
+            (
+                item["eoNumber"],
+                item.get("title"),
+                item.get("number"),
+                item.get("documentDate"),
+                (item.get("signatoryAuthority") or {}).get("name"),
+                build_filename(item),
+                now,
+                now,
+            )
+            for item in items
+            if item.get("eoNumber")
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO documents (eo_number, title, number, document_date, authority, filename, first_seen, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(eo_number) DO UPDATE SET
+                    title = excluded.title,
+                    number = excluded.number,
+                    document_date = excluded.document_date,
+                    authority = excluded.authority,
+                    filename = excluded.filename,
+                    updated_at = excluded.updated_at
+                """,
+                rows,
+            )
+
+    def get(self, eo_number):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM documents WHERE eo_number = ?", (eo_number,)).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, eo_number):
+        """Занимает документ для скачивания. False — его уже качает другой запуск
+        или он уже скачан и файл на месте. Запись 'downloaded', файл которой
+        удалён или испорчен, занимается как обычная."""
+        now = datetime.now().isoformat(timespec="seconds")
+        stale = (datetime.now() - timedelta(seconds=CLAIM_TIMEOUT)).isoformat(timespec="seconds")
+        with self.lock, self.conn:
+            # Проверка и захват — одна транзакция и для соседних процессов
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT * FROM documents WHERE eo_number = ?", (eo_number,)).fetchone()
+            if row is None:
+                return False
+            if row["status"] == "downloaded" and indexed_copy_ok(row):
+                return False
+            if row["status"] == "downloading" and row["claimed_at"] and row["claimed_at"] >= stale:
+                return False
+            self.conn.execute(
+                "UPDATE documents SET status = 'downloading', claimed_at = ?, updated_at = ? WHERE eo_number = ?",
+                (now, now, eo_number),
+            )
+        return True
+
+    def wait_claimed(self, eo_number, poll=1.0):
+        """Ждёт, пока другой запуск докачает документ (или бросит его); возвращает запись индекса."""
+        while True:
+            known = self.get(eo_number)
+            if known is None or known["status"] != "downloading":
+                return known
+            claimed_at = datetime.fromisoformat(known["claimed_at"]) if known["claimed_at"] else None
+            if claimed_at is None or datetime.now() - claimed_at > timedelta(seconds=CLAIM_TIMEOUT):
+                return known
+            time.sleep(poll)
+
+    def mark_downloaded(self, eo_number, path, sha256, size):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE documents SET status = 'downloaded', path = ?, sha256 = ?, size = ?, updated_at = ? "
+                "WHERE eo_number = ?",
+                (os.path.abspath(path), sha256, size, self._now(), eo_number),
+            )
+
+    def mark_deferred(self, eo_numbers):
+        """Документы, отложенные триажем: не скачаны, докачиваются запуском без --triage defer."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE documents SET status = 'deferred', updated_at = ? "
+                "WHERE eo_number = ? AND status NOT IN ('downloaded', 'downloading')",
+                [(self._now(), eo_number) for eo_number in eo_numbers],
+            )
+
+    def mark_failed(self, eo_number):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE documents SET status = 'failed', updated_at = ? WHERE eo_number = ? AND status != 'downloaded'",
+                (self._now(), eo_number),
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def write_manifest(manifest_path, items, results, date_from, date_to):
+    """Пишет манифест запуска: eoNumber → метаданные и имя PDF.
+
+    Имена txt после OCR и нормализации совпадают с именем PDF (другое
+    расширение), поэтому следующие шаги находят файлы документа по манифесту.
+    results — True/False (скачан/ошибка) или None для отложенных триажем.
+    """
+    statuses = {True: "downloaded", False: "failed", None: "deferred"}
+    documents = [
+        {
+            "eoNumber": item["eoNumber"],
+            "title": item.get("title"),
+            "number": item.get("number"),
+            "documentDate": item.get("documentDate"),
+            "pdf": build_filename(item),
+            "status": statuses[ok],
+        }
+        for item, ok in zip(items, results)
+        if item.get("eoNumber")
+    ]
+    payload = {"date_from": date_from, "date_to": date_to, "documents": documents}
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def link_or_copy(src, dst):
+    """Жёсткая ссылка на уже скачанный файл (или копия, если ссылку создать нельзя)."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def download_item(
+    session, limiter, item, download_dir, base_url, label, show_progress=True, index=None, metrics=None
+):
+    """Скачивает PDF одного элемента выдачи. Возвращает True при успехе (или если файл уже есть).
+
+    Сначала проверяется файл в папке: целый PDF пропускается, недокачанный или
+    испорченный докачивается с того же места (так же, как <имя>.part).
+    index — DocumentIndex: документ, скачанный в другую папку, переносится
+    ссылкой, если его файл на месте и совпадает с записью индекса.
+    metrics — StageMetrics: запись о каждом документе, который качался по сети.
+    """
+    eo_number = item.get("eoNumber")
+    if not eo_number:
+        print(f"\n{label} Отсутствует eoNumber, пропускаем")
+        return False
+
+    download_url = f"{base_url}/file/pdf?eoNumber={eo_number}"
+    filename = build_filename(item)
+    filepath = os.path.join(download_dir, filename)
+
+    known = index.get(eo_number) if index is not None else None
+    partial_path = f"{filepath}.part"
+
+    if os.path.exists(filepath):
+        file_size = os.path.getsize(filepath)
+        if is_valid_pdf(filepath):
+            indexed = (
+                known is not None and known["status"] == "downloaded"
+                and known["path"] == os.path.abspath(filepath) and known["size"] == file_size
+            )
+            print(f"{label} ✓ Уже скачан{' (индекс)' if indexed else ''}: {filename} ({file_size} bytes)")
+            if index is not None and not indexed:
+                index.mark_downloaded(eo_number, filepath, file_sha256(filepath), file_size)
+            return True
+        # Недокачанный файл от прежних версий скрипта — докачиваем его с того же места
+        print(f"{label} ✗ Файл повреждён или недокачан, докачиваю: {filename} ({file_size} bytes)")
+        os.replace(filepath, partial_path)
+    elif known and known["status"] == "downloaded" and indexed_copy_ok(known):
+        link_or_copy(known["path"], filepath)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        print(f"{label} ✓ Уже скачан в другой запуск, связан: {filename} ({known['size']} bytes)")
+        return True
+
+    # Документ качает тот, кто его занял; пока занять не удаётся — ждём другой запуск
+    while index is not None and not index.claim(eo_number):
+        known = index.get(eo_number)
+        if known is None:
+            break  # документа нет в индексе — занимать нечего
+        if known["status"] == "downloading":
+            # Тот же документ сейчас качает другой запуск (соседняя неделя при backfill)
+            print(f"{label} … Скачивается другим запуском, ожидаю: {filename}")
+            known = index.wait_claimed(eo_number)
+        if known and known["status"] == "downloaded" and indexed_copy_ok(known):
+            if known["path"] != os.path.abspath(filepath):
+                link_or_copy(known["path"], filepath)
+            print(f"{label} ✓ Скачан другим запуском, связан: {filename} ({known['size']} bytes)")
+            return True
+
+    print(f"\n{label} Скачиваю: {eo_number}")
+    print(f"Название: {item.get('title', 'document')}")
+
+    started = time.perf_counter()
+    try:
+        if not fetch_pdf(session, limiter, download_url, filepath, show_progress):
+            if index is not None:
+                index.mark_failed(eo_number)
+            if metrics is not None:
+                metrics.document(filename, eoNumber=eo_number, status="failed",
+                                 seconds=round(time.perf_counter() - started, 3))
+            return False
+
+        file_size = os.path.getsize(filepath)
+        print(f"✓ Успешно сохранен: {filename} ({file_size} bytes)")
+        if index is not None:
+            index.mark_downloaded(eo_number, filepath, file_sha256(filepath), file_size)
+        if metrics is not None:
+            metrics.document(filename, eoNumber=eo_number, status="downloaded", bytes=file_size,
+                             seconds=round(time.perf_counter() - started, 3))
+        return True
+
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Ошибка при скачивании {eo_number}: {e}")
+        if index is not None:
+            index.mark_failed(eo_number)
+        if metrics is not None:
+            metrics.document(filename, eoNumber=eo_number, status="failed",
+                             seconds=round(time.perf_counter() - started, 3))
+        return False
 
 
 def download_documents(
@@ -12,15 +529,31 @@ def download_documents(
     date_to: str,
     download_dir: str = "downloaded_documents",
     page_size: int = 30,
-    sleep_between_pages: float = 0.5,
-    sleep_between_files: float = 1.0,
+    workers: int = 4,
+    rate: float = 2.0,
+    base_url: str = DEFAULT_BASE_URL,
+    index_db: str = None,
+    manifest_path: str = None,
+    on_downloaded=None,
+    metrics=None,
+    triage=None,
 ):
     """Скачивает PDF-документы с publication.pravo.gov.ru за диапазон дат.
 
     date_from/date_to: строки в формате DD.MM.YYYY (как ожидает API).
+    workers — сколько PDF качается одновременно; rate — общий лимит запросов
+    в секунду (API и файлы), автоматически снижается при 429/5xx.
+    base_url — адрес сервера (можно подменить локальной заглушкой).
+    index_db — путь к SQLite-индексу документов (см. DocumentIndex).
+    manifest_path — куда записать манифест запуска (см. write_manifest).
+    on_downloaded(item, filepath) — вызывается из потока загрузки сразу после
+    того, как PDF документа готов (потоковый режим пайплайна).
+    metrics — StageMetrics шага: документы, байты, запросы и повторы.
+    triage — MetadataTriage (см. triage.py): решения по метаданным пишутся в лог,
+    в режиме defer заведомо нерелевантные документы не скачиваются.
     """
 
-    base_api_url = "http://publication.pravo.gov.ru/api/Documents"
+    base_api_url = f"{base_url}/api/Documents"
 
     params = {
         "DocumentTypes": "7ff5b3b5-3757-44f1-bb76-3766cabe3593",
@@ -43,16 +576,16 @@ def download_documents(
 
     os.makedirs(download_dir, exist_ok=True)
     all_items = []
+    deferred = set()
+    workers = max(1, int(workers))
+    session = make_session(pool_size=workers + 1)
+    limiter = RateLimiter(rate)
+    index = DocumentIndex(index_db) if index_db else None
 
     try:
         print("\nПолучаем информацию о количестве страниц...")
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept": "application/json",
-        }
 
-        first_page_response = requests.get(base_api_url, params=params, headers=headers, timeout=30)
-        first_page_response.raise_for_status()
+        first_page_response = request_with_retries(session, limiter, base_api_url, params=params)
         first_page_data = first_page_response.json()
 
         total_count = first_page_data.get("totalCount", 0)
@@ -64,22 +597,28 @@ def download_documents(
         print(f"Всего страниц: {pages_total_count}")
 
         print(f"\nСобираем данные со всех {pages_total_count} страниц...")
-        for index in range(1, int(pages_total_count) + 1):
-            print(f"Обрабатываем страницу {index}/{pages_total_count}...")
-            params["index"] = str(index)
 
-            response = requests.get(base_api_url, params=params, headers=headers, timeout=30)
-            response.raise_for_status()
-            data = response.json()
+        def fetch_page(index_number):
+            page_params = dict(params, index=str(index_number))
+            return request_with_retries(session, limiter, base_api_url, params=page_params).json()
 
+        # Первая страница уже получена, остальные запрашиваются параллельно
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pages_data = [first_page_data] + list(
+                executor.map(fetch_page, range(2, int(pages_total_count) + 1))
+            )
+
+        for page_number, data in enumerate(pages_data, 1):
             if "items" in data:
                 items = data["items"]
                 all_items.extend(items)
-                print(f"Страница {index}: добавлено {len(items)} документов")
+                print(f"Страница {page_number}: добавлено {len(items)} документов")
             else:
-                print(f"Страница {index}: ключ 'items' не найден")
+                print(f"Страница {page_number}: ключ 'items' не найден")
 
-            time.sleep(float(sleep_between_pages))
+        if index is not None:
+            index.upsert_items(all_items)
+            print(f"Индекс документов обновлён: {index.db_path}")
 
         print(f"\nВсего собрано документов: {len(all_items)}")
 
@@ -97,70 +636,50 @@ def download_documents(
             if "signatoryAuthority" in item:
                 print(f"  Орган: {item['signatoryAuthority'].get('name', 'N/A')}")
 
-        download_base_url = "http://publication.pravo.gov.ru/file/pdf?eoNumber="
-        successful_downloads = 0
-        failed_downloads = 0
-
-        print(f"\nНачинаем скачивание {len(all_items)} документов...")
-
-        for i, item in enumerate(all_items, 1):
-            eo_number = item.get("eoNumber")
-            if not eo_number:
-                print(f"\n[{i}/{len(all_items)}] Отсутствует eoNumber, пропускаем")
-                failed_downloads += 1
-                continue
-
-            download_url = f"{download_base_url}{eo_number}"
-
-            title = item.get("title", "document")
-            number = item.get("number", "number")
-            doc_date = item.get("documentDate", "documentDate")
-            doc_date = doc_date[:10] if isinstance(doc_date, str) else "date"
-
-            safe_title = "".join(c for c in title if c.isalnum() or c in (" ", "-", "_")).strip()[:50]
-            filename = f"{number}_{safe_title}_{doc_date}.pdf".replace(" ", "_")
-            filepath = os.path.join(download_dir, filename)
-
-            if os.path.exists(filepath):
-                file_size = os.path.getsize(filepath)
-                print(f"[{i}/{len(all_items)}] ✓ Уже скачан: {filename} ({file_size} bytes)")
-                successful_downloads += 1
-                continue
-
-            print(f"\n[{i}/{len(all_items)}] Скачиваю: {eo_number}")
-            print(f"Название: {title}")
-
-            try:
-                file_response = requests.get(download_url, stream=True, timeout=30, headers=headers)
-                file_response.raise_for_status()
-
-                content_type = file_response.headers.get("content-type", "")
-                if "pdf" not in content_type.lower():
-                    print(f"Внимание: файл может не быть PDF (Content-Type: {content_type})")
-
-                total_size = int(file_response.headers.get("content-length", 0))
-                with open(filepath, "wb") as f, tqdm(
-                    desc=filename,
-                    total=total_size,
-                    unit="B",
-                    unit_scale=True,
-                    unit_divisor=1024,
-                    disable=total_size == 0,
-                ) as pbar:
-                    for chunk in file_response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            pbar.update(len(chunk))
-
-                file_size = os.path.getsize(filepath)
-                print(f"✓ Успешно сохранен: {filename} ({file_size} bytes)")
-                successful_downloads += 1
-
-            except requests.exceptions.RequestException as e:
-                print(f"✗ Ошибка при скачивании {eo_number}: {e}")
-                failed_downloads += 1
-
-            time.sleep(float(sleep_between_files))
+        to_download = all_items
+        if triage is not None:
+            decisions = [triage.decide(item) for item in all_items]
+            deferred = {d["eoNumber"] for d in decisions if d["eoNumber"] and triage.deferred(d)}
+            triage.write_log(decisions)
+            counts = {name: sum(1 for d in decisions if d["decision"] == name)
+                      for name in ("relevant", "borderline", "irrelevant")}
+            print(
+                f"\nТриаж по метаданным ({triage.mode}): релевантных {counts['relevant']}, "
+                f"пограничных {counts['borderline']}, нерелевантных {counts['irrelevant']}, отложено {len(deferred)}"
+            )
+            if index is not None and deferred:
+                index.mark_deferred(deferred)
+            to_download = [item for item in all_items if item.get("eoNumber") not in deferred]
+
+        print(f"\nНачинаем скачивание {len(to_download)} документов (потоков: {workers})...")
+
+        def download_numbered(numbered):
+            number, item = numbered
+            ok = download_item(
+                session,
+                limiter,
+                item,
+                download_dir,
+                base_url,
+                f"[{number}/{len(to_download)}]",
+                show_progress=workers == 1,
+                index=index,
+                metrics=metrics,
+            )
+            if ok and on_downloaded is not None:
+                on_downloaded(item, os.path.join(download_dir, build_filename(item)))
+            return ok
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            downloaded = iter(list(executor.map(download_numbered, enumerate(to_download, 1))))
+        results = [None if item.get("eoNumber") in deferred else next(downloaded) for item in all_items]
+
+        successful_downloads = sum(1 for ok in results if ok)
+        failed_downloads = sum(1 for ok in results if ok is False)
+
+        if manifest_path:
+            write_manifest(manifest_path, all_items, results, date_from, date_to)
+            print(f"Манифест запуска: {manifest_path}")
 
         print(f"\n{'=' * 60}")
         print("ЗАВЕРШЕНО!")
@@ -168,6 +687,8 @@ def download_documents(
         print(f"Всего документов (в выдаче): {len(all_items)}")
         print(f"Успешно скачано: {successful_downloads}")
         print(f"Не удалось скачать: {failed_downloads}")
+        if deferred:
+            print(f"Отложено триажем: {len(deferred)}")
         print(f"Документы сохранены в папке: '{download_dir}'")
         print(f"{'=' * 60}")
 
@@ -179,6 +700,19 @@ def download_documents(
         print(f"Ошибка при парсинге JSON ответа: {e}")
     except Exception as e:
         print(f"Неожиданная ошибка: {e}")
+    finally:
+        session.close()
+        if index is not None:
+            index.close()
+        if metrics is not None:
+            if deferred:
+                metrics.add(deferred=len(deferred))
+            metrics.add(
+                documents=len(all_items),
+                bytes=limiter.bytes_received,
+                requests=limiter.requests,
+                retries=limiter.retries,
+            )
 
     return 0, 0, 0
 
@@ -189,28 +723,59 @@ def _validate_date(s: str) -> str:
     return s
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Скачивание документов с publication.pravo.gov.ru")
     parser.add_argument("--date-from", required=True, type=_validate_date, help="Дата начала (DD.MM.YYYY)")
     parser.add_argument("--date-to", required=True, type=_validate_date, help="Дата конца (DD.MM.YYYY)")
     parser.add_argument("--download-dir", default="downloaded_documents", help="Папка для PDF")
     parser.add_argument("--page-size", type=int, default=30, help="PageSize для API")
-    parser.add_argument("--sleep-pages", type=float, default=0.5, help="Пауза между страницами API (сек)")
-    parser.add_argument("--sleep-files", type=float, default=1.0, help="Пауза между скачиваниями файлов (сек)")
-    args = parser.parse_args()
+    parser.add_argument("--workers", type=int, default=4, help="Сколько PDF скачивать одновременно")
+    parser.add_argument("--rate", type=float, default=2.0, help="Лимит запросов в секунду (снижается при 429/5xx)")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL, help="Адрес сервера API")
+    parser.add_argument("--index-db", help="SQLite-индекс документов (по умолчанию не ведётся)")
+    parser.add_argument("--manifest", help="JSON-манифест запуска: eoNumber → PDF")
+    parser.add_argument("--metrics-file", help="JSONL-файл метрик шага (см. run_metrics)")
+    parser.add_argument(
+        "--triage", choices=["off", "log", "defer"], default="off",
+        help="Отбор по метаданным: log — только записать решения, defer — не качать заведомо нерелевантные",
+    )
+    parser.add_argument("--triage-log", default="triage.jsonl", help="JSONL с решениями триажа")
+    parser.add_argument("--rules", help="JSON с правилами классификации (ключевые слова бюджетной фазы и triage)")
+    # Оставлены для совместимости со старыми командами запуска: паузы заменены лимитером --rate
+    parser.add_argument("--sleep-pages", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--sleep-files", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
 
     print("=" * 60)
     print("СКРИПТ ДЛЯ СКАЧИВАНИЯ ДОКУМЕНТОВ С PRAVO.GOV.RU")
     print("=" * 60)
-    download_documents(
+    if args.sleep_pages is not None or args.sleep_files is not None:
+        print("Внимание: --sleep-pages/--sleep-files больше не используются, темп задаётся --rate")
+
+    metrics = StageMetrics(args.metrics_file, "download")
+    triage = None
+    if args.triage != "off":
+        from classifier_cli import load_rules
+        from triage import MetadataTriage
+
+        triage = MetadataTriage(load_rules(args.rules), args.triage, args.triage_log)
+    total, ok, failed = download_documents(
         date_from=args.date_from,
         date_to=args.date_to,
         download_dir=args.download_dir,
         page_size=args.page_size,
-        sleep_between_pages=args.sleep_pages,
-        sleep_between_files=args.sleep_files,
+        workers=args.workers,
+        rate=args.rate,
+        base_url=args.base_url,
+        index_db=args.index_db,
+        manifest_path=args.manifest,
+        metrics=metrics,
+        triage=triage,
     )
+    metrics.finish(downloaded=ok, failed=failed)
 
 
 if __name__ == "__main__":
-    main()
+    from daemon_cli import run_cli
+
+    run_cli(__file__, main)
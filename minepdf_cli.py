@@ -1,57 +1,1203 @@
 import os
+import re
+import json
+import hashlib
+import shutil
+import subprocess
+import threading
 import pytesseract
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
 from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from dataclasses import dataclass
 import time
 import argparse
 
+from run_metrics import StageMetrics
+from stage_state import StageState, file_sha256
+
 
 # При необходимости укажите путь к tesseract.exe:
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
+OCR_LANG = "rus+eng"
+OCR_PSM = 6
+OCR_CONFIG = f"--psm {OCR_PSM}"
+
+# pytesseract — процесс tesseract на каждую страницу; tesserocr — движок через C API,
+# живёт всё время работы процесса (потока), страницы передаются в памяти
+OCR_BACKENDS = ("pytesseract", "tesserocr")
+
+# pdf2image — pdftoppm, страницы через временные JPEG; pymupdf — рендеринг в процессе
+# сразу в буфер оттенков серого, без кодирования и диска
+RENDER_BACKENDS = ("pdf2image", "pymupdf")
+
+# Порог качества текстового слоя: минимум букв на странице и доля кириллицы среди них
+TEXT_LAYER_MIN_CHARS = 100
+TEXT_LAYER_MIN_CYRILLIC_SHARE = 0.5
+
+# Адаптивный режим: страница распознаётся с --adaptive-dpi и повторяется с --dpi,
+# если средняя уверенность слов Tesseract или доля кириллицы ниже порога.
+# Долю кириллицы не проверяем на страницах, где букв меньше ADAPTIVE_MIN_LETTERS
+ADAPTIVE_MIN_CONFIDENCE = 70.0
+ADAPTIVE_MIN_CYRILLIC_SHARE = 0.5
+ADAPTIVE_MIN_LETTERS = 20
+
+LETTER_RE = re.compile(r"[^\W\d_]")
+CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
+
+
+@dataclass
+class OcrOptions:
+    """Настройки распознавания одного документа."""
+
+    dpi: int = 300
+    page_batch: int = 10
+    text_layer: bool = True
+    min_text_chars: int = TEXT_LAYER_MIN_CHARS
+    min_cyrillic_share: float = TEXT_LAYER_MIN_CYRILLIC_SHARE
+    backend: str = "pytesseract"
+    render: str = "pdf2image"
+    adaptive_dpi: int = 0
+    min_confidence: float = ADAPTIVE_MIN_CONFIDENCE
+    # Настройки прогрессивного OCR (progressive.progressive_settings) или None
+    progressive: dict = None
+
+    @property
+    def scan_dpi(self):
+        """DPI первого прохода OCR."""
+        return self.adaptive_dpi or self.dpi
+
+    def ocr_settings(self):
+        """Настройки, от которых зависит текст распознанной страницы.
+
+        Бэкенд OCR и рендерер входят в ключ кэша: у бэкендов может отличаться
+        сборка Tesseract и его данные, рендереры дают разные пиксели.
+        """
+        settings = {
+            "dpi": self.dpi,
+            "lang": OCR_LANG,
+            "config": OCR_CONFIG,
+            "backend": self.backend,
+            "tesseract": tesseract_version(self.backend),
+            "render": self.render,
+        }
+        if self.adaptive_dpi:
+            settings.update(
+                adaptive_dpi=self.adaptive_dpi,
+                min_confidence=self.min_confidence,
+                min_ocr_cyrillic_share=ADAPTIVE_MIN_CYRILLIC_SHARE,
+            )
+        return settings
+
+    def state_params(self):
+        """Всё, от чего зависит итоговый txt документа (для инкрементальных перезапусков)."""
+        return {**self.ocr_settings(), **self.document_settings()}
+
+    def document_settings(self):
+        """Дополнительные настройки, от которых зависит итоговый txt документа."""
+        settings = {
+            "text_layer": self.text_layer,
+            "min_text_chars": self.min_text_chars,
+            "min_cyrillic_share": self.min_cyrillic_share,
+        }
+        if self.progressive:
+            # Досрочно остановленный документ — не тот же txt, что полный
+            settings["progressive"] = self.progressive
+        return settings
 
-def ocr_pdf_to_text(pdf_path, output_path, dpi=300):
-    """Конвертирует PDF в текст с помощью OCR."""
+
+def tesseract_version(backend="pytesseract"):
     try:
-        print(f"Начинаю OCR обработку: {os.path.basename(pdf_path)}")
-        start_time = time.time()
+        if backend == "tesserocr":
+            import tesserocr
+
+            # "tesseract 5.3.0\n leptonica-..." -> "5.3.0", как у pytesseract
+            return tesserocr.tesseract_version().split()[1]
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return "unknown"
+
+
+def resolve_ocr_backend(backend):
+    """Возвращает backend или pytesseract, если tesserocr не установлен."""
+    if backend == "tesserocr":
+        try:
+            import tesserocr  # noqa: F401
+        except ImportError:
+            print("tesserocr не установлен (pip install tesserocr), используется pytesseract")
+            return "pytesseract"
+    return backend
+
+
+def import_pymupdf():
+    """Модуль PyMuPDF (pymupdf, в старых версиях — fitz) или None, если он не установлен."""
+    try:
+        import pymupdf
+    except ImportError:
+        try:
+            import fitz as pymupdf
+        except ImportError:
+            return None
+    return pymupdf
+
+
+def resolve_render_backend(render):
+    """Возвращает render или pdf2image, если PyMuPDF не установлен."""
+    if render == "pymupdf" and import_pymupdf() is None:
+        print("PyMuPDF не установлен (pip install pymupdf), страницы рендерит pdf2image")
+        return "pdf2image"
+    return render
+
+
+class TesserocrEngine:
+    """Долгоживущий движок Tesseract (tesserocr): модель rus+eng загружается один раз.
+
+    Настройки те же, что у pytesseract (язык, --psm 6); как и текстовый вывод
+    tesseract, текст страницы заканчивается разделителем страниц (form feed).
+    """
+
+    PAGE_SEPARATOR = "\f"
+
+    def __init__(self):
+        import tesserocr
+
+        self.api = tesserocr.PyTessBaseAPI(lang=OCR_LANG, psm=tesserocr.PSM(OCR_PSM))
+
+    def image_to_string(self, image):
+        self.api.SetImage(image)
+        return self.api.GetUTF8Text() + self.PAGE_SEPARATOR
+
+    def image_to_data(self, image):
+        """Текст страницы и уверенности слов (0-100) за одно распознавание."""
+        text = self.image_to_string(image)
+        return text, list(self.api.AllWordConfidences())
+
+
+# Движок tesserocr не потокобезопасен — по одному на поток, пока жив процесс
+_engines = threading.local()
+
+
+def tesserocr_engine():
+    engine = getattr(_engines, "tesserocr", None)
+    if engine is None:
+        engine = _engines.tesserocr = TesserocrEngine()
+    return engine
+
+
+class OcrCache:
+    """Кэш результатов OCR, общий для всех запусков (обычно <base-dir>/ocr_cache).
+
+    Ключ документа — хэш содержимого PDF + все настройки, влияющие на итоговый txt;
+    вместе с txt документа хранится его <имя>.ocr.json, если он был записан.
+    ключ страницы — хэш PDF + настройки распознавания (dpi, язык, psm, версия Tesseract).
+    Размер ограничен max_bytes, при превышении удаляются давно не использованные записи.
+    Документ, который уже распознаёт другой процесс (соседняя неделя при backfill),
+    помечается файлом-блокировкой locks/<ключ>.lock — остальные ждут его результата.
+    """
+
+    # Через сколько секунд блокировка считается брошенной (процесс упал)
+    LOCK_TIMEOUT = 60 * 60
+
+    def __init__(self, cache_dir, options, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        ocr_settings = options.ocr_settings()
+        self.ocr_key = self._settings_hash(ocr_settings)
+        self.document_key_suffix = self._settings_hash({**ocr_settings, **options.document_settings()})
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        (self.cache_dir / "documents").mkdir(parents=True, exist_ok=True)
+        (self.cache_dir / "pages").mkdir(parents=True, exist_ok=True)
+        (self.cache_dir / "locks").mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _settings_hash(settings):
+        payload = json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()[:16]
+
+    def _document_path(self, pdf_hash):
+        return self.cache_dir / "documents" / pdf_hash[:2] / f"{pdf_hash}_{self.document_key_suffix}.txt"
+
+    def _metadata_path(self, pdf_hash):
+        return self._document_path(pdf_hash).with_suffix(".ocr.json")
+
+    def _page_path(self, pdf_hash, page_number):
+        return self.cache_dir / "pages" / pdf_hash[:2] / f"{pdf_hash}_{self.ocr_key}_{page_number}.txt"
+
+    def _read(self, path):
+        # Запись может удалить evict() другого процесса в любой момент — это промах
+        try:
+            text = path.read_text(encoding="utf-8")
+            os.utime(path)  # отметка использования для LRU
+            size = path.stat().st_size
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.bytes_saved += size
+        return text
+
+    @staticmethod
+    def _write(path, text):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def get_document(self, pdf_hash):
+        return self._read(self._document_path(pdf_hash))
+
+    def get_document_metadata(self, pdf_hash):
+        """Сохранённый вместе с документом <имя>.ocr.json или None."""
+        try:
+            return json.loads(self._metadata_path(pdf_hash).read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_document_file(self, pdf_hash, text_path, metadata_path=None):
+        """Кладёт в кэш txt документа и, если есть, его <имя>.ocr.json (до txt: txt в кэше — запись полная)."""
+        paths = [(text_path, self._document_path(pdf_hash))]
+        if metadata_path is not None:
+            paths.insert(0, (metadata_path, self._metadata_path(pdf_hash)))
+        for source, path in paths:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+
+    def _lock_path(self, pdf_hash):
+        return self.cache_dir / "locks" / f"{pdf_hash}_{self.document_key_suffix}.lock"
+
+    def _lock_is_stale(self, path):
+        try:
+            return time.time() - path.stat().st_mtime > self.LOCK_TIMEOUT
+        except FileNotFoundError:
+            return True
+
+    def lock_document(self, pdf_hash):
+        """Занимает документ для распознавания. False — его уже распознаёт другой процесс."""
+        path = self._lock_path(pdf_hash)
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._lock_is_stale(path):
+                    return False
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+            os.write(fd, str(os.getpid()).encode("ascii"))
+            os.close(fd)
+            return True
+
+    def unlock_document(self, pdf_hash):
+        try:
+            self._lock_path(pdf_hash).unlink()
+        except FileNotFoundError:
+            pass
+
+    def wait_document(self, pdf_hash, poll=2.0):
+        """Ждёт, пока другой процесс распознает документ; текст из кэша или None."""
+        path = self._lock_path(pdf_hash)
+        while path.exists() and not self._lock_is_stale(path):
+            time.sleep(poll)
+        return self.get_document(pdf_hash)
+
+    def acquire_document(self, pdf_hash):
+        """Готовый текст документа из кэша (возможно, дождавшись другого процесса) или None.
+
+        None означает, что документ занят этим процессом: после распознавания
+        нужно вызвать unlock_document.
+        """
+        text = self.get_document(pdf_hash)
+        while text is None and not self.lock_document(pdf_hash):
+            print(f"Документ распознаётся другим процессом, ожидаю: {pdf_hash[:12]}")
+            text = self.wait_document(pdf_hash)
+        return text
+
+    def try_acquire_document(self, pdf_hash):
+        """Как acquire_document, но без ожидания: (текст из кэша или None, занят ли документ этим процессом).
+
+        (None, False) — документ распознаёт другой процесс.
+        """
+        text = self.get_document(pdf_hash)
+        if text is not None:
+            return text, False
+        return None, self.lock_document(pdf_hash)
+
+    def get_page(self, pdf_hash, page_number):
+        return self._read(self._page_path(pdf_hash, page_number))
+
+    def put_page(self, pdf_hash, page_number, text):
+        self._write(self._page_path(pdf_hash, page_number), text)
+
+    def evict(self):
+        """Удаляет самые давно использованные записи, пока кэш больше max_bytes."""
+        entries = []
+        total = 0
+        for path in self.cache_dir.rglob("*"):
+            if path.suffix not in (".txt", ".json"):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed, total
+
+    def take_stats(self):
+        """Возвращает (hits, misses, bytes_saved) с прошлого вызова и обнуляет их."""
+        stats = (self.hits, self.misses, self.bytes_saved)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        return stats
+
+    def merge_stats(self, hits, misses, bytes_saved):
+        """Учитывает статистику кэша рабочего процесса."""
+        self.hits += hits
+        self.misses += misses
+        self.bytes_saved += bytes_saved
+
+    def stats_line(self):
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return (
+            f"Кэш OCR: попаданий {self.hits}, промахов {self.misses} ({rate:.1f}%), "
+            f"сэкономлено {self.bytes_saved / 1024:.1f} КБ текста"
+        )
+
+
+def format_page(page_number, text):
+    """Форматирует текст страницы так же, как в итоговом txt."""
+    return f"--- Страница {page_number} ---\n{text}\n\n"
+
+
+def write_document_text(output_path, text):
+    """Пишет txt документа через <имя>.part: прерванная запись не оставляет обрезанный txt."""
+    partial_path = f"{output_path}.part"
+    with open(partial_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(partial_path, output_path)
+
+
+def ocr_image(image, backend="pytesseract"):
+    if backend == "tesserocr":
+        return tesserocr_engine().image_to_string(image)
+    return pytesseract.image_to_string(image, lang=OCR_LANG, config=OCR_CONFIG)
+
+
+def ocr_image_data(image, backend="pytesseract"):
+    """Распознаёт изображение: (текст, уверенности слов 0-100)."""
+    if backend == "tesserocr":
+        return tesserocr_engine().image_to_data(image)
+    data = pytesseract.image_to_data(
+        image, lang=OCR_LANG, config=OCR_CONFIG, output_type=pytesseract.Output.DICT
+    )
+    # Текст собирается из слов так же, как его выводит tesseract: слова через
+    # пробел, строки через \n, абзацы через пустую строку, в конце — \f
+    paragraphs = {}
+    confidences = []
+    for word, conf, block, par, line in zip(
+        data["text"], data["conf"], data["block_num"], data["par_num"], data["line_num"]
+    ):
+        if float(conf) < 0 or not word.strip():
+            continue
+        confidences.append(float(conf))
+        paragraphs.setdefault((block, par), {}).setdefault(line, []).append(word)
+    text = "\n".join(
+        "\n".join(" ".join(words) for words in lines.values()) + "\n"
+        for lines in paragraphs.values()
+    )
+    return text + "\f", confidences
+
+
+def ocr_quality(text, confidences):
+    """Средняя уверенность слов и доля кириллицы среди букв (None — не по чему судить)."""
+    letters = len(LETTER_RE.findall(text))
+    return {
+        "confidence": round(sum(confidences) / len(confidences), 1) if confidences else None,
+        "cyrillic_share": (
+            round(len(CYRILLIC_RE.findall(text)) / letters, 3) if letters >= ADAPTIVE_MIN_LETTERS else None
+        ),
+    }
+
+
+def is_confident_ocr(quality, min_confidence=ADAPTIVE_MIN_CONFIDENCE):
+    """Пустая страница (нет слов) считается распознанной уверенно."""
+    if quality["confidence"] is not None and quality["confidence"] < min_confidence:
+        return False
+    return quality["cyrillic_share"] is None or quality["cyrillic_share"] >= ADAPTIVE_MIN_CYRILLIC_SHARE
+
+
+def ocr_page_adaptive(image, render_page, options):
+    """Распознаёт страницу, отрендеренную с options.adaptive_dpi.
+
+    Если качество ниже порога, страница рендерится заново с options.dpi
+    (render_page(dpi) -> изображение) и распознаётся ещё раз. Возвращает
+    (текст, сведения о странице: dpi, confidence, cyrillic_share и first_pass
+    при повторе).
+    """
+    text, confidences = ocr_image_data(image, options.backend)
+    info = {"source": "ocr", "dpi": options.adaptive_dpi, **ocr_quality(text, confidences)}
+    if options.dpi <= options.adaptive_dpi or is_confident_ocr(info, options.min_confidence):
+        return text, info
+
+    first_pass = {key: info[key] for key in ("dpi", "confidence", "cyrillic_share")}
+    image = render_page(options.dpi)
+    try:
+        text, confidences = ocr_image_data(image, options.backend)
+    finally:
+        image.close()
+    return text, {"source": "ocr", "dpi": options.dpi, **ocr_quality(text, confidences), "first_pass": first_pass}
+
+
+def ocr_metadata_path(output_path):
+    """Сведения об OCR документа лежат рядом с txt: <имя>.ocr.json."""
+    return Path(output_path).with_suffix(".ocr.json")
+
+
+def write_ocr_metadata(output_path, pdf_name, options, pages_info=None, progressive=None):
+    """Пишет <имя>.ocr.json: по каждой странице источник текста, DPI и уверенность.
+
+    pages_info=None — документ целиком взят из кэша, сведений о страницах нет.
+    progressive — решение прогрессивного OCR (см. progressive.DocumentProgress.record).
+    Возвращает путь к записанному файлу.
+    """
+    record = {"pdf": pdf_name, "dpi": options.dpi, "adaptive_dpi": options.adaptive_dpi,
+              "min_confidence": options.min_confidence}
+    if pages_info is None:
+        record["cached"] = True
+    else:
+        if options.adaptive_dpi:
+            record["rescanned_pages"] = sum(1 for info in pages_info.values() if "first_pass" in info)
+        record["pages"] = [{"page": i, **pages_info[i]} for i in sorted(pages_info)]
+    if progressive is not None:
+        record["progressive"] = progressive
+    return _write_ocr_record(output_path, record)
+
+
+def _write_ocr_record(output_path, record):
+    path = ocr_metadata_path(output_path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(record, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+    return path
+
+
+def restore_ocr_metadata(output_path, pdf_name, options, cache, pdf_hash):
+    """<имя>.ocr.json документа, взятого из кэша: сведения, сохранённые при его распознавании.
+
+    Если их в кэше нет (запись сделана до того, как их стали сохранять),
+    уже лежащий рядом с txt файл не перезаписывается. Возвращает решение
+    прогрессивного OCR из сохранённых сведений или None.
+    """
+    record = cache.get_document_metadata(pdf_hash)
+    if record is None:
+        if not ocr_metadata_path(output_path).exists():
+            write_ocr_metadata(output_path, pdf_name, options)
+        return None
+    record.update(pdf=pdf_name, cached=True)
+    _write_ocr_record(output_path, record)
+    return record.get("progressive")
+
+
+def cached_progressive_metrics(progressive):
+    """Счётчики и поля метрик документа из кэша с решением прогрессивного OCR."""
+    if progressive is None:
+        return {}, {}
+    skipped = len(progressive["skipped_pages"])
+    counters = {"skipped_pages": skipped, "stopped_documents": int(progressive["decision"] == "stopped")}
+    return counters, {"progressive": progressive["decision"], "skipped_pages": skipped}
+
+
+def skipped_note(skipped):
+    return f", пропущено (нет бюджетных признаков): {len(skipped)}" if skipped else ""
+
+
+def progressive_classifier(options):
+    """Проверки прогрессивного OCR для одного запуска или None, если режим выключен.
 
+    Создаётся на вызов, а не на процесс: в демоне (daemon_cli.py) у заданий
+    могут быть разные правила.
+    """
+    if not options.progressive:
+        return None
+    from progressive import ProgressiveClassifier
+
+    return ProgressiveClassifier(options.progressive)
+
+
+def count_pdf_pages(pdf_path, render="pdf2image"):
+    if render == "pymupdf":
+        with import_pymupdf().open(pdf_path) as doc:
+            return doc.page_count
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def render_pymupdf_page(doc, page_number, dpi):
+    """Страница документа PyMuPDF -> изображение PIL в оттенках серого (без промежуточных файлов)."""
+    pymupdf = import_pymupdf()
+    pixmap = doc[page_number - 1].get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY, alpha=False)
+    return Image.frombuffer("L", (pixmap.width, pixmap.height), pixmap.samples, "raw", "L", pixmap.stride, 1)
+
+
+def extract_text_layer(pdf_path, pages):
+    """Возвращает список текстов страниц из текстового слоя PDF (pdftotext из poppler).
+
+    None — если pdftotext недоступен или завершился с ошибкой.
+    """
+    try:
+        result = subprocess.run(
+            ["pdftotext", "-layout", "-enc", "UTF-8", pdf_path, "-"],
+            capture_output=True,
+            check=True,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+    # pdftotext завершает каждую страницу символом \f
+    texts = result.stdout.decode("utf-8", errors="replace").split("\f")[:pages]
+    return texts + [""] * (pages - len(texts))
+
+
+def is_usable_text_layer(text, min_chars=TEXT_LAYER_MIN_CHARS, min_cyrillic_share=TEXT_LAYER_MIN_CYRILLIC_SHARE):
+    """Проверяет, что текст страницы достаточно длинный и в основном кириллический."""
+    letters = len(LETTER_RE.findall(text))
+    if letters < min_chars:
+        return False
+    return len(CYRILLIC_RE.findall(text)) / letters >= min_cyrillic_share
+
+
+def select_text_layer_pages(
+    pdf_path,
+    pages,
+    min_chars=TEXT_LAYER_MIN_CHARS,
+    min_cyrillic_share=TEXT_LAYER_MIN_CYRILLIC_SHARE,
+):
+    """Возвращает {номер страницы: текст} для страниц с пригодным текстовым слоем."""
+    texts = extract_text_layer(pdf_path, pages)
+    if texts is None:
+        print("Текстовый слой недоступен (pdftotext), все страницы пойдут в OCR")
+        return {}
+    return {
+        i: text
+        for i, text in enumerate(texts, 1)
+        if is_usable_text_layer(text, min_chars, min_cyrillic_share)
+    }
+
+
+def render_pdf_page(pdf_path, page_number, dpi=300, render="pdf2image"):
+    """Рендерит одну страницу PDF в изображение."""
+    if render == "pymupdf":
+        with import_pymupdf().open(pdf_path) as doc:
+            return render_pymupdf_page(doc, page_number, dpi)
+    images = convert_from_path(
+        pdf_path,
+        dpi=dpi,
+        fmt="jpeg",
+        first_page=page_number,
+        last_page=page_number,
+    )
+    return images[0]
+
+
+def ocr_pdf_page(pdf_path, page_number, dpi=300, backend="pytesseract", render="pdf2image"):
+    """Рендерит и распознаёт одну страницу PDF (задача для пула процессов)."""
+    return ocr_image(render_pdf_page(pdf_path, page_number, dpi, render), backend)
+
+
+def ocr_pdf_page_adaptive(pdf_path, page_number, options):
+    """Как ocr_pdf_page, но в адаптивном режиме: возвращает (текст, сведения о странице)."""
+    image = render_pdf_page(pdf_path, page_number, options.adaptive_dpi, options.render)
+    try:
+        return ocr_page_adaptive(
+            image, lambda dpi: render_pdf_page(pdf_path, page_number, dpi, options.render), options
+        )
+    finally:
+        image.close()
+
+
+def page_windows(page_numbers, page_batch):
+    """Разбивает возрастающий список страниц на непрерывные окна (first, last) не длиннее page_batch."""
+    window = []
+    for page_number in page_numbers:
+        if window and (page_number != window[-1] + 1 or len(window) >= page_batch):
+            yield window[0], window[-1]
+            window = []
+        window.append(page_number)
+    if window:
+        yield window[0], window[-1]
+
+
+def iter_pdf_images(pdf_path, dpi=300, page_batch=10, page_numbers=None, render="pdf2image"):
+    """Рендерит PDF окнами по page_batch страниц и отдаёт пары (номер страницы, изображение).
+
+    В памяти одновременно находится не больше page_batch изображений,
+    page_batch <= 0 — весь документ за один вызов convert_from_path.
+    page_numbers — рендерить только эти страницы (по умолчанию все).
+    render=pymupdf — страницы рендерятся по одной в процессе, page_batch не нужен.
+    """
+    if render == "pymupdf":
+        with import_pymupdf().open(pdf_path) as doc:
+            for i in page_numbers or range(1, doc.page_count + 1):
+                yield i, render_pymupdf_page(doc, i, dpi)
+        return
+
+    if page_batch <= 0:
+        images = convert_from_path(pdf_path, dpi=dpi, fmt="jpeg", thread_count=4)
+        print(f"PDF конвертирован в {len(images)} изображений")
+        wanted = None if page_numbers is None else set(page_numbers)
+        for i, image in enumerate(images, 1):
+            if wanted is None or i in wanted:
+                yield i, image
+        return
+
+    if page_numbers is None:
+        page_numbers = range(1, count_pdf_pages(pdf_path) + 1)
+    print(f"Страниц к рендерингу: {len(page_numbers)}, окнами по {page_batch}")
+
+    for first_page, last_page in page_windows(page_numbers, page_batch):
         images = convert_from_path(
             pdf_path,
             dpi=dpi,
             fmt="jpeg",
-            thread_count=4
+            thread_count=4,
+            first_page=first_page,
+            last_page=last_page,
         )
+        for offset, image in enumerate(images):
+            yield first_page + offset, image
+        del images
 
-        print(f"PDF конвертирован в {len(images)} изображений")
 
-        full_text = ""
-        for i, image in enumerate(images, 1):
-            print(f"Обрабатываю страницу {i}...")
+def ocr_pdf_to_text(pdf_path, output_path, options=None, cache=None, metrics=None, classifier=None):
+    """Конвертирует PDF в текст с помощью OCR.
 
-            text = pytesseract.image_to_string(
-                image,
-                lang="rus+eng",
-                config="--psm 6"
+    При options.text_layer страницы с пригодным текстовым слоем берутся из него,
+    в OCR идут только остальные. Страницы рендерятся и распознаются окнами
+    (см. iter_pdf_images), текст дописывается во временный файл, который по
+    завершении переименовывается в output_path. cache — OcrCache: сначала
+    ищется готовый документ, затем уже распознанные страницы. metrics —
+    StageMetrics: запись по документу (страницы по источникам, время, скорость).
+    При options.adaptive_dpi страницы сначала распознаются с пониженным DPI
+    (см. ocr_page_adaptive), рядом с txt пишется <имя>.ocr.json. При
+    options.progressive после каждой пачки страниц проверяется, есть ли в
+    документе бюджетные сигналы; если нет — остальные страницы не распознаются.
+    classifier — ProgressiveClassifier запуска (по умолчанию создаётся для документа).
+    """
+    options = options or OcrOptions()
+    partial_path = f"{output_path}.part"
+    pdf_hash = None
+    locked = False
+    try:
+        print(f"Начинаю OCR обработку: {os.path.basename(pdf_path)}")
+        start_time = time.time()
+
+        if cache is not None:
+            pdf_hash = file_sha256(pdf_path)
+            cached_text = cache.acquire_document(pdf_hash)
+            locked = cached_text is None
+            if cached_text is not None:
+                write_document_text(output_path, cached_text)
+                print(f"Успешно (из кэша): {os.path.basename(pdf_path)} -> {len(cached_text)} символов")
+                progressive = None
+                if options.adaptive_dpi or options.progressive:
+                    progressive = restore_ocr_metadata(
+                        output_path, os.path.basename(pdf_path), options, cache, pdf_hash
+                    )
+                if metrics is not None:
+                    counters, fields = cached_progressive_metrics(progressive)
+                    metrics.add(documents=1, cached_documents=1, **counters)
+                    metrics.document(os.path.basename(pdf_path), cached=True, chars=len(cached_text),
+                                     **fields, seconds=round(time.time() - start_time, 3))
+                return True
+
+        pages = count_pdf_pages(pdf_path, options.render)
+        extracted = {}
+        if options.text_layer:
+            extracted = select_text_layer_pages(
+                pdf_path, pages, options.min_text_chars, options.min_cyrillic_share
             )
+        ready = dict(extracted)
+        pages_info = {i: {"source": "text_layer"} for i in extracted}
+        cached_pages = 0
+        if cache is not None:
+            for i in range(1, pages + 1):
+                if i not in ready:
+                    text = cache.get_page(pdf_hash, i)
+                    if text is not None:
+                        ready[i] = text
+                        pages_info[i] = {"source": "cache"}
+                        cached_pages += 1
+        ocr_pages = [i for i in range(1, pages + 1) if i not in ready]
+        if classifier is None:
+            classifier = progressive_classifier(options)
+        progress = classifier.document() if classifier is not None else None
+
+        total_chars = 0
+        ocr_done = []
+        with open(partial_path, "w", encoding="utf-8") as f:
+            def write_page(page_number, text):
+                nonlocal total_chars
+                page_text = format_page(page_number, text)
+                f.write(page_text)
+                total_chars += len(page_text)
+                if progress is not None:
+                    progress.add_page(text)
+
+            next_page = 1
+            images = iter_pdf_images(pdf_path, options.scan_dpi, options.page_batch, ocr_pages, options.render) if ocr_pages else iter(())
+            for i, image in images:
+                while next_page < i:
+                    write_page(next_page, ready[next_page])
+                    next_page += 1
+
+                if progress is not None and progress.decide() == "stop":
+                    image.close()
+                    break
+
+                print(f"Обрабатываю страницу {i}...")
+                if options.adaptive_dpi:
+                    text, pages_info[i] = ocr_page_adaptive(
+                        image, lambda dpi: render_pdf_page(pdf_path, i, dpi, options.render), options
+                    )
+                else:
+                    text = ocr_image(image, options.backend)
+                    pages_info[i] = {"source": "ocr", "dpi": options.dpi}
+                image.close()
+                if cache is not None:
+                    cache.put_page(pdf_hash, i, text)
+                write_page(i, text)
+                ocr_done.append(i)
+                next_page = i + 1
+            if ocr_pages:
+                images.close()
 
-            full_text += f"--- Страница {i} ---\n{text}\n\n"
+            # После досрочной остановки дописываются только страницы, готовые без OCR
+            skipped = ocr_pages[len(ocr_done):]
+            while next_page <= pages:
+                if next_page in ready:
+                    write_page(next_page, ready[next_page])
+                else:
+                    pages_info[next_page] = {"source": "skipped"}
+                next_page += 1
 
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(full_text)
+        os.replace(partial_path, output_path)
+        rescanned = metadata_path = None
+        if options.adaptive_dpi:
+            rescanned = sum(1 for info in pages_info.values() if "first_pass" in info)
+        if options.adaptive_dpi or progress is not None:
+            metadata_path = write_ocr_metadata(
+                output_path, os.path.basename(pdf_path), options, pages_info,
+                progress.record(skipped) if progress is not None else None,
+            )
+        if cache is not None:
+            cache.put_document_file(pdf_hash, output_path, metadata_path)
 
         processing_time = time.time() - start_time
-        print(f"Успешно: {os.path.basename(pdf_path)} -> {len(full_text)} символов, время: {processing_time:.1f} сек")
+        print(
+            f"Страницы {os.path.basename(pdf_path)}: OCR {len(ocr_done)}"
+            f"{f' (повторно с {options.dpi} DPI: {rescanned})' if rescanned is not None else ''}, "
+            f"из текстового слоя {len(extracted)}, из кэша {cached_pages}"
+            f"{skipped_note(skipped)}"
+        )
+        print(f"Успешно: {os.path.basename(pdf_path)} -> {total_chars} символов, время: {processing_time:.1f} сек")
+        if metrics is not None:
+            metrics.add(documents=1, pages=pages, ocr_pages=len(ocr_done))
+            if rescanned is not None:
+                metrics.add(rescanned_pages=rescanned)
+            if progress is not None:
+                metrics.add(skipped_pages=len(skipped), stopped_documents=int(bool(skipped)))
+            metrics.document(
+                os.path.basename(pdf_path),
+                pages=pages,
+                ocr_pages=len(ocr_done),
+                **({"rescanned_pages": rescanned} if rescanned is not None else {}),
+                **({"progressive": progress.record(skipped)["decision"], "skipped_pages": len(skipped)}
+                   if progress is not None else {}),
+                text_layer_pages=len(extracted),
+                cached_pages=cached_pages,
+                chars=total_chars,
+                seconds=round(processing_time, 3),
+                pages_per_s=round(pages / processing_time, 2) if processing_time > 0 else None,
+            )
 
         return True
 
     except Exception as e:
         print(f"Ошибка OCR при обработке {os.path.basename(pdf_path)}: {str(e)}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
         return False
 
+    finally:
+        if locked:
+            cache.unlock_document(pdf_hash)
+
+
+_worker_options = None
+_worker_cache = None
+_worker_metrics = None
+_worker_classifier = None
+
 
-def process_pdf_folder(input_folder, output_folder, dpi=300):
-    """Обрабатывает все PDF файлы в папке."""
+def _init_worker(options, cache_dir=None, cache_max_bytes=2 * 1024 ** 3, metrics_path=None):
+    global _worker_options, _worker_cache, _worker_metrics, _worker_classifier
+    _worker_options = options
+    _worker_cache = OcrCache(cache_dir, options, cache_max_bytes) if cache_dir else None
+    _worker_metrics = StageMetrics(metrics_path, "ocr") if metrics_path else None
+    _worker_classifier = progressive_classifier(options)
+
+
+def _ocr_document_task(pdf_path, output_path):
+    """Один документ целиком в рабочем процессе (потоковый режим пайплайна)."""
+    ok = ocr_pdf_to_text(
+        pdf_path, output_path, _worker_options, _worker_cache, _worker_metrics, _worker_classifier
+    )
+    stats = _worker_cache.take_stats() if _worker_cache is not None else (0, 0, 0)
+    return ok, stats
+
+
+# Пулы OCR, которые живут дольше одного вызова process_pdf_folder (демон daemon_cli.py):
+# {число процессов: пул}; None — пул создаётся и закрывается на каждый вызов
+_persistent_pools = None
+_pools_lock = threading.Lock()
+
+
+def keep_ocr_pools():
+    """Не закрывать пулы OCR между вызовами: процессы и их движки Tesseract остаются тёплыми."""
+    global _persistent_pools
+    with _pools_lock:
+        if _persistent_pools is None:
+            _persistent_pools = {}
+
+
+def shutdown_ocr_pools():
+    global _persistent_pools
+    with _pools_lock:
+        pools, _persistent_pools = _persistent_pools or {}, None
+    for pool in pools.values():
+        pool.shutdown()
+
+
+@contextmanager
+def ocr_page_pool(workers):
+    if _persistent_pools is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield pool
+        return
+
+    with _pools_lock:
+        pool = _persistent_pools.get(workers)
+        if pool is not None:
+            # Пул, в котором упал процесс, задач больше не принимает — заменяем
+            try:
+                pool.submit(int).result()
+            except BrokenProcessPool:
+                print("Пул OCR сломан (процесс завершился аварийно), создаю новый")
+                pool.shutdown(wait=False)
+                pool = None
+        if pool is None:
+            pool = _persistent_pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    try:
+        yield pool
+    except BrokenProcessPool:
+        with _pools_lock:
+            if _persistent_pools is not None and _persistent_pools.get(workers) is pool:
+                del _persistent_pools[workers]
+        pool.shutdown(wait=False)
+        raise
+
+
+def process_pdf_folder_parallel(
+    input_folder, output_folder, pdf_files, options=None, workers=2, cache=None, state=None, metrics=None,
+    classifier=None,
+):
+    """Распознаёт страницы всех PDF в пуле процессов и собирает текст по порядку страниц."""
+    options = options or OcrOptions()
+    documents = {}
+    success_count = 0
+
+    def finish_document(filename):
+        doc = documents[filename]
+        output_path = os.path.join(output_folder, f"{Path(filename).stem}.txt")
+        full_text = "".join(
+            format_page(i, doc["texts"][i]) for i in range(1, doc["pages"] + 1) if i in doc["texts"]
+        )
+        for i in doc["skipped"]:
+            doc["info"][i] = {"source": "skipped"}
+        progressive = None
+        if doc["progress"] is not None:
+            progressive = doc["progress"].record(doc["skipped"], doc["deferred"])
+        try:
+            write_document_text(output_path, full_text)
+            metadata_path = None
+            if options.adaptive_dpi or progressive is not None:
+                metadata_path = write_ocr_metadata(output_path, filename, options, doc["info"], progressive)
+            if cache is not None:
+                cache.put_document_file(doc["hash"], output_path, metadata_path)
+                if doc["hash"] in locked_hashes:
+                    cache.unlock_document(doc["hash"])
+                    locked_hashes.remove(doc["hash"])
+            if state is not None:
+                state.record(Path(filename).stem, [doc["path"]])
+        except Exception as e:
+            print(f"Ошибка OCR при обработке {filename}: {str(e)}")
+            return False
+
+        processing_time = time.time() - doc["start_time"]
+        rescanned = None
+        if options.adaptive_dpi:
+            rescanned = sum(1 for info in doc["info"].values() if "first_pass" in info)
+        ocr_pages = doc["pages"] - doc["extracted"] - doc["cached"] - len(doc["skipped"])
+        print(
+            f"Страницы {filename}: OCR {ocr_pages}"
+            f"{f' (повторно с {options.dpi} DPI: {rescanned})' if rescanned is not None else ''}, "
+            f"из текстового слоя {doc['extracted']}, из кэша {doc['cached']}"
+            f"{skipped_note(doc['skipped'])}"
+        )
+        print(f"Успешно: {filename} -> {len(full_text)} символов, время: {processing_time:.1f} сек")
+        if metrics is not None:
+            metrics.add(documents=1, pages=doc["pages"], ocr_pages=ocr_pages)
+            if rescanned is not None:
+                metrics.add(rescanned_pages=rescanned)
+            if progressive is not None:
+                metrics.add(skipped_pages=len(doc["skipped"]), stopped_documents=int(bool(doc["skipped"])))
+            metrics.document(
+                filename,
+                pages=doc["pages"],
+                ocr_pages=ocr_pages,
+                **({"rescanned_pages": rescanned} if rescanned is not None else {}),
+                **({"progressive": progressive["decision"], "skipped_pages": len(doc["skipped"]),
+                    "deferred_pages": doc["deferred"]} if progressive is not None else {}),
+                text_layer_pages=doc["extracted"],
+                cached_pages=doc["cached"],
+                chars=len(full_text),
+                seconds=round(processing_time, 3),
+            )
+        doc["texts"] = {}
+        doc["info"] = {}
+        return True
+
+    # Документы, которые распознаёт другой процесс (соседняя неделя при backfill),
+    # ждём только после своих и без своих блокировок: два процесса, ждущие
+    # друг друга с занятыми документами, иначе стояли бы до LOCK_TIMEOUT
+    pending = list(pdf_files)
+    while pending:
+        busy = []
+        documents.clear()
+        # Документы, занятые этим процессом в кэше: освобождаются при любом исходе
+        locked_hashes = []
+        try:
+            for filename in pending:
+                input_path = os.path.join(input_folder, filename)
+                try:
+                    pdf_hash = None
+                    started = time.time()
+                    if cache is not None:
+                        pdf_hash = file_sha256(input_path)
+                        # Копию документа, уже занятого этим запуском, не ждём — распознаём сами
+                        cached_text, locked = (
+                            (None, True) if pdf_hash in locked_hashes else cache.try_acquire_document(pdf_hash)
+                        )
+                        if cached_text is None and not locked:
+                            busy.append((filename, pdf_hash))
+                            continue
+                        if cached_text is None:
+                            if pdf_hash not in locked_hashes:
+                                locked_hashes.append(pdf_hash)
+                        else:
+                            output_path = os.path.join(output_folder, f"{Path(filename).stem}.txt")
+                            write_document_text(output_path, cached_text)
+                            print(f"Успешно (из кэша): {filename} -> {len(cached_text)} символов")
+                            progressive = None
+                            if options.adaptive_dpi or options.progressive:
+                                progressive = restore_ocr_metadata(output_path, filename, options, cache, pdf_hash)
+                            if state is not None:
+                                state.record(Path(filename).stem, [input_path])
+                            if metrics is not None:
+                                counters, fields = cached_progressive_metrics(progressive)
+                                metrics.add(documents=1, cached_documents=1, **counters)
+                                metrics.document(filename, cached=True, chars=len(cached_text),
+                                                 **fields, seconds=round(time.time() - started, 3))
+                            success_count += 1
+                            continue
+                    pages = count_pdf_pages(input_path, options.render)
+                except Exception as e:
+                    print(f"Ошибка OCR при обработке {filename}: не удалось прочитать PDF: {str(e)}")
+                    continue
+
+                extracted = {}
+                if options.text_layer:
+                    extracted = select_text_layer_pages(
+                        input_path, pages, options.min_text_chars, options.min_cyrillic_share
+                    )
+                texts = dict(extracted)
+                info = {i: {"source": "text_layer"} for i in extracted}
+                cached_pages = 0
+                if cache is not None:
+                    for i in range(1, pages + 1):
+                        if i not in texts:
+                            text = cache.get_page(pdf_hash, i)
+                            if text is not None:
+                                texts[i] = text
+                                info[i] = {"source": "cache"}
+                                cached_pages += 1
+
+                documents[filename] = {
+                    "path": input_path,
+                    "hash": pdf_hash,
+                    "pages": pages,
+                    "texts": texts,
+                    "info": info,
+                    "extracted": len(extracted),
+                    "progress": classifier.document() if classifier is not None else None,
+                    "fed": 1,
+                    "in_flight": 0,
+                    "skipped": [],
+                    "deferred": 0,
+                    "cached": cached_pages,
+                    "failed": False,
+                    "start_time": time.time(),
+                }
+
+            total_pages = sum(doc["pages"] - len(doc["texts"]) for doc in documents.values())
+            print(f"Всего страниц к распознаванию: {total_pages}, процессов: {workers}")
+
+            with ocr_page_pool(workers) as executor:
+                futures = {}
+                # Страницы документов, уже признанных бюджетными: решение принято,
+                # пачки больше не нужны — страницы занимают все свободные процессы.
+                # С defer_qualified они отдаются пулу, только когда нет другой работы
+                released = []
+                deferred = []
+
+                def submit(filename, page_numbers):
+                    doc = documents[filename]
+                    for page_number in page_numbers:
+                        if options.adaptive_dpi:
+                            future = executor.submit(ocr_pdf_page_adaptive, doc["path"], page_number, options)
+                        else:
+                            future = executor.submit(
+                                ocr_pdf_page, doc["path"], page_number, options.dpi, options.backend, options.render
+                            )
+                        futures[future] = (filename, page_number)
+                        doc["in_flight"] += 1
+
+                def submit_next(filename):
+                    """Следующая пачка страниц документа; без прогрессивного режима — все сразу."""
+                    doc = documents[filename]
+                    batch = options.progressive["batch_pages"] if doc["progress"] is not None else len(doc["queue"])
+                    submit(filename, doc["queue"][:batch])
+                    doc["queue"] = doc["queue"][batch:]
+
+                for filename, doc in documents.items():
+                    doc["queue"] = [i for i in range(1, doc["pages"] + 1) if i not in doc["texts"]]
+                    if not doc["queue"]:
+                        if finish_document(filename):
+                            success_count += 1
+                        continue
+                    submit_next(filename)
+
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        filename, page_number = futures.pop(future)
+                        doc = documents[filename]
+                        doc["in_flight"] -= 1
+
+                        try:
+                            text = future.result()
+                            if options.adaptive_dpi:
+                                text, doc["info"][page_number] = text
+                            else:
+                                doc["info"][page_number] = {"source": "ocr", "dpi": options.dpi}
+                            doc["texts"][page_number] = text
+                            if cache is not None:
+                                cache.put_page(doc["hash"], page_number, text)
+                        except Exception as e:
+                            if not doc["failed"]:
+                                print(f"Ошибка OCR при обработке {filename}: {str(e)}")
+                            doc["failed"] = True
+                            doc["texts"][page_number] = ""
+
+                        if doc["in_flight"] or doc["failed"]:
+                            continue
+
+                        progress = doc["progress"]
+                        if doc["queue"] and progress is not None:
+                            # Пачка готова: решение по уже распознанному началу документа
+                            while doc["fed"] in doc["texts"]:
+                                progress.add_page(doc["texts"][doc["fed"]])
+                                doc["fed"] += 1
+                            decision = progress.decide()
+                            if decision == "stop":
+                                doc["skipped"], doc["queue"] = doc["queue"], []
+                            elif decision == "qualified" and options.progressive["defer_qualified"]:
+                                doc["deferred"] = len(doc["queue"])
+                                deferred.extend((filename, i) for i in doc["queue"])
+                                doc["queue"] = []
+                            elif decision == "qualified":
+                                released.extend((filename, i) for i in doc["queue"])
+                                doc["queue"] = []
+
+                        if doc["queue"]:
+                            submit_next(filename)
+                        elif len(doc["texts"]) + len(doc["skipped"]) == doc["pages"]:
+                            if finish_document(filename):
+                                success_count += 1
+
+                    for waiting in (released, deferred):
+                        while waiting and len(futures) < workers:
+                            filename, page_number = waiting.pop(0)
+                            if not documents[filename]["failed"]:
+                                submit(filename, [page_number])
+
+        finally:
+            for pdf_hash in locked_hashes:
+                cache.unlock_document(pdf_hash)
+            locked_hashes.clear()
+
+        for _, pdf_hash in busy:
+            print(f"Документ распознаётся другим процессом, ожидаю: {pdf_hash[:12]}")
+            cache.wait_document(pdf_hash)
+        pending = [filename for filename, _ in busy]
+
+    return success_count
+
+
+def process_pdf_folder(
+    input_folder, output_folder, options=None, workers=1, cache=None, state=None, metrics=None
+):
+    """Обрабатывает все PDF файлы в папке.
+
+    workers > 1 — страницы всех PDF распределяются по пулу процессов.
+    cache — OcrCache; в конце выводится статистика и кэш ужимается до лимита.
+    state — StageState: PDF, для которых txt построен из того же файла с теми же
+    настройками, пропускаются. metrics — StageMetrics шага.
+    """
+    options = options or OcrOptions()
     Path(output_folder).mkdir(parents=True, exist_ok=True)
 
     pdf_files = [f for f in os.listdir(input_folder) if f.lower().endswith(".pdf")]
@@ -60,34 +1206,147 @@ def process_pdf_folder(input_folder, output_folder, dpi=300):
         return 0, 0
 
     print(f"Найдено {len(pdf_files)} PDF файлов для обработки")
+    if state is not None:
+        pdf_files = [
+            filename for filename in pdf_files
+            if not state.skip(
+                Path(filename).stem,
+                [os.path.join(input_folder, filename)],
+                os.path.join(output_folder, f"{Path(filename).stem}.txt"),
+            )
+        ]
+        print(f"Без изменений, пропущено: {state.skipped}")
 
-    success_count = 0
-    for filename in pdf_files:
-        input_path = os.path.join(input_folder, filename)
-        output_path = os.path.join(output_folder, f"{Path(filename).stem}.txt")
+    classifier = progressive_classifier(options)
+    if workers > 1:
+        success_count = process_pdf_folder_parallel(
+            input_folder, output_folder, pdf_files, options, workers, cache, state, metrics, classifier
+        )
+    else:
+        success_count = 0
+        for filename in pdf_files:
+            input_path = os.path.join(input_folder, filename)
+            output_path = os.path.join(output_folder, f"{Path(filename).stem}.txt")
 
-        if ocr_pdf_to_text(input_path, output_path, dpi):
-            success_count += 1
+            if ocr_pdf_to_text(input_path, output_path, options, cache, metrics, classifier):
+                success_count += 1
+                if state is not None:
+                    state.record(Path(filename).stem, [input_path])
 
     print(f"\nОбработка завершена! Успешно: {success_count}/{len(pdf_files)}")
+    if state is not None:
+        state.save()
+        if metrics is not None:
+            metrics.add(skipped=state.skipped)
+    if cache is not None:
+        if metrics is not None:
+            metrics.add(cache_hits=cache.hits, cache_misses=cache.misses, cache_bytes_saved=cache.bytes_saved)
+        print(cache.stats_line())
+        removed, total = cache.evict()
+        print(f"Размер кэша OCR: {total / 1024 ** 2:.1f} МБ, удалено записей: {removed}")
     return success_count, len(pdf_files)
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="OCR PDF документов в текст")
     parser.add_argument("--input-folder", default="downloaded_documents", help="Папка с PDF")
     parser.add_argument("--output-folder", default="text_output_ocr", help="Папка для txt после OCR")
     parser.add_argument("--dpi", type=int, default=300, help="DPI (300-400 обычно оптимально)")
-    args = parser.parse_args()
+    parser.add_argument("--workers", type=int, default=1, help="Число процессов OCR (1 — последовательно)")
+    parser.add_argument(
+        "--page-batch", type=int, default=10,
+        help="Сколько страниц рендерить за раз (ограничивает память; 0 — весь PDF сразу)",
+    )
+    parser.add_argument(
+        "--text-layer", action=argparse.BooleanOptionalAction, default=True,
+        help="Брать текст из текстового слоя PDF, если он пригоден (OCR только для остальных страниц)",
+    )
+    parser.add_argument(
+        "--min-text-chars", type=int, default=TEXT_LAYER_MIN_CHARS,
+        help="Минимум букв на странице, чтобы доверять текстовому слою",
+    )
+    parser.add_argument(
+        "--min-cyrillic-share", type=float, default=TEXT_LAYER_MIN_CYRILLIC_SHARE,
+        help="Минимальная доля кириллицы среди букв текстового слоя",
+    )
+    parser.add_argument(
+        "--ocr-backend", choices=OCR_BACKENDS, default="pytesseract",
+        help="pytesseract — процесс tesseract на страницу; tesserocr — постоянный движок в каждом процессе",
+    )
+    parser.add_argument(
+        "--render-backend", choices=RENDER_BACKENDS, default="pdf2image",
+        help="pymupdf — рендеринг страниц в памяти в оттенках серого, без временных JPEG",
+    )
+    parser.add_argument(
+        "--adaptive-dpi", type=int, default=0,
+        help="Сначала распознавать с этим DPI, с --dpi повторять только страницы с низкой уверенностью (0 — выкл.)",
+    )
+    parser.add_argument(
+        "--min-confidence", type=float, default=ADAPTIVE_MIN_CONFIDENCE,
+        help="Средняя уверенность слов Tesseract (0-100), ниже которой страница распознаётся повторно",
+    )
+    parser.add_argument(
+        "--progressive", action="store_true",
+        help="Распознавать пачками и не дораспознавать документы без бюджетных признаков (см. progressive.py)",
+    )
+    parser.add_argument("--rules", help="JSON правил классификации: ключевые слова и секция progressive")
+    parser.add_argument("--cache-dir", help="Папка общего кэша OCR (по умолчанию кэш отключён)")
+    parser.add_argument("--cache-max-mb", type=int, default=2048, help="Предельный размер кэша OCR (МБ)")
+    parser.add_argument("--state-dir", help="Папка состояния шагов: пропускать PDF без изменений")
+    parser.add_argument("--force", action="store_true", help="Распознать все PDF заново, даже без изменений")
+    parser.add_argument("--metrics-file", help="JSONL-файл метрик шага (см. run_metrics)")
+    args = parser.parse_args(argv)
 
     print("=== OCR обработка PDF документов ===")
     print(f"Входная папка: {args.input_folder}")
     print(f"Выходная папка: {args.output_folder}")
     print(f"Разрешение: {args.dpi} DPI")
+    if args.adaptive_dpi:
+        print(f"Адаптивный режим: сначала {args.adaptive_dpi} DPI, повтор при уверенности ниже {args.min_confidence}")
+    print(f"Процессов: {args.workers}")
+    print(f"Окно рендеринга: {args.page_batch or 'весь PDF'}")
+    print(f"Текстовый слой: {'да' if args.text_layer else 'нет'}")
+    backend = resolve_ocr_backend(args.ocr_backend)
+    print(f"Движок OCR: {backend}")
+    render = resolve_render_backend(args.render_backend)
+    print(f"Рендеринг страниц: {render}")
+    print(f"Кэш OCR: {args.cache_dir or 'отключён'}")
     print("=" * 50)
 
-    process_pdf_folder(args.input_folder, args.output_folder, args.dpi)
+    options = OcrOptions(
+        dpi=args.dpi,
+        page_batch=args.page_batch,
+        text_layer=args.text_layer,
+        min_text_chars=args.min_text_chars,
+        min_cyrillic_share=args.min_cyrillic_share,
+        backend=backend,
+        render=render,
+        adaptive_dpi=args.adaptive_dpi,
+        min_confidence=args.min_confidence,
+    )
+    if args.progressive:
+        from classifier_cli import load_rules
+        from progressive import progressive_settings
+
+        options.progressive = progressive_settings(load_rules(args.rules))
+        print(
+            f"Прогрессивный режим: пачки по {options.progressive['batch_pages']} стр., "
+            f"остановка после {options.progressive['stop_after_pages']} стр. без бюджетных признаков"
+        )
+    cache = None
+    if args.cache_dir:
+        cache = OcrCache(args.cache_dir, options, args.cache_max_mb * 1024 ** 2)
+
+    state = StageState(args.state_dir, "ocr", options.state_params(), args.force) if args.state_dir else None
+
+    metrics = StageMetrics(args.metrics_file, "ocr")
+    success_count, total = process_pdf_folder(
+        args.input_folder, args.output_folder, options, args.workers, cache, state, metrics
+    )
+    metrics.finish(succeeded=success_count, failed=total - success_count, workers=args.workers, dpi=args.dpi)
 
 
 if __name__ == "__main__":
-    main()
+    from daemon_cli import run_cli
+
+    run_cli(__file__, main)
@@ -1,30 +1,219 @@
 import pymorphy3
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
+import json
+import os
+import re
 import time
 import argparse
 
+from run_metrics import StageMetrics
+from stage_state import StageState
+
+
+TEXT_EXTENSIONS = {".txt", ".text", ".md", ".rtf", ""}
+# Всё, кроме букв и дефиса: не-\w символы, цифры и подчёркивание
+NON_WORD_CHARS_RE = re.compile(r"[^\w-]|[\d_]")
+# Сколько символов читать за раз при потоковой нормализации
+READ_BLOCK_CHARS = 1024 * 1024
+
+
+_morph_analyzer = None
+
+
+def morph_analyzer():
+    """MorphAnalyzer процесса: словари pymorphy3 загружаются один раз.
+
+    Разбор только читает словари, поэтому анализатор общий для всех
+    нормализаторов и потоков процесса (в т.ч. заданий daemon_cli.py);
+    при запуске из командной строки рабочие процессы пулов получают уже
+    загруженный анализатор при fork. В демоне пулы порождаются forkserver,
+    где заранее импортирован только модуль: словари загружаются один раз
+    в каждом рабочем процессе (_init_worker).
+    """
+    global _morph_analyzer
+    if _morph_analyzer is None:
+        _morph_analyzer = pymorphy3.MorphAnalyzer()
+    return _morph_analyzer
+
+
+def iter_text_blocks(stream, block_chars: int = READ_BLOCK_CHARS):
+    """Читает текстовый поток блоками ~block_chars символов, не разрывая слова.
+
+    Каждый блок, кроме последнего, заканчивается пробельным символом.
+    """
+    tail = ""
+    while True:
+        block = stream.read(block_chars)
+        if not block:
+            break
+        block = tail + block
+        if block[-1].isspace():
+            tail = ""
+        else:
+            cut = len(block.rstrip()) - len(block.rstrip().split()[-1]) if block.strip() else 0
+            block, tail = block[:cut], block[cut:]
+            if not block:
+                continue
+        yield block
+    if tail:
+        yield tail
+
 
 class TextNormalizer:
-    def __init__(self):
-        self.morph = pymorphy3.MorphAnalyzer()
+    """Лемматизатор на pymorphy3 с ограниченным кэшем «слово → начальная форма».
+
+    Тексты OCR сильно повторяются («субъект», «Российской», «Федерации»,
+    названия регионов), поэтому каждое слово разбирается pymorphy3 один раз.
+    cache_path — JSON-файл, из которого кэш загружается при старте и куда
+    сохраняется методом save_cache (следующие запуски стартуют «прогретыми»).
+    """
+
+    def __init__(self, cache_size: int = 200_000, cache_path=None):
+        self.morph = morph_analyzer()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Новые слова с последнего take_stats (нужны для слияния кэшей рабочих процессов)
+        self.new_entries = {}
+        self.cache_path = Path(cache_path) if cache_path else None
+        if self.cache_path is not None:
+            self.load_cache()
+
+    @staticmethod
+    def clean_word(word: str) -> str:
+        """Оставляет в слове только буквы и дефис."""
+        if word.isalpha():
+            return word
+        cleaned = NON_WORD_CHARS_RE.sub("", word)
+        if cleaned.replace("-", "").isalpha():
+            return cleaned
+        # Редкие символы вида «²», «½»: \w, но не буквы — проверяем посимвольно
+        return "".join(char for char in cleaned if char.isalpha() or char == "-")
+
+    def lemmatize(self, clean_word: str) -> str:
+        """Начальная форма очищенного слова (через кэш)."""
+        normal_form = self.cache.get(clean_word)
+        if normal_form is not None:
+            self.hits += 1
+            self.cache.move_to_end(clean_word)
+            return normal_form
+
+        self.misses += 1
+        try:
+            normal_form = self.morph.parse(clean_word)[0].normal_form
+        except Exception:
+            normal_form = clean_word
+
+        self.cache[clean_word] = normal_form
+        self.new_entries[clean_word] = normal_form
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return normal_form
+
+    def normalize_word(self, word: str) -> str:
+        clean_word = self.clean_word(word)
+        return self.lemmatize(clean_word) if clean_word else word
 
     def normalize_text(self, text: str) -> str:
         """Приводит все слова в тексте к начальной форме."""
-        words = text.split()
-        normalized_words = []
-
-        for word in words:
-            clean_word = "".join(char for char in word if char.isalpha() or char == "-")
-            if clean_word:
-                try:
-                    parsed = self.morph.parse(clean_word)[0]
-                    normalized_words.append(parsed.normal_form)
-                except Exception:
-                    normalized_words.append(clean_word)
-            else:
-                normalized_words.append(word)
+        return " ".join(self.normalize_word(word) for word in text.split())
+
+    def normalize_stream(self, source, target, block_chars: int = READ_BLOCK_CHARS):
+        """Потоковая нормализация: читает source блоками и сразу пишет результат в target.
+
+        Результат совпадает с normalize_text(source.read()), но память не зависит от размера текста.
+        Возвращает число слов.
+        """
+        word_count = 0
+        for block in iter_text_blocks(source, block_chars):
+            words = block.split()
+            if not words:
+                continue
+            if word_count:
+                target.write(" ")
+            target.write(" ".join(self.normalize_word(word) for word in words))
+            word_count += len(words)
+        return word_count
+
+    def normalize_file(self, input_path, output_path) -> int:
+        """Нормализует файл потоково; результат появляется под output_path только целиком."""
+        output_path = Path(output_path)
+        partial_path = output_path.with_name(f"{output_path.name}.part")
+        try:
+            with open(input_path, encoding="utf-8", errors="ignore") as source, \
+                    open(partial_path, "w", encoding="utf-8") as target:
+                word_count = self.normalize_stream(source, target)
+            os.replace(partial_path, output_path)
+        finally:
+            if partial_path.exists():
+                partial_path.unlink()
+        return word_count
+
+    def normalize_many(self, texts) -> list:
+        """Нормализует пачку текстов: уникальный словарь пачки лемматизируется один раз."""
+        tokenized = [text.split() for text in texts]
+        vocabulary = {}
+        for words in tokenized:
+            for word in words:
+                if word not in vocabulary:
+                    vocabulary[word] = None
+
+        for word in vocabulary:
+            clean_word = self.clean_word(word)
+            vocabulary[word] = self.lemmatize(clean_word) if clean_word else word
+
+        return [" ".join(vocabulary[word] for word in words) for words in tokenized]
+
+    def take_stats(self):
+        """Возвращает (hits, misses, new_entries) с прошлого вызова и обнуляет их."""
+        stats = (self.hits, self.misses, self.new_entries)
+        self.hits = 0
+        self.misses = 0
+        self.new_entries = {}
+        return stats
+
+    def merge_stats(self, hits, misses, new_entries):
+        """Учитывает статистику и новые слова рабочего процесса."""
+        self.hits += hits
+        self.misses += misses
+        for clean_word, normal_form in new_entries.items():
+            self.cache[clean_word] = normal_form
+            self.cache.move_to_end(clean_word)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
 
-        return " ".join(normalized_words)
+    def cache_stats(self) -> str:
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return f"Кэш лемм: попаданий {self.hits} из {lookups} ({rate:.1f}%), слов в кэше: {len(self.cache)}"
+
+    @staticmethod
+    def state_params():
+        """От чего зависит результат нормализации (для инкрементальных перезапусков)."""
+        return {"pymorphy3": pymorphy3.__version__}
+
+    def load_cache(self):
+        try:
+            data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if data.get("pymorphy3") != pymorphy3.__version__:
+            return
+        entries = list(data.get("entries", {}).items())[-self.cache_size:]
+        self.cache.update(entries)
+        print(f"Загружен кэш лемм: {len(self.cache)} слов из {self.cache_path}")
+
+    def save_cache(self):
+        if self.cache_path is None:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}.tmp")
+        payload = {"pymorphy3": pymorphy3.__version__, "entries": self.cache}
+        tmp_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.cache_path)
 
 
 def setup_directories(input_path: str, output_suffix: str = "_normalized"):
@@ -37,59 +226,297 @@ def setup_directories(input_path: str, output_suffix: str = "_normalized"):
     return input_dir, output_dir
 
 
-def process_files(input_dir: Path, output_dir: Path, normalizer: TextNormalizer):
-    text_extensions = {".txt", ".text", ".md", ".rtf", ""}
+def iter_text_files(input_dir: Path, output_dir: Path, state=None):
+    """Пары (входной файл, выходной файл) с сохранением относительных путей.
+
+    state — StageState: файлы, уже нормализованные из того же текста, пропускаются.
+    """
+    for input_file_path in input_dir.rglob("*"):
+        if input_file_path.is_file() and input_file_path.suffix.lower() in TEXT_EXTENSIONS:
+            relative = input_file_path.relative_to(input_dir)
+            output_file_path = output_dir / relative
+            if state is not None and state.skip(relative.as_posix(), [input_file_path], output_file_path):
+                continue
+            yield input_file_path, output_file_path
+
+
+def process_files(input_dir: Path, output_dir: Path, normalizer: TextNormalizer, state=None, metrics=None):
     processed_count = 0
     error_count = 0
 
-    for input_file_path in input_dir.rglob("*"):
-        if input_file_path.is_file() and input_file_path.suffix.lower() in text_extensions:
+    for input_file_path, output_file_path in iter_text_files(input_dir, output_dir, state):
+        try:
+            output_file_path.parent.mkdir(parents=True, exist_ok=True)
+            started = time.perf_counter()
+            word_count = normalizer.normalize_file(input_file_path, output_file_path)
+            if metrics is not None:
+                record_file_metrics(metrics, input_file_path, word_count, time.perf_counter() - started)
+            if state is not None:
+                state.record(input_file_path.relative_to(input_dir).as_posix(), [input_file_path])
+
+            processed_count += 1
+            if processed_count % 100 == 0:
+                print(f"Обработано файлов: {processed_count}")
+
+        except Exception as e:
+            error_count += 1
+            print(f"Ошибка при обработке {input_file_path}: {e}")
+
+    return processed_count, error_count
+
+
+def record_file_metrics(metrics, input_file_path, word_count, seconds):
+    size = input_file_path.stat().st_size
+    metrics.add(documents=1, tokens=word_count, input_bytes=size)
+    metrics.document(
+        input_file_path.name,
+        tokens=word_count,
+        bytes=size,
+        seconds=round(seconds, 3),
+        tokens_per_s=round(word_count / seconds, 1) if seconds > 0 else None,
+    )
+
+
+# Нормализатор рабочего процесса: создаётся один раз в _init_worker
+_worker_normalizer = None
+
+
+def _init_worker(cache_size, cache_path):
+    global _worker_normalizer
+    _worker_normalizer = TextNormalizer(cache_size=cache_size, cache_path=cache_path)
+
+
+def _normalize_file_task(input_path, output_path):
+    """Возвращает (число слов, секунды, статистика кэша)."""
+    started = time.perf_counter()
+    word_count = _worker_normalizer.normalize_file(input_path, output_path)
+    return word_count, time.perf_counter() - started, _worker_normalizer.take_stats()
+
+
+def _normalize_chunk_task(text):
+    return _worker_normalizer.normalize_text(text), _worker_normalizer.take_stats()
+
+
+def process_files_parallel(
+    input_dir: Path,
+    output_dir: Path,
+    normalizer: TextNormalizer,
+    workers: int = 2,
+    chunk_bytes: int = 4 * 1024 * 1024,
+    state=None,
+    metrics=None,
+):
+    """Нормализует файлы в пуле процессов; у каждого процесса свой MorphAnalyzer.
+
+    Файлы крупнее chunk_bytes читаются потоково кусками по границам слов,
+    куски нормализуются параллельно и дописываются в выходной файл в исходном
+    порядке по мере готовности. Число задач в работе ограничено, поэтому
+    память не зависит от размера файлов.
+    """
+    processed_count = 0
+    error_count = 0
+    max_pending = workers * 2
+
+    # задача -> (входной файл, номер куска или None)
+    pending = {}
+    # входной файл -> состояние потоковой записи крупного файла
+    chunked = {}
+
+    def file_done(input_file_path, error=None):
+        nonlocal processed_count, error_count
+        if error is not None:
+            error_count += 1
+            print(f"Ошибка при обработке {input_file_path}: {error}")
+            return
+        processed_count += 1
+        if state is not None:
+            state.record(input_file_path.relative_to(input_dir).as_posix(), [input_file_path])
+        if processed_count % 100 == 0:
+            print(f"Обработано файлов: {processed_count}")
+
+    def close_chunked(input_file_path, error=None):
+        entry = chunked.pop(input_file_path)
+        entry["target"].close()
+        if error is None:
+            os.replace(entry["partial"], entry["output"])
+            if metrics is not None:
+                record_file_metrics(metrics, input_file_path, entry["tokens"], time.perf_counter() - entry["started"])
+        elif entry["partial"].exists():
+            entry["partial"].unlink()
+        file_done(input_file_path, error)
+
+    def flush_chunked(input_file_path):
+        """Дописывает готовые куски подряд с начала; закрывает файл, когда записан последний."""
+        entry = chunked[input_file_path]
+        while entry["next"] in entry["ready"]:
+            part = entry["ready"].pop(entry["next"])
+            if part:
+                if entry["written"]:
+                    entry["target"].write(" ")
+                entry["target"].write(part)
+                entry["written"] = True
+                entry["tokens"] += part.count(" ") + 1
+            entry["next"] += 1
+        if entry["total"] is not None and entry["next"] == entry["total"]:
+            close_chunked(input_file_path)
+
+    def tasks():
+        for input_file_path, output_file_path in iter_text_files(input_dir, output_dir, state):
             try:
-                relative_path = input_file_path.relative_to(input_dir)
-                output_file_path = output_dir / relative_path
                 output_file_path.parent.mkdir(parents=True, exist_ok=True)
+                if input_file_path.stat().st_size <= chunk_bytes:
+                    yield input_file_path, output_file_path, None, None
+                    continue
+                source = open(input_file_path, encoding="utf-8", errors="ignore")
+                partial = output_file_path.with_name(f"{output_file_path.name}.part")
+                chunked[input_file_path] = {
+                    "output": output_file_path,
+                    "partial": partial,
+                    "target": open(partial, "w", encoding="utf-8"),
+                    "ready": {},
+                    "next": 0,
+                    "total": None,
+                    "written": False,
+                    "tokens": 0,
+                    "started": time.perf_counter(),
+                }
+            except Exception as e:
+                file_done(input_file_path, e)
+                continue
 
-                content = input_file_path.read_text(encoding="utf-8", errors="ignore")
-                normalized_content = normalizer.normalize_text(content)
-                output_file_path.write_text(normalized_content, encoding="utf-8")
+            with source:
+                blocks = iter_text_blocks(source, chunk_bytes)
+                number = 0
+                block = next(blocks, None)
+                while block is not None and input_file_path in chunked:
+                    following = next(blocks, None)
+                    if following is None:
+                        # Последний кусок: общее число известно до отправки задачи
+                        chunked[input_file_path]["total"] = number + 1
+                    yield input_file_path, output_file_path, number, block
+                    block = following
+                    number += 1
+            if input_file_path in chunked and chunked[input_file_path]["total"] is None:
+                # Ни одного куска (например, только нечитаемые байты): файл пустой
+                chunked[input_file_path]["total"] = number
+                flush_chunked(input_file_path)
 
-                processed_count += 1
-                if processed_count % 100 == 0:
-                    print(f"Обработано файлов: {processed_count}")
+    def collect(future):
+        input_file_path, number = pending.pop(future)
+        try:
+            result = future.result()
+            if number is None:
+                word_count, seconds, (hits, misses, new_entries) = result
+            else:
+                normalized, (hits, misses, new_entries) = result
+            normalizer.merge_stats(hits, misses, new_entries)
+        except Exception as e:
+            if number is None:
+                file_done(input_file_path, e)
+            elif input_file_path in chunked:
+                close_chunked(input_file_path, e)
+            return
 
-            except Exception as e:
-                error_count += 1
-                print(f"Ошибка при обработке {input_file_path}: {e}")
+        if number is None:
+            if metrics is not None:
+                record_file_metrics(metrics, input_file_path, word_count, seconds)
+            file_done(input_file_path)
+            return
+        if input_file_path not in chunked:
+            return  # файл уже завершился ошибкой
+
+        chunked[input_file_path]["ready"][number] = normalized
+        try:
+            flush_chunked(input_file_path)
+        except Exception as e:
+            if input_file_path in chunked:
+                close_chunked(input_file_path, e)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(normalizer.cache_size, str(normalizer.cache_path) if normalizer.cache_path else None),
+    ) as executor:
+        for input_file_path, output_file_path, number, block in tasks():
+            if number is None:
+                future = executor.submit(_normalize_file_task, str(input_file_path), str(output_file_path))
+            else:
+                future = executor.submit(_normalize_chunk_task, block)
+            pending[future] = (input_file_path, number)
+
+            while len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for finished in done:
+                    collect(finished)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for finished in done:
+                collect(finished)
 
     return processed_count, error_count
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Нормализация текстов (pymorphy3) в начальную форму")
     parser.add_argument("--input-folder", default="text_output_ocr", help="Папка с txt после OCR")
     parser.add_argument("--output-suffix", default="_normalized", help="Суффикс папки вывода")
-    args = parser.parse_args()
+    parser.add_argument("--cache-file", help="JSON-файл кэша лемм между запусками (по умолчанию не сохраняется)")
+    parser.add_argument("--cache-size", type=int, default=200_000, help="Максимум слов в кэше лемм")
+    parser.add_argument("--workers", type=int, default=1, help="Число процессов нормализации (1 — последовательно)")
+    parser.add_argument(
+        "--chunk-mb", type=float, default=4,
+        help="Файлы крупнее этого размера (МБ) нормализуются параллельно по кускам",
+    )
+    parser.add_argument("--state-dir", help="Папка состояния шагов: пропускать тексты без изменений")
+    parser.add_argument("--force", action="store_true", help="Нормализовать все тексты заново")
+    parser.add_argument("--metrics-file", help="JSONL-файл метрик шага (см. run_metrics)")
+    args = parser.parse_args(argv)
 
     print("Запуск нормализации текстовых файлов...")
     print(f"Исходная папка: {args.input_folder}")
 
     try:
-        normalizer = TextNormalizer()
+        normalizer = TextNormalizer(cache_size=args.cache_size, cache_path=args.cache_file)
         input_dir, output_dir = setup_directories(args.input_folder, args.output_suffix)
 
+        state = None
+        if args.state_dir:
+            state = StageState(args.state_dir, "morph", TextNormalizer.state_params(), args.force)
+
         print(f"Выходная папка: {output_dir}")
         print("Начинаю обработку...")
 
+        metrics = StageMetrics(args.metrics_file, "morph")
         start_time = time.time()
-        processed, errors = process_files(input_dir, output_dir, normalizer)
+        if args.workers > 1:
+            print(f"Процессов: {args.workers}")
+            processed, errors = process_files_parallel(
+                input_dir, output_dir, normalizer, args.workers, int(args.chunk_mb * 1024 * 1024), state, metrics
+            )
+        else:
+            processed, errors = process_files(input_dir, output_dir, normalizer, state, metrics)
         end_time = time.time()
+        normalizer.save_cache()
+        if state is not None:
+            state.save()
+        metrics.finish(
+            errors=errors,
+            skipped=state.skipped if state is not None else 0,
+            cache_hits=normalizer.hits,
+            cache_misses=normalizer.misses,
+            workers=args.workers,
+        )
 
         print("\n" + "=" * 50)
         print("ОБРАБОТКА ЗАВЕРШЕНА")
         print("=" * 50)
         print(f"Обработано файлов: {processed}")
+        if state is not None:
+            print(f"Без изменений, пропущено: {state.skipped}")
         print(f"Ошибок: {errors}")
         print(f"Затраченное время: {end_time - start_time:.2f} секунд")
+        print(normalizer.cache_stats())
         print(f"Нормализованные файлы сохранены в: {output_dir}")
 
     except Exception as e:
@@ -97,4 +524,6 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    from daemon_cli import run_cli
+
+    run_cli(__file__, main)
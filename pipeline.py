@@ -1,11 +1,19 @@
 import argparse
+import os
 import subprocess
 import sys
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
 from pathlib import Path
 from typing import Tuple, Optional
 
+from run_metrics import StageMetrics, read_records, write_prometheus
+from stage_state import StageState
+
+# Шаги, для которых ведётся состояние (runs/<неделя>/.state/<шаг>.json)
+STATE_STAGES = ("ocr", "morph", "classify")
+
 
 def parse_ddmmyyyy(s: str) -> date:
     return datetime.strptime(s, "%d.%m.%Y").date()
@@ -29,6 +37,20 @@ def friday_to_friday_range(ref: Optional[date] = None) -> Tuple[date, date]:
     return start, end
 
 
+def weekly_ranges(date_from: date, date_to: date):
+    """Недели ПТ→ПТ, покрывающие [date_from, date_to]; первая начинается в пятницу не позже date_from.
+
+    Конец недели — начало следующей: если date_to попадает на пятницу, неделя,
+    которая с неё начинается, не нужна. Хотя бы одна неделя есть всегда.
+    """
+    start, _ = friday_to_friday_range(date_from)
+    while True:
+        yield start, start + timedelta(days=7)
+        start += timedelta(days=7)
+        if start >= date_to:
+            break
+
+
 def setup_logger(log_path: Path) -> logging.Logger:
     log_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -60,6 +82,26 @@ def run_step(cmd: list[str], title: str, logger: logging.Logger):
     logger.info("CMD: %s", " ".join(cmd))
     logger.info(sep)
 
+    # Если запущен daemon_cli.py serve — шаг выполняется в нём, без нового интерпретатора
+    from daemon_cli import submit
+
+    pending = ""
+
+    def log_output(text):
+        nonlocal pending
+        *lines, pending = (pending + text).split("\n")
+        for line in lines:
+            logger.info(line)
+
+    rc = submit(cmd[1], cmd[2:], log_output)
+    if rc is not None:
+        if pending:
+            logger.info(pending)
+        logger.info("(шаг выполнен демоном)")
+        if rc != 0:
+            raise SystemExit(f"Шаг упал с кодом {rc}: {title}")
+        return
+
     # Потоковый вывод: и в консоль, и в лог
     proc = subprocess.Popen(
         cmd,
@@ -80,6 +122,166 @@ def run_step(cmd: list[str], title: str, logger: logging.Logger):
         raise SystemExit(f"Шаг упал с кодом {rc}: {title}")
 
 
+def dry_run(args, paths: dict, state_dir: Path, force: set, logger: logging.Logger):
+    """Печатает, какие документы каждый шаг пересчитал бы, ничего не запуская.
+
+    Документ, который пересчитывается на одном шаге, пересчитывается и на всех следующих.
+    """
+    from minepdf_cli import OcrOptions, resolve_ocr_backend, resolve_render_backend
+    from morphy_cli import TextNormalizer
+    from classifier_cli import classification_params, load_rules
+
+    rules = load_rules(args.rules)
+    regions = [name.strip() for name in args.regions.split(",")] if args.regions else None
+    progressive = None
+    if args.progressive:
+        from progressive import progressive_settings
+
+        progressive = progressive_settings(rules)
+    states = {
+        "ocr": StageState(state_dir, "ocr", OcrOptions(
+            dpi=args.dpi,
+            backend=resolve_ocr_backend(args.ocr_backend),
+            render=resolve_render_backend(args.render_backend),
+            adaptive_dpi=args.adaptive_dpi,
+            min_confidence=args.min_confidence,
+            progressive=progressive,
+        ).state_params(), "ocr" in force),
+        "morph": StageState(state_dir, "morph", TextNormalizer.state_params(), "morph" in force),
+        "classify": StageState(
+            state_dir, "classify", classification_params(rules, regions, args.extract_tables), "classify" in force
+        ),
+    }
+
+    logger.info("DRY RUN: скачивание не выполняется, учитываются PDF, уже лежащие в %s", paths["pdf"])
+    pdf_files = sorted(paths["pdf"].glob("*.pdf")) if paths["pdf"].exists() else []
+    planned = {stage: 0 for stage in STATE_STAGES}
+    for pdf_path in pdf_files:
+        txt_path = paths["ocr"] / f"{pdf_path.stem}.txt"
+        norm_path = paths["norm"] / txt_path.name
+        classify_inputs = [norm_path]
+        if args.extract_tables:
+            classify_inputs.append(txt_path)
+
+        reasons = {"ocr": states["ocr"].check(pdf_path.stem, [pdf_path], txt_path)}
+        reasons["morph"] = "upstream" if reasons["ocr"] else states["morph"].check(
+            txt_path.name, [txt_path], norm_path
+        )
+        reasons["classify"] = "upstream" if reasons["morph"] else states["classify"].check(
+            pdf_path.stem, classify_inputs, None
+        )
+
+        stages = []
+        for stage, reason in reasons.items():
+            if reason:
+                planned[stage] += 1
+                stages.append(f"{stage} ({states[stage].reason_text(reason)})")
+        if stages:
+            logger.info("  %s: %s", pdf_path.name, ", ".join(stages))
+
+    logger.info("Документов: %d", len(pdf_files))
+    for stage in STATE_STAGES:
+        logger.info("  %s: пересчитать %d, без изменений %d", stage, planned[stage], len(pdf_files) - planned[stage])
+
+
+def week_command(args, base_dir: Path, start: date, end: date, parallel: int) -> list[str]:
+    """Команда запуска одной недели backfill: общий бюджет исполнителей делится между неделями."""
+    cmd = [
+        sys.executable, str(base_dir / "pipeline.py"),
+        "--date-from", start.strftime("%d.%m.%Y"),
+        "--date-to", end.strftime("%d.%m.%Y"),
+        "--base-dir", str(base_dir),
+        "--dpi", str(args.dpi),
+        "--adaptive-dpi", str(args.adaptive_dpi),
+        "--min-confidence", str(args.min_confidence),
+        "--page-size", str(args.page_size),
+        "--download-workers", str(max(1, args.download_workers // parallel)),
+        "--download-rate", str(args.download_rate / parallel),
+        "--ocr-workers", str(max(1, args.ocr_workers // parallel)),
+        "--morph-workers", str(max(1, args.morph_workers // parallel)),
+        "--link-mode", args.link_mode,
+        "--ocr-cache-max-mb", str(args.ocr_cache_max_mb),
+        "--base-url", args.base_url,
+        "--triage", args.triage,
+        "--ocr-backend", args.ocr_backend,
+        "--render-backend", args.render_backend,
+    ]
+    if args.rules:
+        cmd += ["--rules", args.rules]
+    if args.regions:
+        cmd += ["--regions", args.regions]
+    for flag in ("extract_tables", "streaming", "dry_run", "progressive"):
+        if getattr(args, flag):
+            cmd.append("--" + flag.replace("_", "-"))
+    if not args.ocr_cache:
+        cmd.append("--no-ocr-cache")
+    for stage in args.force_stage:
+        cmd += ["--force-stage", stage]
+    return cmd
+
+
+def run_backfill(args, base_dir: Path):
+    """Прогоняет диапазон дат по неделям, по args.backfill_parallel недель одновременно.
+
+    Каждая неделя — обычный запуск pipeline.py со своей папкой runs/<неделя>/ и
+    логом. Документы на стыке недель скачиваются и распознаются один раз: загрузки
+    делятся через индекс documents.sqlite, распознавание — через кэш OCR.
+    Одновременные недели выполняют шаги сами, без демона (daemon_cli.py).
+    """
+    date_from, date_to = (parse_ddmmyyyy(value) for value in args.backfill)
+    if date_from > date_to:
+        raise SystemExit("--backfill: дата начала позже даты конца")
+    weeks = list(weekly_ranges(date_from, date_to))
+    parallel = max(1, min(args.backfill_parallel, len(weeks)))
+
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_path = base_dir / "runs" / f"backfill_{date_from.isoformat()}__{date_to.isoformat()}_{ts}.log"
+    logger = setup_logger(log_path)
+    logger.info("Backfill: %s — %s, недель %d, одновременно %d", args.backfill[0], args.backfill[1], len(weeks), parallel)
+    logger.info("LOG_FILE: %s", log_path)
+    if not args.ocr_cache:
+        logger.warning("Кэш OCR отключён: документы на стыке недель будут распознаны дважды")
+
+    env = None
+    if parallel > 1:
+        # Демон выполняет задания по одному: недели, идущие через него, ждали бы
+        # друг друга с урезанным на parallel числом процессов OCR и нормализации
+        from daemon_cli import DISABLE_ENV
+
+        env = {**os.environ, DISABLE_ENV: "off"}
+
+    def run_week(week):
+        start, end = week
+        label = f"{start.isoformat()}__{end.isoformat()}"
+        logger.info("Неделя %s: старт", label)
+        started = datetime.now()
+        proc = subprocess.run(
+            week_command(args, base_dir, start, end, parallel),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+        elapsed = (datetime.now() - started).total_seconds()
+        if proc.returncode != 0:
+            logger.error("Неделя %s: ошибка (код %d), %.0f сек. Конец вывода:", label, proc.returncode, elapsed)
+            for line in proc.stdout.splitlines()[-20:]:
+                logger.error("  %s", line)
+            return False
+        logger.info("Неделя %s: готово, %.0f сек", label, elapsed)
+        return True
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        results = list(executor.map(run_week, weeks))
+
+    failed = [f"{start.isoformat()}__{end.isoformat()}" for (start, end), ok in zip(weeks, results) if not ok]
+    logger.info("Backfill завершён: недель %d, с ошибками %d", len(weeks), len(failed))
+    if failed:
+        raise SystemExit(f"Недели с ошибками: {', '.join(failed)}")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Единый пайплайн: download -> OCR -> morph -> classify"
@@ -88,11 +290,97 @@ def main():
     parser.add_argument("--date-to", help="Переопределить дату конца (DD.MM.YYYY)")
     parser.add_argument("--base-dir", default=".", help="Базовая директория (по умолчанию текущая)")
     parser.add_argument("--dpi", type=int, default=300, help="DPI для OCR")
+    parser.add_argument(
+        "--adaptive-dpi", type=int, default=0,
+        help="Сначала распознавать с этим DPI, с --dpi — только страницы с низкой уверенностью (0 — выкл.)",
+    )
+    parser.add_argument(
+        "--min-confidence", type=float, default=70.0,
+        help="Порог средней уверенности слов Tesseract для адаптивного режима (0-100)",
+    )
     parser.add_argument("--page-size", type=int, default=30, help="PageSize для API скачивания")
+    parser.add_argument("--download-workers", type=int, default=4, help="Сколько PDF скачивать одновременно")
+    parser.add_argument("--download-rate", type=float, default=2.0, help="Лимит запросов к API в секунду")
+    parser.add_argument(
+        "--base-url", default="http://publication.pravo.gov.ru",
+        help="Адрес сервера API (например, заглушка benchmark_cli.py serve)",
+    )
+    parser.add_argument("--ocr-workers", type=int, default=1, help="Число процессов OCR")
+    parser.add_argument(
+        "--ocr-backend", choices=["pytesseract", "tesserocr"], default="pytesseract",
+        help="tesserocr — постоянный движок Tesseract в каждом процессе OCR (если не установлен — pytesseract)",
+    )
+    parser.add_argument(
+        "--render-backend", choices=["pdf2image", "pymupdf"], default="pdf2image",
+        help="pymupdf — рендеринг страниц в памяти, без временных JPEG (если не установлен — pdf2image)",
+    )
+    parser.add_argument("--rules", help="JSON с наборами правил классификации (см. classifier_rules.json)")
+    parser.add_argument("--regions", help="Через запятую: какие регионы из правил проверять")
+    parser.add_argument(
+        "--link-mode", choices=["copy", "hardlink", "list"], default="copy",
+        help="Как раскладывать отобранные документы по папкам результатов",
+    )
+    parser.add_argument(
+        "--extract-tables", action="store_true",
+        help="Извлечь строки таблиц распределения в runs/<неделя>/table_rows.csv",
+    )
+    parser.add_argument(
+        "--triage", choices=["off", "log", "defer"], default="off",
+        help="Отбор по метаданным API до скачивания: log — только записать решения в runs/<неделя>/triage.jsonl, "
+             "defer — не скачивать и не распознавать заведомо нерелевантные документы",
+    )
+    parser.add_argument(
+        "--no-daemon", action="store_true",
+        help="Не отправлять шаги запущенному демону (daemon_cli.py), запускать каждый своим процессом",
+    )
+    parser.add_argument(
+        "--progressive", action="store_true",
+        help="Прогрессивный OCR: распознавать пачками страниц и не дораспознавать документы без бюджетных "
+             "признаков (настройки — секция progressive правил)",
+    )
+    parser.add_argument(
+        "--streaming", action="store_true",
+        help="Потоковый режим в одном процессе: документ идёт на OCR сразу после скачивания и т.д.",
+    )
+    parser.add_argument(
+        "--force-stage", action="append", choices=[*STATE_STAGES, "all"], default=[],
+        help="Пересчитать шаг для всех документов, даже без изменений (можно повторять)",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Только показать, какие документы будут пересчитаны на каждом шаге",
+    )
+    parser.add_argument("--morph-workers", type=int, default=1, help="Число процессов нормализации")
+    parser.add_argument(
+        "--ocr-cache", action=argparse.BooleanOptionalAction, default=True,
+        help="Общий кэш OCR в <base-dir>/ocr_cache",
+    )
+    parser.add_argument("--ocr-cache-max-mb", type=int, default=2048, help="Предельный размер кэша OCR (МБ)")
+    parser.add_argument(
+        "--prometheus-file",
+        help="Записать итоги шагов в textfile для Prometheus (node_exporter --collector.textfile)",
+    )
+    parser.add_argument(
+        "--backfill", nargs=2, metavar=("FROM", "TO"),
+        help="Обработать диапазон DD.MM.YYYY по неделям ПТ→ПТ (каждая неделя — своя папка runs/)",
+    )
+    parser.add_argument(
+        "--backfill-parallel", type=int, default=2,
+        help="Сколько недель backfill обрабатывать одновременно (--*-workers и --download-rate делятся между ними)",
+    )
     args = parser.parse_args()
+    if args.no_daemon:
+        # Наследуют и недели backfill, запущенные отдельными процессами
+        from daemon_cli import DISABLE_ENV
+
+        os.environ[DISABLE_ENV] = "off"
 
     base_dir = Path(args.base_dir).resolve()
 
+    if args.backfill:
+        run_backfill(args, base_dir)
+        return
+
     if args.date_from and args.date_to:
         start_d = parse_ddmmyyyy(args.date_from)
         end_d = parse_ddmmyyyy(args.date_to)
@@ -114,6 +402,13 @@ def main():
     norm_dir = run_dir / "text_output_ocr_normalized"
     out_budget = run_dir / "бюджетные_документы"
     out_cfo = run_dir / "документы_цфо"
+    summary_path = run_dir / "classification_summary.json"
+    manifest_path = run_dir / "manifest.json"
+    tables_csv = run_dir / "table_rows.csv"
+    state_dir = run_dir / ".state"
+    metrics_path = run_dir / "metrics.jsonl"
+    triage_log = run_dir / "triage.jsonl"
+    force = set(STATE_STAGES) if "all" in args.force_stage else set(args.force_stage)
 
     date_from = start_d.strftime("%d.%m.%Y")
     date_to = end_d.strftime("%d.%m.%Y")
@@ -124,47 +419,143 @@ def main():
     logger.info("RUN_DIR: %s", run_dir)
     logger.info("LOG_FILE: %s", log_path)
 
-    py = sys.executable
-
-    # 1) Download PDFs
-    run_step(
-        [py, str(base_dir / "download_pdf_cli.py"),
-         "--date-from", date_from, "--date-to", date_to,
-         "--download-dir", str(pdf_dir),
-         "--page-size", str(args.page_size)],
-        "ШАГ 1/4: Скачивание PDF",
-        logger,
-    )
-
-    # 2) OCR PDFs -> TXT
-    run_step(
-        [py, str(base_dir / "minepdf_cli.py"),
-         "--input-folder", str(pdf_dir),
-         "--output-folder", str(ocr_dir),
-         "--dpi", str(args.dpi)],
-        "ШАГ 2/4: OCR (PDF -> TXT)",
-        logger,
-    )
-
-    # 3) Normalize (morphy)
-    run_step(
-        [py, str(base_dir / "morphy_cli.py"),
-         "--input-folder", str(ocr_dir),
-         "--output-suffix", "_normalized"],
-        "ШАГ 3/4: Нормализация (pymorphy3)",
-        logger,
-    )
-
-    # 4) Classify / filter
-    run_step(
-        [py, str(base_dir / "classifier_cli.py"),
-         "--source-folder", str(ocr_dir),
-         "--normalized-folder", str(norm_dir),
-         "--output-budget", str(out_budget),
-         "--output-cfo", str(out_cfo)],
-        "ШАГ 4/4: Классификация/отбор",
-        logger,
+    paths = {
+        "pdf": pdf_dir,
+        "ocr": ocr_dir,
+        "norm": norm_dir,
+        "budget": out_budget,
+        "cfo": out_cfo,
+        "summary": summary_path,
+        "manifest": manifest_path,
+        "tables": tables_csv,
+        "triage": triage_log,
+    }
+    if args.dry_run:
+        dry_run(args, paths, state_dir, force, logger)
+        return
+
+    def state_args(stage):
+        return ["--state-dir", str(state_dir)] + (["--force"] if stage in force else [])
+
+    # Записи этого запуска в metrics.jsonl начинаются с текущего конца файла
+    metrics_offset = metrics_path.stat().st_size if metrics_path.exists() else 0
+    pipeline_metrics = StageMetrics(metrics_path, "pipeline")
+    metrics_args = ["--metrics-file", str(metrics_path)]
+
+    triage_args = []
+    if args.triage != "off":
+        triage_args = ["--triage", args.triage, "--triage-log", str(triage_log)]
+        if args.rules:
+            triage_args += ["--rules", args.rules]
+
+    if args.streaming:
+        from stream_pipeline import run_streaming
+
+        run_streaming(args, date_from, date_to, base_dir, paths, logger, state_dir, force, metrics_path)
+    else:
+        py = sys.executable
+
+        # 1) Download PDFs
+        run_step(
+            [py, str(base_dir / "download_pdf_cli.py"),
+             "--date-from", date_from, "--date-to", date_to,
+             "--download-dir", str(pdf_dir),
+             "--page-size", str(args.page_size),
+             "--workers", str(args.download_workers),
+             "--rate", str(args.download_rate),
+             "--base-url", args.base_url,
+             "--index-db", str(base_dir / "documents.sqlite"),
+             "--manifest", str(manifest_path),
+             *metrics_args,
+             *triage_args],
+            "ШАГ 1/4: Скачивание PDF",
+            logger,
+        )
+
+        # 2) OCR PDFs -> TXT
+        ocr_cmd = [py, str(base_dir / "minepdf_cli.py"),
+                   "--input-folder", str(pdf_dir),
+                   "--output-folder", str(ocr_dir),
+                   "--dpi", str(args.dpi),
+                   "--adaptive-dpi", str(args.adaptive_dpi),
+                   "--min-confidence", str(args.min_confidence),
+                   "--workers", str(args.ocr_workers),
+                   "--ocr-backend", args.ocr_backend,
+                   "--render-backend", args.render_backend]
+        if args.ocr_cache:
+            ocr_cmd += ["--cache-dir", str(base_dir / "ocr_cache"),
+                        "--cache-max-mb", str(args.ocr_cache_max_mb)]
+        if args.progressive:
+            ocr_cmd.append("--progressive")
+            if args.rules:
+                ocr_cmd += ["--rules", args.rules]
+        ocr_cmd += state_args("ocr") + metrics_args
+        run_step(ocr_cmd, "ШАГ 2/4: OCR (PDF -> TXT)", logger)
+
+        # 3) Normalize (morphy)
+        run_step(
+            [py, str(base_dir / "morphy_cli.py"),
+             "--input-folder", str(ocr_dir),
+             "--output-suffix", "_normalized",
+             "--cache-file", str(base_dir / "morph_cache.json"),
+             "--workers", str(args.morph_workers),
+             *state_args("morph"),
+             *metrics_args],
+            "ШАГ 3/4: Нормализация (pymorphy3)",
+            logger,
+        )
+
+        # 4) Classify / filter
+        classify_cmd = [py, str(base_dir / "classifier_cli.py"),
+                        "--source-folder", str(ocr_dir),
+                        "--normalized-folder", str(norm_dir),
+                        "--output-budget", str(out_budget),
+                        "--output-cfo", str(out_cfo),
+                        "--summary", str(summary_path),
+                        "--manifest", str(manifest_path),
+                        "--link-mode", args.link_mode]
+        if args.rules:
+            classify_cmd += ["--rules", args.rules]
+        if args.regions:
+            classify_cmd += ["--regions", args.regions]
+        if args.extract_tables:
+            classify_cmd += ["--tables-csv", str(tables_csv)]
+        classify_cmd += state_args("classify") + metrics_args
+        run_step(classify_cmd, "ШАГ 4/4: Классификация/отбор", logger)
+
+    record = pipeline_metrics.finish(week=run_dir.name, mode="streaming" if args.streaming else "sequential")
+    logger.info(
+        "Метрики: %.1f сек, CPU %.1f сек (в дочерних процессах %.1f) -> %s",
+        record["wall_s"], record["cpu_s"], record["cpu_children_s"], metrics_path,
     )
+    if args.prometheus_file:
+        write_prometheus(read_records(metrics_path, metrics_offset), args.prometheus_file, week=run_dir.name)
+        logger.info("Метрики Prometheus: %s", args.prometheus_file)
+
+    if args.triage != "off" and triage_log.exists() and summary_path.exists():
+        from triage import triage_recall
+
+        recall = triage_recall(triage_log, summary_path)
+        logger.info(
+            "Триаж: документов %d, нерелевантных по метаданным %d, отложено %d; "
+            "бюджетных в сводке %d, из них помечены нерелевантными %d (полнота %s)",
+            recall["items"], recall["irrelevant"], recall["deferred"], recall["budget"], len(recall["missed"]),
+            "—" if recall["recall"] is None else f"{recall['recall']:.1%}",
+        )
+        for eo_number in recall["missed"]:
+            logger.warning("Триаж пропустил бы бюджетный документ: %s", eo_number)
+
+    if args.progressive:
+        from progressive import progressive_summary
+
+        progress = progressive_summary(ocr_dir)
+        logger.info(
+            "Прогрессивный OCR: документов %d, признаны бюджетными досрочно %d, "
+            "остановлены без бюджетных признаков %d (не распознано страниц: %d)",
+            progress["documents"], progress["qualified"], len(progress["stopped"]), progress["skipped_pages"],
+        )
+        for stem in progress["stopped"]:
+            logger.info("OCR остановлен досрочно: %s (см. %s.ocr.json)", stem, stem)
 
     logger.info("ГОТОВО ✅")
     logger.info("Результаты:")
@@ -173,6 +564,11 @@ def main():
     logger.info("  Normalized txt: %s", norm_dir)
     logger.info("  Бюджетные документы: %s", out_budget)
     logger.info("  Документы ЦФО: %s", out_cfo)
+    logger.info("  Сводка классификации: %s", summary_path)
+    if args.triage != "off":
+        logger.info("  Решения триажа: %s", triage_log)
+    if args.extract_tables:
+        logger.info("  Строки таблиц: %s", tables_csv)
 
 
 if __name__ == "__main__":
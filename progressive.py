@@ -0,0 +1,135 @@
+"""Прогрессивный OCR с оглядкой на классификацию (minepdf_cli.py --progressive).
+
+Документ распознаётся пачками страниц; после каждой пачки уже готовый текст
+нормализуется и проверяется ключевыми словами правил. Если в первых
+stop_after_pages страницах нет ни бюджетных слов, ни таблицы распределения,
+ни слов-сигналов (signal), остальные страницы не распознаются. Документ, уже
+признанный бюджетным и с найденным регионом, дораспознаётся в пуле процессов
+в последнюю очередь (defer_qualified). Настройки — секция "progressive" правил,
+решение по каждому документу — в <имя>.ocr.json рядом с txt.
+"""
+import json
+from pathlib import Path
+
+from classifier_cli import TableScanner, keyword_matcher
+from morphy_cli import TextNormalizer
+from triage import DEFAULT_KEEP_KEYWORDS
+
+DEFAULT_PROGRESSIVE = {
+    "batch_pages": 2,
+    "stop_after_pages": 4,
+    "defer_qualified": True,
+}
+
+
+def progressive_settings(rules) -> dict:
+    """Настройки прогрессивного OCR для набора правил (входят в ключ кэша OCR).
+
+    Слова-сигналы по умолчанию — keep из секции triage: документ, где речь
+    о финансировании, распознаётся целиком, даже без бюджетных терминов.
+    """
+    section = rules.get("progressive", {})
+    settings = {key: section.get(key, default) for key, default in DEFAULT_PROGRESSIVE.items()}
+    settings["batch_pages"] = max(1, int(settings["batch_pages"]))
+    settings["signal"] = section.get("signal", rules.get("triage", {}).get("keep", DEFAULT_KEEP_KEYWORDS))
+    settings["budget"] = rules["budget"]["keywords"]
+    settings["regions"] = {name: spec["keywords"] for name, spec in rules["regions"].items()}
+    return settings
+
+
+class ProgressiveClassifier:
+    """Проверки, общие для всех документов процесса: автомат ключевых слов и нормализатор."""
+
+    def __init__(self, settings, normalizer=None):
+        self.settings = settings
+        self.normalizer = normalizer or TextNormalizer()
+        self.table_scanner = TableScanner()
+        self.matcher = keyword_matcher({
+            "budget": settings["budget"],
+            "signal": settings["signal"],
+            **{f"region:{name}": keywords for name, keywords in settings["regions"].items()},
+        })
+
+    def document(self):
+        return DocumentProgress(self)
+
+
+class DocumentProgress:
+    """Решение по одному документу по мере поступления страниц (строго по порядку).
+
+    decide() возвращает qualified (бюджетный, регион найден), stop (сигналов нет)
+    или None — распознавать дальше. Проверка выполняется раз в batch_pages страниц.
+    """
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.settings = classifier.settings
+        self.normalized = []
+        self.raw = []
+        self.pages = 0
+        self.checked_at = 0
+        self.decision = None
+        self.decided_at_page = None
+        self.budget = False
+        self.regions = []
+
+    def add_page(self, text):
+        self.raw.append(text)
+        self.normalized.append(self.classifier.normalizer.normalize_text(text))
+        self.pages += 1
+
+    def decide(self):
+        if self.decision is not None:
+            return self.decision
+        if self.pages - self.checked_at < self.settings["batch_pages"]:
+            return None
+        self.checked_at = self.pages
+
+        matches = self.classifier.matcher.scan("\n".join(self.normalized))
+        self.budget = bool(matches["budget"]) or self.classifier.table_scanner.has_table("".join(self.raw))
+        self.regions = [name for name in self.settings["regions"] if matches[f"region:{name}"]]
+        if self.budget and self.regions:
+            self.decision = "qualified"
+        elif not self.budget and not matches["signal"] and self.pages >= self.settings["stop_after_pages"]:
+            self.decision = "stop"
+        if self.decision is not None:
+            self.decided_at_page = self.pages
+        return self.decision
+
+    def record(self, skipped_pages=(), deferred_pages=0) -> dict:
+        """Запись для <имя>.ocr.json: решение, на какой странице оно принято, что пропущено."""
+        return {
+            "decision": {"qualified": "qualified", "stop": "stopped"}.get(self.decision, "complete"),
+            "decided_at_page": self.decided_at_page,
+            "pages_checked": self.checked_at,
+            "budget": self.budget,
+            "regions": self.regions,
+            "skipped_pages": list(skipped_pages),
+            "deferred_pages": deferred_pages,
+        }
+
+
+def progressive_summary(ocr_folder) -> dict:
+    """Сводка решений по <имя>.ocr.json папки OCR: какие документы остановлены досрочно.
+
+    Остановленные документы — кандидаты на выборочную сверку полноты
+    (распознать целиком без --progressive и сравнить классификацию).
+    """
+    stopped = []
+    skipped_pages = qualified = documents = 0
+    for path in sorted(Path(ocr_folder).glob("*.ocr.json")):
+        progressive = json.loads(path.read_text(encoding="utf-8")).get("progressive")
+        if progressive is None:
+            continue
+        documents += 1
+        if progressive["decision"] == "stopped":
+            stopped.append(path.name[: -len(".ocr.json")])
+            skipped_pages += len(progressive["skipped_pages"])
+        elif progressive["decision"] == "qualified":
+            qualified += 1
+    return {
+        "documents": documents,
+        "qualified": qualified,
+        "stopped": stopped,
+        "skipped_pages": skipped_pages,
+    }
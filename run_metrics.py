@@ -0,0 +1,167 @@
+"""Метрики шагов пайплайна.
+
+Каждый шаг пишет в runs/<неделя>/metrics.jsonl записи по документам
+(type=document) и итог шага (type=stage): время, CPU, пиковую память,
+счётчики и производные скорости. Итоги можно выгрузить в textfile для
+Prometheus (node_exporter --collector.textfile).
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows: пиковая память не измеряется
+    resource = None
+
+# Счётчик -> производная скорость в итоге шага
+RATES = {
+    "pages": "pages_per_s",
+    "tokens": "tokens_per_s",
+    "documents": "documents_per_s",
+    "bytes": "bytes_per_s",
+}
+
+PROMETHEUS_PREFIX = "federal_mbt"
+
+
+def peak_rss_mb(children=False):
+    """Пиковый RSS процесса (или самого «тяжёлого» завершённого дочернего) в МБ; None, если неизвестен."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss: Linux — КБ, macOS — байты
+    divisor = 1024 ** 2 if sys.platform == "darwin" else 1024
+    return round(usage.ru_maxrss / divisor, 1)
+
+
+def children_cpu_seconds():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class StageMetrics:
+    """Метрики одного шага. path=None — ничего не пишется (счётчики всё равно ведутся)."""
+
+    def __init__(self, path, stage, **labels):
+        self.path = Path(path) if path else None
+        self.stage = stage
+        self.labels = labels
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._children_cpu = children_cpu_seconds()
+
+    def add(self, **counters):
+        with self.lock:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def document(self, name, **values):
+        self.write({"type": "document", "document": name, **values})
+
+    def finish(self, resources=True, **values):
+        """Пишет итог шага и возвращает его.
+
+        resources=False — без CPU и памяти (когда в процессе идут и другие шаги).
+        """
+        wall = time.perf_counter() - self._wall
+        record = {"type": "stage", "started_at": self.started_at, "wall_s": round(wall, 3)}
+        if resources:
+            record.update({
+                "cpu_s": round(time.process_time() - self._cpu, 3),
+                "cpu_children_s": round(children_cpu_seconds() - self._children_cpu, 3),
+                "peak_rss_mb": peak_rss_mb(),
+                "peak_rss_children_mb": peak_rss_mb(children=True),
+            })
+        with self.lock:
+            record.update(self.counters)
+        record.update(values)
+        for counter, rate in RATES.items():
+            if isinstance(record.get(counter), (int, float)) and wall > 0:
+                record[rate] = round(record[counter] / wall, 2)
+        self.write(record)
+        return record
+
+    def write(self, record):
+        if self.path is None:
+            return
+        record = {
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "stage": self.stage,
+            "pid": os.getpid(),
+            **self.labels,
+            **record,
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Одна строка — одна запись; добавление строкой целиком безопасно из нескольких процессов
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def read_records(path, offset=0):
+    """Записи metrics.jsonl, начиная с байта offset (например, только текущего запуска)."""
+    records = []
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def _metric_name(key):
+    key = re.sub(r"[^a-zA-Z0-9_]", "_", key)
+    for suffix, unit in (("_per_s", "_per_second"), ("_s", "_seconds"), ("_mb", "_megabytes")):
+        if key.endswith(suffix):
+            key = key[: -len(suffix)] + unit
+            break
+    return f"{PROMETHEUS_PREFIX}_stage_{key}"
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def write_prometheus(records, path, **labels):
+    """Числовые поля итогов шагов (type=stage) — gauge с метками stage и labels."""
+    samples = {}
+    for record in records:
+        if record.get("type") != "stage":
+            continue
+        base_labels = {"stage": record["stage"], **labels}
+        for key, value in record.items():
+            if key == "pid":
+                continue
+            # Словарь счётчиков (например, документы по регионам) — метка key
+            values = value.items() if isinstance(value, dict) else [(None, value)]
+            for subkey, number in values:
+                if isinstance(number, bool) or not isinstance(number, (int, float)):
+                    continue
+                sample_labels = base_labels if subkey is None else {**base_labels, "key": subkey}
+                label_text = ",".join(f'{name}="{_label_value(text)}"' for name, text in sample_labels.items())
+                samples.setdefault(_metric_name(key), []).append(f"{_metric_name(key)}{{{label_text}}} {number}")
+
+    lines = []
+    for name in sorted(samples):
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(samples[name])
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # textfile-коллектор читает файл в любой момент — подменяем целиком
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    os.replace(tmp_path, path)
@@ -0,0 +1,122 @@
+"""Состояние шагов пайплайна для инкрементальных перезапусков.
+
+Для каждого артефакта (txt после OCR, нормализованный txt, запись сводки)
+запоминается хэш содержимого входных файлов и хэш параметров шага. При
+повторном запуске шаг обрабатывает только документы, у которых изменился
+вход или настройки либо пропал результат.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+
+def params_hash(params) -> str:
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StageState:
+    """Состояние одного шага: <state_dir>/<stage>.json.
+
+    Записи — по ключу документа: хэш параметров, входы (размер, mtime, sha256)
+    и произвольные данные шага. Хэш входа пересчитывается, только если
+    размер или mtime файла отличаются от записанных. force — считать все
+    документы изменёнными.
+    """
+
+    REASONS = {
+        "force": "принудительно",
+        "new": "новый документ",
+        "params": "изменились параметры",
+        "input": "изменился вход",
+        "output": "нет результата",
+        "upstream": "пересчитывается предыдущий шаг",
+    }
+
+    def __init__(self, state_dir, stage, params, force=False):
+        self.path = Path(state_dir) / f"{stage}.json"
+        self.stage = stage
+        self.params_hash = params_hash(params)
+        self.force = force
+        self.skipped = 0
+        self.lock = threading.Lock()
+        self.entries = {}
+        try:
+            self.entries = json.loads(self.path.read_text(encoding="utf-8")).get("documents", {})
+        except (OSError, ValueError):
+            pass
+
+    def _inputs(self, inputs, known=None):
+        """{имя: [размер, mtime_ns, sha256]} для входных файлов."""
+        known = known or {}
+        result = {}
+        for path in inputs:
+            st = os.stat(path)
+            previous = known.get(Path(path).name)
+            if previous and previous[0] == st.st_size and previous[1] == st.st_mtime_ns:
+                result[Path(path).name] = previous
+            else:
+                result[Path(path).name] = [st.st_size, st.st_mtime_ns, file_sha256(path)]
+        return result
+
+    def _check(self, key, inputs, output):
+        if self.force:
+            return "force", None
+        entry = self.entries.get(key)
+        if entry is None:
+            return "new", None
+        if entry["params"] != self.params_hash:
+            return "params", None
+        if output is not None and not os.path.exists(output):
+            return "output", None
+        current = self._inputs(inputs, entry["inputs"])
+        if {name: value[2] for name, value in current.items()} != {
+            name: value[2] for name, value in entry["inputs"].items()
+        }:
+            return "input", None
+        return None, current
+
+    def check(self, key, inputs, output):
+        """Почему документ нужно пересчитать (код из REASONS) или None, если результат актуален."""
+        return self._check(key, inputs, output)[0]
+
+    def skip(self, key, inputs, output) -> bool:
+        """True, если результат актуален (и учитывает его в skipped)."""
+        reason, current = self._check(key, inputs, output)
+        if reason is not None:
+            return False
+        with self.lock:
+            # Файл мог быть перезаписан тем же содержимым — обновляем размер и mtime
+            self.entries[key]["inputs"] = current
+            self.skipped += 1
+        return True
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def record(self, key, inputs, **data):
+        """Запоминает, с какими входами и параметрами построен результат документа."""
+        entry = {"params": self.params_hash, "inputs": self._inputs(inputs), **data}
+        with self.lock:
+            self.entries[key] = entry
+
+    def save(self):
+        with self.lock:
+            payload = {"stage": self.stage, "params": self.params_hash, "documents": dict(self.entries)}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    def reason_text(self, reason):
+        return self.REASONS.get(reason, reason)
@@ -0,0 +1,271 @@
+"""Потоковый режим пайплайна (pipeline.py --streaming).
+
+Каждый документ проходит download -> OCR -> morph -> classify, как только готов
+предыдущий шаг, не дожидаясь остальных документов. Стадии связаны ограниченными
+очередями, у OCR и нормализации свои пулы процессов. Раскладка runs/<неделя>/
+та же, что и в последовательном режиме.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import download_pdf_cli
+import minepdf_cli
+import morphy_cli
+from classifier_cli import DocumentFilter, classification_params, load_rules
+from run_metrics import StageMetrics
+from stage_state import StageState
+
+# Сколько документов может ждать в очереди на одного исполнителя стадии
+QUEUE_PER_WORKER = 2
+
+
+@dataclass
+class StreamDocument:
+    item: dict
+    pdf_path: Path
+    txt_path: Path = None
+    norm_path: Path = None
+
+
+class Stage:
+    """Стадия: workers потоков берут документы из inbox и передают в outbox.
+
+    handler(doc) возвращает False, если документ дальше не идёт. Конец потока —
+    None в inbox; close() дожидается стадии и передаёт None дальше.
+    """
+
+    def __init__(self, name, handler, workers, inbox, outbox, logger, metrics_path=None):
+        self.name = name
+        self.metrics = StageMetrics(metrics_path, name)
+        self.handler = handler
+        self.inbox = inbox
+        self.outbox = outbox
+        self.logger = logger
+        self.done = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            doc = self.inbox.get()
+            if doc is None:
+                self.inbox.put(None)  # остальным потокам стадии
+                return
+            started = time.monotonic()
+            try:
+                ok = self.handler(doc)
+            except Exception as e:
+                self.logger.error("%s: %s — %s", self.name, doc.pdf_path.name, e)
+                ok = False
+            with self.lock:
+                self.busy_seconds += time.monotonic() - started
+                if ok:
+                    self.done += 1
+                else:
+                    self.failed += 1
+            if ok and self.outbox is not None:
+                self.outbox.put(doc)
+
+    def close(self):
+        for thread in self.threads:
+            thread.join()
+        if self.outbox is not None:
+            self.outbox.put(None)
+        self.logger.info(
+            "Стадия %s: готово %d, ошибок %d, время работы %.1f сек",
+            self.name, self.done, self.failed, self.busy_seconds,
+        )
+
+
+def run_streaming(
+    args, date_from, date_to, base_dir: Path, paths: dict, logger, state_dir=None, force=(), metrics_path=None
+):
+    """Запускает все четыре шага потоково.
+
+    paths — папки и файлы недели: pdf, ocr, norm, budget, cfo, summary, manifest, tables, triage.
+    state_dir — состояние шагов (документы без изменений не пересчитываются),
+    force — шаги, которые пересчитываются для всех документов.
+    metrics_path — metrics.jsonl недели: записи по документам и итоги стадий
+    (без CPU и памяти — они общие для процесса и пишутся итогом pipeline).
+    """
+    rules = load_rules(args.rules)
+    regions = [name.strip() for name in args.regions.split(",")] if args.regions else None
+    if regions:
+        unknown = [name for name in regions if name not in rules["regions"]]
+        if unknown:
+            raise SystemExit(f"Регионов нет в правилах: {', '.join(unknown)}")
+
+    paths["ocr"].mkdir(parents=True, exist_ok=True)
+    paths["norm"].mkdir(parents=True, exist_ok=True)
+
+    ocr_options = minepdf_cli.OcrOptions(
+        dpi=args.dpi,
+        backend=minepdf_cli.resolve_ocr_backend(args.ocr_backend),
+        render=minepdf_cli.resolve_render_backend(args.render_backend),
+        adaptive_dpi=args.adaptive_dpi,
+        min_confidence=args.min_confidence,
+    )
+    if args.progressive:
+        from progressive import progressive_settings
+
+        ocr_options.progressive = progressive_settings(rules)
+    cache_dir = base_dir / "ocr_cache" if args.ocr_cache else None
+    cache_max_bytes = args.ocr_cache_max_mb * 1024 ** 2
+    ocr_cache = minepdf_cli.OcrCache(cache_dir, ocr_options, cache_max_bytes) if cache_dir else None
+    normalizer = morphy_cli.TextNormalizer(cache_path=base_dir / "morph_cache.json")
+    ocr_state = morph_state = classify_state = None
+    if state_dir is not None:
+        ocr_state = StageState(state_dir, "ocr", ocr_options.state_params(), "ocr" in force)
+        morph_state = StageState(state_dir, "morph", normalizer.state_params(), "morph" in force)
+        classify_state = StageState(
+            state_dir, "classify", classification_params(rules, regions, args.extract_tables), "classify" in force
+        )
+    flt = DocumentFilter(
+        paths["ocr"],
+        paths["norm"],
+        paths["budget"],
+        paths["cfo"],
+        rules=rules,
+        regions=regions,
+        summary_path=paths["summary"],
+        link_mode=args.link_mode,
+        tables_csv=paths["tables"] if args.extract_tables else None,
+        state=classify_state,
+    )
+    triage = None
+    if args.triage != "off":
+        from triage import MetadataTriage
+
+        triage = MetadataTriage(rules, args.triage, paths["triage"], normalizer)
+
+    stats_lock = threading.Lock()
+    summary = []
+    table_rows = []
+
+    ocr_pool = ProcessPoolExecutor(
+        max_workers=args.ocr_workers,
+        initializer=minepdf_cli._init_worker,
+        initargs=(
+            ocr_options,
+            str(cache_dir) if cache_dir else None,
+            cache_max_bytes,
+            str(metrics_path) if metrics_path else None,
+        ),
+    )
+    morph_pool = ProcessPoolExecutor(
+        max_workers=args.morph_workers,
+        initializer=morphy_cli._init_worker,
+        initargs=(normalizer.cache_size, str(normalizer.cache_path)),
+    )
+
+    def ocr(doc):
+        doc.txt_path = paths["ocr"] / f"{doc.pdf_path.stem}.txt"
+        if ocr_state is not None and ocr_state.skip(doc.pdf_path.stem, [doc.pdf_path], doc.txt_path):
+            return True
+        ok, stats = ocr_pool.submit(minepdf_cli._ocr_document_task, str(doc.pdf_path), str(doc.txt_path)).result()
+        if ocr_cache is not None:
+            with stats_lock:
+                ocr_cache.merge_stats(*stats)
+        if ok and ocr_state is not None:
+            ocr_state.record(doc.pdf_path.stem, [doc.pdf_path])
+        return ok
+
+    def morph(doc):
+        doc.norm_path = paths["norm"] / doc.txt_path.name
+        if morph_state is not None and morph_state.skip(doc.txt_path.name, [doc.txt_path], doc.norm_path):
+            return True
+        word_count, seconds, stats = morph_pool.submit(
+            morphy_cli._normalize_file_task, str(doc.txt_path), str(doc.norm_path)
+        ).result()
+        morphy_cli.record_file_metrics(stages[1].metrics, doc.txt_path, word_count, seconds)
+        with stats_lock:
+            normalizer.merge_stats(*stats)
+        if morph_state is not None:
+            morph_state.record(doc.txt_path.name, [doc.txt_path])
+        return True
+
+    def classify(doc):
+        entry = {"eoNumber": doc.item.get("eoNumber"), "pdf": doc.pdf_path.name}
+        document, rows = flt.classify_document(doc.norm_path, doc.txt_path, entry)
+        summary.append(document)
+        table_rows.extend(rows)
+        return True
+
+    ocr_queue = queue.Queue(maxsize=args.ocr_workers * QUEUE_PER_WORKER)
+    morph_queue = queue.Queue(maxsize=args.morph_workers * QUEUE_PER_WORKER)
+    classify_queue = queue.Queue(maxsize=QUEUE_PER_WORKER)
+    stages = [
+        Stage("ocr", ocr, args.ocr_workers, ocr_queue, morph_queue, logger, metrics_path),
+        Stage("morph", morph, args.morph_workers, morph_queue, classify_queue, logger, metrics_path),
+        # Классификация лёгкая и ведёт общие списки — один поток
+        Stage("classify", classify, 1, classify_queue, None, logger, metrics_path),
+    ]
+    flt.metrics = stages[2].metrics
+    for stage in stages:
+        stage.start()
+    download_metrics = StageMetrics(metrics_path, "download")
+
+    logger.info(
+        "Потоковый режим: загрузка %d, OCR %d, нормализация %d",
+        args.download_workers, args.ocr_workers, args.morph_workers,
+    )
+    started = time.monotonic()
+    try:
+        total, ok, failed = download_pdf_cli.download_documents(
+            date_from=date_from,
+            date_to=date_to,
+            download_dir=str(paths["pdf"]),
+            page_size=args.page_size,
+            workers=args.download_workers,
+            rate=args.download_rate,
+            base_url=args.base_url,
+            index_db=str(base_dir / "documents.sqlite"),
+            manifest_path=str(paths["manifest"]),
+            on_downloaded=lambda item, filepath: ocr_queue.put(StreamDocument(item, Path(filepath))),
+            metrics=download_metrics,
+            triage=triage,
+        )
+        download_metrics.finish(resources=False, downloaded=ok, failed=failed)
+        logger.info("Загрузка завершена: документов %d, скачано %d, ошибок %d", total, ok, failed)
+    finally:
+        ocr_queue.put(None)
+        for stage in stages:
+            stage.close()
+        ocr_pool.shutdown()
+        morph_pool.shutdown()
+
+    flt.finish(summary, table_rows)
+    if ocr_cache is not None:
+        stages[0].metrics.add(
+            cache_hits=ocr_cache.hits, cache_misses=ocr_cache.misses, cache_bytes_saved=ocr_cache.bytes_saved
+        )
+    stages[1].metrics.add(cache_hits=normalizer.hits, cache_misses=normalizer.misses)
+    for stage in stages:
+        stage.metrics.finish(
+            resources=False, succeeded=stage.done, failed=stage.failed, busy_s=round(stage.busy_seconds, 3)
+        )
+    for state in (ocr_state, morph_state):
+        if state is not None:
+            state.save()
+            logger.info("Шаг %s: без изменений, пропущено %d", state.stage, state.skipped)
+    normalizer.save_cache()
+    logger.info(normalizer.cache_stats())
+    if ocr_cache is not None:
+        logger.info(ocr_cache.stats_line())
+        removed, cache_total = ocr_cache.evict()
+        logger.info("Размер кэша OCR: %.1f МБ, удалено записей: %d", cache_total / 1024 ** 2, removed)
+    logger.info("Потоковый режим: всего %.1f сек", time.monotonic() - started)
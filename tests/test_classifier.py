@@ -0,0 +1,103 @@
+"""Классификатор: поиск ключевых слов за один проход и разбор таблиц распределения."""
+import random
+
+import pytest
+
+from benchmark_cli import CorpusParams, build_corpus
+from classifier_cli import KeywordMatcher, TableScanner, keyword_matcher, parse_amount
+
+
+def naive_scan(rule_sets, text):
+    """Эталон: str.startswith в каждой позиции текста для каждого слова."""
+    text = text.lower()
+    matches = {}
+    for name, keywords in rule_sets.items():
+        matches[name] = {}
+        for keyword in keywords:
+            positions = [i for i in range(len(text)) if text.startswith(keyword.lower(), i)]
+            if positions:
+                matches[name][keyword] = positions
+    return matches
+
+
+RULE_SETS = {
+    "budget": ["субсидия", "субсидия бюджет", "резервный фонд", "фонд"],
+    "region:ЦФО": ["курский область", "курский", "г. москва"],
+    "signal": ["бюджет", "Фонд"],
+}
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matcher_agrees_with_naive_search(seed):
+    rng = random.Random(seed)
+    # Текст из кусков слов правил: много пересекающихся и вложенных вхождений
+    pieces = ["субсидия", " бюджет", "Фонд", "ф", " ", "курский", " область", "г. москва", "резервный ", "СУБ"]
+    text = "".join(rng.choice(pieces) for _ in range(200))
+    assert KeywordMatcher(RULE_SETS).scan(text) == naive_scan(RULE_SETS, text)
+
+
+def test_matcher_counts_nested_and_overlapping_keywords():
+    rule_sets = {"a": ["аба", "аб"], "b": ["ба"]}
+    matches = KeywordMatcher(rule_sets).scan("АБАБА")
+    assert matches == {"a": {"аба": [0, 2], "аб": [0, 2]}, "b": {"ба": [1, 3]}}
+    assert KeywordMatcher.counts(matches["a"]) == {"аба": 2, "аб": 2}
+
+
+def test_matcher_without_keywords_finds_nothing():
+    assert KeywordMatcher({"budget": []}).scan("субсидия") == {"budget": {}}
+
+
+def test_same_rule_sets_compile_once():
+    assert keyword_matcher(RULE_SETS) is keyword_matcher({name: list(words) for name, words in RULE_SETS.items()})
+
+
+TABLE_TEXT = """--- Страница 1 ---
+Распределение субсидий бюджетам субъектов Российской Федерации
+
+Наименование субъекта Российской Федерации    Размер субсидии (тыс. рублей)
+Белгородская область                          1 234 567,8
+Курская область                                  12 000
+--- Страница 2 ---
+Тверская область                                 350,5
+г. Москва                                     2.500.000,25
+Итого                                         3 597 118,55
+"""
+
+
+@pytest.mark.parametrize("value, amount", [
+    ("1 234 567,8", 1234567.8),
+    ("12000", 12000.0),
+    ("2.500.000,25", 2500000.25),
+    ("350,5.", 350.5),
+    ("—", None),
+])
+def test_parse_amount(value, amount):
+    assert parse_amount(value) == amount
+
+
+def test_table_rows_follow_title_across_pages_without_totals():
+    assert TableScanner().extract_rows(TABLE_TEXT) == [
+        ("Белгородская область", 1234567.8),
+        ("Курская область", 12000.0),
+        ("Тверская область", 350.5),
+        ("г. Москва", 2500000.25),
+    ]
+
+
+def test_table_needs_both_titles_and_enough_rows():
+    scanner = TableScanner()
+    assert scanner.has_table(TABLE_TEXT)
+    assert not scanner.has_table(TABLE_TEXT.replace("Наименование субъекта", "Перечень"))
+    assert not scanner.has_table(TABLE_TEXT.replace("Размер субсидии (тыс. рублей)", ""))
+    assert not TableScanner(min_rows=10).has_table(TABLE_TEXT)
+    assert scanner.extract_rows(TABLE_TEXT.replace("Наименование субъекта", "Перечень")) == []
+
+
+def test_table_rows_of_synthetic_corpus(tmp_path):
+    corpus = build_corpus(tmp_path, CorpusParams(documents=6, min_pages=2, max_pages=3, scanned_share=0))
+    assert any(document["table_rows"] for document in corpus.documents)
+    scanner = TableScanner()
+    for document in corpus.documents:
+        text = corpus.text_path(document).read_text(encoding="utf-8")
+        assert scanner.has_table(text) == bool(document["table_rows"])
+        assert len(scanner.extract_rows(text)) == document["table_rows"]
@@ -0,0 +1,129 @@
+"""Демон пайплайна: выполнение шагов, отказ в задании и запуск шага без демона."""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+import daemon_cli
+import minepdf_cli
+from daemon_cli import (
+    BASE_DIR, DISABLE_ENV, DaemonServer, JobHandler, OutputRouter, PipelineDaemon, request, submit,
+)
+
+
+@pytest.fixture(scope="module")
+def pipeline_daemon():
+    daemon = PipelineDaemon()
+    yield daemon
+    minepdf_cli.shutdown_ocr_pools()
+
+
+@pytest.fixture
+def socket_path(pipeline_daemon, monkeypatch):
+    monkeypatch.delenv(DISABLE_ENV, raising=False)
+    # Короткий путь: длина пути Unix-сокета ограничена
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "daemon.sock"
+        server = DaemonServer(str(path), JobHandler)
+        server.daemon = pipeline_daemon
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            yield path
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+
+@contextmanager
+def routed_output(daemon):
+    """Вывод заданий — клиенту, как после serve() (pytest подменяет sys.stdout к началу теста)."""
+    saved = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = OutputRouter(daemon, sys.stdout), OutputRouter(daemon, sys.stderr)
+    try:
+        yield
+    finally:
+        sys.stdout, sys.stderr = saved
+
+
+@pytest.fixture
+def text_folder(tmp_path):
+    folder = tmp_path / "txt"
+    folder.mkdir()
+    (folder / "doc.txt").write_text("Субсидии областям", encoding="utf-8")
+    return folder
+
+
+def test_submit_runs_step_in_daemon(socket_path, pipeline_daemon, text_folder):
+    output = []
+    with routed_output(pipeline_daemon):
+        code = submit(BASE_DIR / "morphy_cli.py", ["--input-folder", str(text_folder)], output.append, socket_path)
+    assert code == 0
+    assert "Начинаю обработку" in "".join(output)
+    assert (text_folder.parent / "txt_normalized" / "doc.txt").read_text(encoding="utf-8").split() == [
+        "субсидия", "область",
+    ]
+    assert request({"op": "status"}, path=socket_path)["completed"] >= 1
+
+
+def test_step_exit_code_is_returned(socket_path, pipeline_daemon):
+    output = []
+    with routed_output(pipeline_daemon):
+        code = submit(BASE_DIR / "morphy_cli.py", ["--workers", "много"], output.append, socket_path)
+    assert code == 2
+    assert "morphy_cli.py: error: argument --workers" in "".join(output)
+
+
+def test_no_daemon_or_disabled_means_local_run(socket_path, tmp_path, monkeypatch):
+    assert submit(BASE_DIR / "morphy_cli.py", [], path=tmp_path / "none.sock") is None
+    monkeypatch.setenv(DISABLE_ENV, "off")
+    assert submit(BASE_DIR / "morphy_cli.py", [], path=socket_path) is None
+
+
+@pytest.mark.parametrize("message, reason", [
+    ({"script": str(BASE_DIR / "pipeline.py")}, "неизвестный шаг"),
+    ({"script": "/elsewhere/federal_mbt/morphy_cli.py"}, "не из папки демона"),
+    ({"script": "morphy_cli.py"}, "не из папки демона"),
+    ({"script": str(BASE_DIR / "morphy_cli.py"), "cwd": "/"}, "другая рабочая папка"),
+])
+def test_daemon_rejects_foreign_jobs(socket_path, message, reason):
+    message = {"argv": [], "cwd": os.getcwd(), **message}
+    assert reason in request(message, path=socket_path)["rejected"]
+
+
+def test_daemon_rejects_jobs_after_code_change(socket_path, pipeline_daemon, monkeypatch, capsys):
+    path = next(iter(pipeline_daemon.sources))
+    monkeypatch.setitem(pipeline_daemon.sources, path, 0)
+    assert submit(BASE_DIR / "morphy_cli.py", [], path=socket_path) is None
+    assert f"{Path(path).name} изменился" in capsys.readouterr().err
+
+
+def run_command(*args, cwd):
+    env = {key: value for key, value in os.environ.items() if key != DISABLE_ENV}
+    return subprocess.run(
+        [sys.executable, str(BASE_DIR / "daemon_cli.py"), "--socket", str(Path(cwd) / "none.sock"), "run", *args],
+        cwd=cwd, env=env, capture_output=True, text=True, timeout=120,
+    )
+
+
+def test_run_without_daemon_falls_back_to_step(text_folder, tmp_path):
+    result = run_command("morphy_cli.py", "--input-folder", str(text_folder), cwd=tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / "txt_normalized" / "doc.txt").exists()
+
+
+def test_run_foreign_script_executes_that_copy(tmp_path):
+    script = tmp_path / "checkout" / "morphy_cli.py"
+    script.parent.mkdir()
+    script.write_text(
+        f"import os, sys\nprint('другая копия', os.environ.get({DISABLE_ENV!r}), sys.argv[1:])\n", encoding="utf-8"
+    )
+    result = run_command(str(script), "--workers", "2", cwd=tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "другая копия off ['--workers', '2']"
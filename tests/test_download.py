@@ -0,0 +1,169 @@
+"""Повторные запуски download_pdf_cli с индексом: докачка и восстановление файлов."""
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmark_cli import CorpusParams, CorpusServer, build_corpus
+import download_pdf_cli
+from download_pdf_cli import DocumentIndex, build_filename, download_documents, download_item, is_valid_pdf
+
+DATE_FROM, DATE_TO = "01.01.2026", "10.01.2026"
+ITEM = {"eoNumber": "0001", "title": "Постановление", "number": "1", "documentDate": "2026-01-05T00:00:00"}
+PDF_BYTES = b"%PDF-1.4\n1 0 obj\n<<>>\nendobj\n%%EOF\n"
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    corpus = build_corpus(
+        tmp_path_factory.mktemp("corpus"),
+        CorpusParams(documents=3, min_pages=1, max_pages=2, scanned_share=0),
+    )
+    with CorpusServer(corpus) as server:
+        yield server
+
+
+def download(server, folder, index_db):
+    return download_documents(DATE_FROM, DATE_TO, str(folder), workers=2, base_url=server.url, index_db=str(index_db))
+
+
+def pdfs(folder):
+    return sorted(folder.glob("*.pdf"))
+
+
+def test_index_rerun_resumes_truncated_and_partial_files(server, tmp_path, capsys):
+    folder, index_db = tmp_path / "week", tmp_path / "index.db"
+    assert download(server, folder, index_db) == (3, 3, 0)
+    truncated, partial, intact = pdfs(folder)
+    sizes = {path.name: path.stat().st_size for path in (truncated, partial, intact)}
+
+    truncated.write_bytes(truncated.read_bytes()[:100])
+    data = partial.read_bytes()
+    partial.unlink()
+    partial.with_name(partial.name + ".part").write_bytes(data[:200])
+    capsys.readouterr()
+
+    assert download(server, folder, index_db) == (3, 3, 0)
+    out = capsys.readouterr().out
+    assert "с 100 bytes" in out and "с 200 bytes" in out
+    assert out.count("Уже скачан (индекс)") == 1
+    for path in (truncated, partial, intact):
+        assert path.stat().st_size == sizes[path.name]
+        assert is_valid_pdf(path)
+    assert not list(folder.glob("*.part"))
+
+
+def test_index_downloads_again_when_indexed_file_is_gone(server, tmp_path, capsys):
+    index_db = tmp_path / "index.db"
+    assert download(server, tmp_path / "first", index_db) == (3, 3, 0)
+    shutil.rmtree(tmp_path / "first")
+    capsys.readouterr()
+
+    assert download(server, tmp_path / "second", index_db) == (3, 3, 0)
+    out = capsys.readouterr().out
+    assert "другим запуском" not in out
+    assert out.count("Успешно сохранен") == 3
+    assert all(is_valid_pdf(path) for path in pdfs(tmp_path / "second"))
+
+
+def test_download_waits_again_when_another_run_reclaims(tmp_path, monkeypatch):
+    """Пока документ занят другими запусками, он не качается: ожидание повторяется,
+    и готовый файл другого запуска переносится ссылкой."""
+    item = ITEM
+    index = DocumentIndex(tmp_path / "index.db")
+    index.upsert_items([item])
+    other = DocumentIndex(tmp_path / "index.db")
+    assert other.claim("0001")
+    ready = tmp_path / "other" / "1.pdf"
+    ready.parent.mkdir()
+    ready.write_bytes(PDF_BYTES)
+
+    waits = []
+
+    def wait_claimed(eo_number, poll=1.0):
+        waits.append(eo_number)
+        if len(waits) == 1:
+            # Первый запуск бросил документ, и его тут же занял третий
+            other.mark_failed(eo_number)
+            assert other.claim(eo_number)
+        else:
+            other.mark_downloaded(eo_number, ready, "sha", ready.stat().st_size)
+        return index.get(eo_number)
+
+    def fetch_pdf(*args, **kwargs):
+        raise AssertionError("документ, занятый другим запуском, качать нельзя")
+
+    monkeypatch.setattr(index, "wait_claimed", wait_claimed)
+    monkeypatch.setattr(download_pdf_cli, "fetch_pdf", fetch_pdf)
+    folder = tmp_path / "week"
+    folder.mkdir()
+    assert download_item(None, None, item, str(folder), "http://unused", "[1/1]", index=index)
+    assert len(waits) == 2
+    assert is_valid_pdf(folder / build_filename(item))
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = DocumentIndex(tmp_path / "index.db")
+    index.upsert_items([ITEM])
+    yield index
+    index.close()
+
+
+def test_claim_is_exclusive_across_runs(index, tmp_path):
+    runs = [DocumentIndex(tmp_path / "index.db") for _ in range(8)]
+    barrier = threading.Barrier(len(runs))
+    claimed = []
+
+    def claim(run):
+        barrier.wait()
+        claimed.append(run.claim(ITEM["eoNumber"]))
+
+    threads = [threading.Thread(target=claim, args=(run,)) for run in runs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for run in runs:
+        run.close()
+    assert sorted(claimed) == [False] * 7 + [True]
+    assert index.get(ITEM["eoNumber"])["status"] == "downloading"
+    assert not index.claim("unknown")
+
+
+def test_claim_after_failure_or_stale_claim(index):
+    assert index.claim(ITEM["eoNumber"])
+    index.mark_failed(ITEM["eoNumber"])
+    assert index.claim(ITEM["eoNumber"])
+
+    stale = (datetime.now() - timedelta(seconds=download_pdf_cli.CLAIM_TIMEOUT + 60)).isoformat(timespec="seconds")
+    with index.conn:
+        index.conn.execute("UPDATE documents SET claimed_at = ? WHERE eo_number = ?", (stale, ITEM["eoNumber"]))
+    # Запуск, занявший документ, пропал: ждать его нечего, документ занимается заново
+    assert index.wait_claimed(ITEM["eoNumber"])["status"] == "downloading"
+    assert index.claim(ITEM["eoNumber"])
+
+
+def test_claim_downloaded_only_when_file_is_gone(index, tmp_path):
+    path = tmp_path / "1.pdf"
+    path.write_bytes(PDF_BYTES)
+    assert index.claim(ITEM["eoNumber"])
+    index.mark_downloaded(ITEM["eoNumber"], path, "sha", len(PDF_BYTES))
+    assert not index.claim(ITEM["eoNumber"])
+
+    path.write_bytes(PDF_BYTES[:10])
+    assert index.claim(ITEM["eoNumber"])
+
+
+def test_wait_claimed_returns_when_other_run_finishes(index, tmp_path):
+    other = DocumentIndex(tmp_path / "index.db")
+    assert other.claim(ITEM["eoNumber"])
+    path = tmp_path / "1.pdf"
+    path.write_bytes(PDF_BYTES)
+    timer = threading.Timer(0.2, other.mark_downloaded, (ITEM["eoNumber"], path, "sha", len(PDF_BYTES)))
+    timer.start()
+    known = index.wait_claimed(ITEM["eoNumber"], poll=0.05)
+    timer.join()
+    other.close()
+    assert known["status"] == "downloaded" and known["path"] == str(path)
@@ -0,0 +1,16 @@
+"""Нормализация: параллельная обработка крупных файлов по кускам."""
+from morphy_cli import TextNormalizer, process_files_parallel
+
+
+def test_large_file_without_blocks_is_finished(tmp_path):
+    input_dir, output_dir = tmp_path / "txt", tmp_path / "txt_normalized"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    # Крупнее chunk_bytes, но после декодирования не остаётся ни одного куска
+    (input_dir / "broken.txt").write_bytes(b"\xff" * 4096)
+    (input_dir / "small.txt").write_text("Субсидии областям", encoding="utf-8")
+
+    assert process_files_parallel(input_dir, output_dir, TextNormalizer(), workers=2, chunk_bytes=1024) == (2, 0)
+    assert (output_dir / "broken.txt").read_text(encoding="utf-8") == ""
+    assert not (output_dir / "broken.txt.part").exists()
+    assert (output_dir / "small.txt").read_text(encoding="utf-8").split() == ["субсидия", "область"]
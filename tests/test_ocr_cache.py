@@ -0,0 +1,175 @@
+"""Кэш OCR: ключ по движкам и сведения <имя>.ocr.json при попадании в кэш."""
+import json
+import shutil
+import threading
+
+import pytest
+
+import minepdf_cli
+from benchmark_cli import CorpusParams, build_corpus
+from classifier_cli import load_rules
+from minepdf_cli import OcrCache, OcrOptions, ocr_metadata_path, process_pdf_folder
+from progressive import progressive_settings, progressive_summary
+from run_metrics import StageMetrics
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    return build_corpus(
+        tmp_path_factory.mktemp("corpus"),
+        CorpusParams(documents=2, min_pages=2, max_pages=3, scanned_share=0),
+    )
+
+
+@pytest.fixture(scope="module")
+def long_corpus(tmp_path_factory):
+    """Документы длиннее stop_after_pages: прогрессивный OCR останавливается досрочно."""
+    return build_corpus(
+        tmp_path_factory.mktemp("long_corpus"),
+        CorpusParams(documents=2, min_pages=6, max_pages=6, scanned_share=0),
+    )
+
+
+def copy_pdfs(corpus, folder):
+    folder.mkdir()
+    for document in corpus.documents:
+        shutil.copy(corpus.pdf_path(document), folder)
+    return folder
+
+
+@pytest.fixture
+def pdf_folder(corpus, tmp_path):
+    return copy_pdfs(corpus, tmp_path / "pdf")
+
+
+@pytest.fixture
+def fake_ocr(monkeypatch):
+    """OCR без Tesseract: страница «распознаётся» с низкой уверенностью,
+    так что при --adaptive-dpi каждая страница сканируется повторно."""
+    monkeypatch.setattr(minepdf_cli, "ocr_image", lambda image, backend="pytesseract": "текст страницы\f")
+    monkeypatch.setattr(
+        minepdf_cli, "ocr_image_data", lambda image, backend="pytesseract": ("текст страницы\f", [50.0])
+    )
+
+
+def sidecars(folder):
+    return {path.name: json.loads(path.read_text(encoding="utf-8")) for path in folder.glob("*.ocr.json")}
+
+
+def test_cache_key_depends_on_backends(tmp_path):
+    keys = {
+        OcrCache(tmp_path, OcrOptions(backend=backend, render=render)).document_key_suffix
+        for backend in minepdf_cli.OCR_BACKENDS
+        for render in minepdf_cli.RENDER_BACKENDS
+    }
+    assert len(keys) == len(minepdf_cli.OCR_BACKENDS) * len(minepdf_cli.RENDER_BACKENDS)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_cache_hit_keeps_adaptive_sidecar(pdf_folder, tmp_path, fake_ocr, workers):
+    options = OcrOptions(dpi=100, adaptive_dpi=50, text_layer=False, render="pymupdf")
+    output = tmp_path / "txt"
+    cache = OcrCache(tmp_path / "cache", options)
+    assert process_pdf_folder(pdf_folder, output, options, workers, cache) == (2, 2)
+    first = sidecars(output)
+    assert len(first) == 2
+    assert all(record["rescanned_pages"] == len(record["pages"]) for record in first.values())
+
+    cache = OcrCache(tmp_path / "cache", options)
+    assert process_pdf_folder(pdf_folder, output, options, workers, cache) == (2, 2)
+    assert cache.hits == 2 and cache.misses == 0
+    second = sidecars(output)
+    for name, record in first.items():
+        assert second[name] == {**record, "cached": True}
+
+
+def test_cache_hit_without_stored_sidecar_keeps_existing_file(pdf_folder, tmp_path, fake_ocr):
+    options = OcrOptions(dpi=100, adaptive_dpi=50, text_layer=False, render="pymupdf")
+    output = tmp_path / "txt"
+    process_pdf_folder(pdf_folder, output, options, 1, OcrCache(tmp_path / "cache", options))
+    for path in (tmp_path / "cache" / "documents").rglob("*.ocr.json"):
+        path.unlink()
+    first = sidecars(output)
+
+    process_pdf_folder(pdf_folder, output, options, 1, OcrCache(tmp_path / "cache", options))
+    assert sidecars(output) == first
+    assert all(ocr_metadata_path(path).exists() for path in output.glob("*.txt"))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_cache_hit_keeps_progressive_record(long_corpus, tmp_path, fake_ocr, workers):
+    options = OcrOptions(dpi=50, text_layer=False, render="pymupdf", progressive=progressive_settings(load_rules()))
+    pdf_folder = copy_pdfs(long_corpus, tmp_path / "pdf")
+    output = tmp_path / "txt"
+    metrics = StageMetrics(None, "ocr")
+    process_pdf_folder(pdf_folder, output, options, workers, OcrCache(tmp_path / "cache", options), metrics=metrics)
+    first = progressive_summary(output)
+    assert len(first["stopped"]) == 2 and first["skipped_pages"] == 4
+    assert metrics.counters["skipped_pages"] == 4
+
+    metrics = StageMetrics(None, "ocr")
+    cache = OcrCache(tmp_path / "cache", options)
+    process_pdf_folder(pdf_folder, output, options, workers, cache, metrics=metrics)
+    assert cache.hits == 2
+    assert progressive_summary(output) == first
+    assert metrics.counters["stopped_documents"] == 2 and metrics.counters["skipped_pages"] == 4
+
+
+def test_parallel_runs_do_not_wait_on_each_others_locks(corpus, tmp_path, fake_ocr):
+    """Два запуска (соседние недели backfill) берут одни и те же документы в
+    обратном порядке: каждый распознаёт свой и берёт второй из кэша, без
+    ожидания до LOCK_TIMEOUT и без повторного OCR."""
+    options = OcrOptions(dpi=50, text_layer=False, render="pymupdf")
+    pdf_folder = copy_pdfs(corpus, tmp_path / "pdf")
+    names = sorted(path.name for path in pdf_folder.glob("*.pdf"))
+    barrier = threading.Barrier(2)
+    results = {}
+
+    def run(run_name, order):
+        cache = OcrCache(tmp_path / "cache", options)
+        lock_document = cache.lock_document
+        locked = []
+
+        def lock_and_wait(pdf_hash):
+            # Оба запуска успевают занять свой первый документ до второго
+            ok = lock_document(pdf_hash)
+            if not locked:
+                locked.append(pdf_hash)
+                barrier.wait(timeout=10)
+            return ok
+
+        cache.lock_document = lock_and_wait
+        metrics = StageMetrics(None, "ocr")
+        output = tmp_path / run_name
+        output.mkdir()
+        ok = minepdf_cli.process_pdf_folder_parallel(pdf_folder, output, order, options, 2, cache, metrics=metrics)
+        results[run_name] = (ok, metrics.counters)
+
+    threads = [
+        threading.Thread(target=run, args=("a", names), daemon=True),
+        threading.Thread(target=run, args=("b", names[::-1]), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    assert not any(thread.is_alive() for thread in threads)
+
+    assert results["a"][0] == results["b"][0] == 2
+    ocr_pages = sum(counters.get("ocr_pages", 0) for _, counters in results.values())
+    assert ocr_pages == sum(document["pages"] for document in corpus.documents)
+    assert all(counters["cached_documents"] == 1 for _, counters in results.values())
+
+
+def test_entry_evicted_during_read_is_a_miss(tmp_path, monkeypatch):
+    cache = OcrCache(tmp_path / "cache", OcrOptions())
+    cache.put_page("ab" * 32, 1, "текст")
+
+    def evicted(path, *args, **kwargs):
+        # evict() другого процесса удалил запись между чтением и отметкой использования
+        path.unlink()
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(minepdf_cli.os, "utime", evicted)
+    assert cache.get_page("ab" * 32, 1) is None
+    assert (cache.hits, cache.misses) == (0, 1)
@@ -0,0 +1,106 @@
+"""Параллельный OCR: расписание страниц в пуле процессов."""
+import hashlib
+import json
+import shutil
+import time
+
+import pytest
+
+import minepdf_cli
+from benchmark_cli import CorpusParams, build_corpus
+from classifier_cli import load_rules
+from minepdf_cli import OcrOptions, process_pdf_folder
+from progressive import progressive_settings
+
+QUALIFIED_TEXT = "Субсидия бюджету Белгородской области\f"
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    return build_corpus(
+        tmp_path_factory.mktemp("corpus"),
+        CorpusParams(documents=3, min_pages=1, max_pages=4, scanned_share=0),
+    )
+
+
+@pytest.fixture(scope="module")
+def long_corpus(tmp_path_factory):
+    return build_corpus(
+        tmp_path_factory.mktemp("long_corpus"),
+        CorpusParams(documents=1, min_pages=6, max_pages=6, scanned_share=0),
+    )
+
+
+def copy_pdfs(corpus, folder):
+    folder.mkdir()
+    for document in corpus.documents:
+        shutil.copy(corpus.pdf_path(document), folder)
+    return folder
+
+
+@pytest.fixture
+def pdf_folder(long_corpus, tmp_path):
+    return copy_pdfs(long_corpus, tmp_path / "pdf")
+
+
+@pytest.fixture
+def image_ocr(monkeypatch):
+    """OCR без Tesseract: «текст» страницы — хэш её изображения, у каждой страницы свой."""
+    monkeypatch.setattr(
+        minepdf_cli, "ocr_image", lambda image, backend="pytesseract": hashlib.md5(image.tobytes()).hexdigest()
+    )
+
+
+@pytest.fixture
+def ocr_log(monkeypatch, tmp_path):
+    """OCR без Tesseract: каждая страница «распознаётся» 0.3 с, интервалы пишутся в файлы
+    (задачи выполняются в дочерних процессах)."""
+    log = tmp_path / "ocr_log"
+    log.mkdir()
+
+    def ocr_image(image, backend="pytesseract"):
+        started = time.monotonic()
+        time.sleep(0.3)
+        (log / f"{started}").write_text(json.dumps([started, time.monotonic()]))
+        return QUALIFIED_TEXT
+
+    monkeypatch.setattr(minepdf_cli, "ocr_image", ocr_image)
+    return log
+
+
+def texts(folder):
+    return {path.name: path.read_text(encoding="utf-8") for path in folder.glob("*.txt")}
+
+
+def test_parallel_pages_are_assembled_like_sequential(corpus, tmp_path, image_ocr):
+    folder = copy_pdfs(corpus, tmp_path / "pdf")
+    options = OcrOptions(dpi=50, page_batch=2, text_layer=False, render="pymupdf")
+    assert process_pdf_folder(folder, tmp_path / "sequential", options, workers=1) == (3, 3)
+    assert process_pdf_folder(folder, tmp_path / "parallel", options, workers=3) == (3, 3)
+
+    sequential = texts(tmp_path / "sequential")
+    assert texts(tmp_path / "parallel") == sequential
+    for document in corpus.documents:
+        text = sequential[f"{document['item']['eoNumber']}.txt"]
+        markers = [line for line in text.splitlines() if line.startswith("--- Страница")]
+        assert markers == [f"--- Страница {i} ---" for i in range(1, document["pages"] + 1)]
+
+
+def max_overlap(log):
+    intervals = [json.loads(path.read_text()) for path in log.iterdir()]
+    return max(sum(start <= moment < end for start, end in intervals) for moment, _ in intervals)
+
+
+def test_qualified_document_fills_free_workers(pdf_folder, tmp_path, ocr_log):
+    settings = progressive_settings(load_rules())
+    settings.update(batch_pages=1, defer_qualified=False)
+    options = OcrOptions(dpi=50, text_layer=False, render="pymupdf", progressive=settings)
+    output = tmp_path / "txt"
+    assert process_pdf_folder(pdf_folder, output, options, workers=3) == (1, 1)
+
+    record = json.loads(next(output.glob("*.ocr.json")).read_text(encoding="utf-8"))
+    assert record["progressive"]["decision"] == "qualified"
+    assert record["progressive"]["decided_at_page"] == 1
+    assert len(list(ocr_log.iterdir())) == 6
+    # После решения по первой странице остальные пять идут не по одной, а во все процессы
+    assert max_overlap(ocr_log) >= 2
@@ -0,0 +1,24 @@
+"""pipeline.py: недели backfill."""
+from datetime import date
+
+import pytest
+
+from pipeline import weekly_ranges
+
+
+@pytest.mark.parametrize(
+    "date_from, date_to, starts",
+    [
+        # TO на границе недели — следующая неделя не нужна
+        (date(2025, 12, 5), date(2025, 12, 12), [date(2025, 12, 5)]),
+        (date(2025, 12, 5), date(2025, 12, 13), [date(2025, 12, 5), date(2025, 12, 12)]),
+        (date(2025, 12, 7), date(2025, 12, 20), [date(2025, 12, 5), date(2025, 12, 12), date(2025, 12, 19)]),
+        # FROM == TO: одна неделя, даже если это пятница
+        (date(2025, 12, 5), date(2025, 12, 5), [date(2025, 12, 5)]),
+        (date(2025, 12, 9), date(2025, 12, 9), [date(2025, 12, 5)]),
+    ],
+)
+def test_weekly_ranges(date_from, date_to, starts):
+    ranges = list(weekly_ranges(date_from, date_to))
+    assert [start for start, _ in ranges] == starts
+    assert all((end - start).days == 7 for start, end in ranges)
@@ -0,0 +1,136 @@
+"""Прогрессивный OCR: досрочная остановка и порядок дораспознавания бюджетных документов."""
+import json
+import os
+import shutil
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import pytest
+
+import minepdf_cli
+from benchmark_cli import CorpusParams, build_corpus
+from classifier_cli import load_rules
+from minepdf_cli import OcrOptions, process_pdf_folder
+from progressive import ProgressiveClassifier, progressive_settings
+
+QUALIFIED_TEXT = "Субсидия бюджету Белгородской области"
+SIGNAL_TEXT = "Финансирование мероприятий"
+NEUTRAL_TEXT = "Об утверждении правил ведения реестра"
+
+
+def settings(**overrides):
+    settings = progressive_settings(load_rules())
+    settings.update(overrides)
+    return settings
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return ProgressiveClassifier(settings())
+
+
+def decisions(classifier, pages):
+    progress = classifier.document()
+    result = []
+    for text in pages:
+        progress.add_page(text)
+        result.append(progress.decide())
+    return progress, result
+
+
+def test_budget_document_with_region_qualifies_at_batch_end(classifier):
+    progress, result = decisions(classifier, [NEUTRAL_TEXT, QUALIFIED_TEXT, NEUTRAL_TEXT])
+    assert result == [None, "qualified", "qualified"]
+    assert progress.record()["decided_at_page"] == 2
+    assert progress.record()["regions"] == ["ЦФО"]
+
+
+def test_document_without_signals_stops_after_limit(classifier):
+    progress, result = decisions(classifier, [NEUTRAL_TEXT] * 4)
+    assert result == [None, None, None, "stop"]
+    assert progress.record([5, 6]) == {
+        "decision": "stopped", "decided_at_page": 4, "pages_checked": 4, "budget": False, "regions": [],
+        "skipped_pages": [5, 6], "deferred_pages": 0,
+    }
+
+
+def test_signal_or_budget_without_region_keeps_recognizing(classifier):
+    for first_page in (SIGNAL_TEXT, "Субсидия на поддержку"):
+        progress, result = decisions(classifier, [first_page] + [NEUTRAL_TEXT] * 5)
+        assert result == [None] * 6
+        assert progress.record()["decision"] == "complete"
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    return build_corpus(
+        tmp_path_factory.mktemp("corpus"),
+        CorpusParams(documents=2, min_pages=6, max_pages=6, scanned_share=0),
+    )
+
+
+def copy_pdfs(corpus, folder, documents=None):
+    folder.mkdir()
+    for document in documents or corpus.documents:
+        shutil.copy(corpus.pdf_path(document), folder)
+    return folder
+
+
+def sidecar(folder, name):
+    return json.loads((folder / f"{name}.ocr.json").read_text(encoding="utf-8"))["progressive"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_stopped_document_skips_remaining_pages(corpus, tmp_path, monkeypatch, workers):
+    monkeypatch.setattr(minepdf_cli, "ocr_image", lambda image, backend="pytesseract": NEUTRAL_TEXT)
+    document = corpus.documents[0]
+    folder = copy_pdfs(corpus, tmp_path / "pdf", [document])
+    output = tmp_path / "txt"
+    options = OcrOptions(dpi=50, text_layer=False, render="pymupdf", progressive=settings())
+    assert process_pdf_folder(folder, output, options, workers) == (1, 1)
+
+    name = document["item"]["eoNumber"]
+    assert sidecar(output, name)["skipped_pages"] == [5, 6]
+    text = (output / f"{name}.txt").read_text(encoding="utf-8")
+    assert text == "".join(minepdf_cli.format_page(i, NEUTRAL_TEXT) for i in range(1, 5))
+
+
+class SyncExecutor:
+    """Пул, выполняющий задачу сразу при отправке: порядок отправки страниц детерминирован."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, pdf_path, page_number, *args):
+        self.submitted.append((os.path.basename(pdf_path), page_number))
+        future = Future()
+        future.set_result(fn(pdf_path, page_number, *args))
+        return future
+
+
+def test_deferred_pages_wait_for_other_documents(corpus, tmp_path, monkeypatch):
+    qualified, other = (f"{document['item']['eoNumber']}.pdf" for document in corpus.documents)
+    executor = SyncExecutor()
+
+    @contextmanager
+    def ocr_page_pool(workers):
+        yield executor
+
+    def ocr_pdf_page(pdf_path, page_number, dpi, backend, render):
+        return QUALIFIED_TEXT if os.path.basename(pdf_path) == qualified else SIGNAL_TEXT
+
+    monkeypatch.setattr(minepdf_cli, "ocr_page_pool", ocr_page_pool)
+    monkeypatch.setattr(minepdf_cli, "ocr_pdf_page", ocr_pdf_page)
+    folder = copy_pdfs(corpus, tmp_path / "pdf")
+    output = tmp_path / "txt"
+    options = OcrOptions(dpi=50, text_layer=False, render="pymupdf", progressive=settings())
+    assert process_pdf_folder(folder, output, options, workers=2) == (2, 2)
+
+    order = [name for name, _ in executor.submitted]
+    # Бюджетный документ решён по первой пачке; его остальные страницы — после всего другого документа
+    assert order[:2] == [qualified] * 2 or order[2:4] == [qualified] * 2
+    assert order[-4:] == [qualified] * 4
+    assert sorted(page for name, page in executor.submitted if name == qualified) == list(range(1, 7))
+    record = sidecar(output, qualified[:-4])
+    assert record["decision"] == "qualified" and record["deferred_pages"] == 4
+    assert sidecar(output, other[:-4])["decision"] == "complete"
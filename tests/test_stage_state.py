@@ -0,0 +1,137 @@
+"""Инкрементальные перезапуски: StageState и --force-stage."""
+import argparse
+import logging
+import shutil
+
+import pytest
+
+import minepdf_cli
+from benchmark_cli import CorpusParams, build_corpus
+from minepdf_cli import OcrOptions, process_pdf_folder
+from morphy_cli import TextNormalizer, process_files
+from pipeline import dry_run
+from stage_state import StageState
+
+
+@pytest.fixture
+def document(tmp_path):
+    source = tmp_path / "doc.txt"
+    source.write_text("исходный текст", encoding="utf-8")
+    output = tmp_path / "doc.out"
+    output.write_text("результат", encoding="utf-8")
+    return source, output
+
+
+def recorded(state_dir, document):
+    source, _ = document
+    state = StageState(state_dir, "ocr", {"dpi": 300})
+    state.record("doc", [source])
+    state.save()
+
+
+def test_unchanged_document_is_skipped(tmp_path, document):
+    source, output = document
+    recorded(tmp_path / "state", document)
+    state = StageState(tmp_path / "state", "ocr", {"dpi": 300})
+    assert state.check("doc", [source], output) is None
+    assert state.skip("doc", [source], output)
+    assert state.skipped == 1
+
+
+@pytest.mark.parametrize("change, reason", [
+    (lambda source, output: None, "new"),
+    (lambda source, output: source.write_text("другой текст", encoding="utf-8"), "input"),
+    (lambda source, output: output.unlink(), "output"),
+])
+def test_changed_document_is_recomputed(tmp_path, document, change, reason):
+    source, output = document
+    if reason != "new":
+        recorded(tmp_path / "state", document)
+    change(source, output)
+    state = StageState(tmp_path / "state", "ocr", {"dpi": 300})
+    assert state.check("doc", [source], output) == reason
+    assert not state.skip("doc", [source], output)
+    assert state.skipped == 0
+
+
+def test_params_change_invalidates_every_document(tmp_path, document):
+    source, output = document
+    recorded(tmp_path / "state", document)
+    assert StageState(tmp_path / "state", "ocr", {"dpi": 400}).check("doc", [source], output) == "params"
+
+
+def test_force_recomputes_up_to_date_document(tmp_path, document):
+    source, output = document
+    recorded(tmp_path / "state", document)
+    assert StageState(tmp_path / "state", "ocr", {"dpi": 300}, force=True).check("doc", [source], output) == "force"
+
+
+def test_rewritten_with_same_content_is_skipped(tmp_path, document):
+    source, output = document
+    recorded(tmp_path / "state", document)
+    source.write_text("исходный текст", encoding="utf-8")
+    state = StageState(tmp_path / "state", "ocr", {"dpi": 300})
+    assert state.skip("doc", [source], output)
+    assert state.get("doc")["inputs"][source.name][1] == source.stat().st_mtime_ns
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    return build_corpus(
+        tmp_path_factory.mktemp("corpus"),
+        CorpusParams(documents=2, min_pages=1, max_pages=2, scanned_share=0),
+    )
+
+
+@pytest.fixture
+def run_dir(corpus, tmp_path, monkeypatch):
+    """Неделя, прошедшая OCR и нормализацию с записью состояния шагов."""
+    monkeypatch.setattr(minepdf_cli, "extract_text_layer", lambda pdf_path, pages: None)
+    monkeypatch.setattr(minepdf_cli, "ocr_image", lambda image, backend="pytesseract": "субсидия курской области")
+    pdf_dir = tmp_path / "downloaded_documents"
+    pdf_dir.mkdir()
+    for item in corpus.documents:
+        shutil.copy(corpus.pdf_path(item), pdf_dir)
+    return tmp_path
+
+
+def run_ocr(run_dir, dpi=50, force=False):
+    state = StageState(run_dir / ".state", "ocr", OcrOptions(dpi=dpi, render="pymupdf").state_params(), force)
+    process_pdf_folder(
+        run_dir / "downloaded_documents", run_dir / "text_output_ocr", OcrOptions(dpi=dpi, render="pymupdf"),
+        state=state,
+    )
+    return state
+
+
+def test_ocr_reruns_only_when_needed(run_dir):
+    assert run_ocr(run_dir).skipped == 0
+    assert run_ocr(run_dir).skipped == 2
+    assert run_ocr(run_dir, force=True).skipped == 0
+    assert run_ocr(run_dir, dpi=60).skipped == 0
+    next((run_dir / "text_output_ocr").glob("*.txt")).unlink()
+    assert run_ocr(run_dir, dpi=60).skipped == 1
+
+
+def test_dry_run_forced_stage_recomputes_following_stages(run_dir, caplog):
+    run_ocr(run_dir)
+    state = StageState(run_dir / ".state", "morph", TextNormalizer.state_params())
+    process_files(run_dir / "text_output_ocr", run_dir / "text_output_ocr_normalized", TextNormalizer(), state)
+    state.save()
+
+    args = argparse.Namespace(
+        rules=None, regions=None, progressive=False, dpi=50, ocr_backend="pytesseract", render_backend="pymupdf",
+        adaptive_dpi=0, min_confidence=minepdf_cli.ADAPTIVE_MIN_CONFIDENCE, extract_tables=False,
+    )
+    paths = {
+        "pdf": run_dir / "downloaded_documents",
+        "ocr": run_dir / "text_output_ocr",
+        "norm": run_dir / "text_output_ocr_normalized",
+    }
+    logger = logging.getLogger("test_stage_state")
+    with caplog.at_level(logging.INFO, logger="test_stage_state"):
+        dry_run(args, paths, run_dir / ".state", {"morph"}, logger)
+    assert "ocr: пересчитать 0, без изменений 2" in caplog.text
+    assert "morph: пересчитать 2, без изменений 0" in caplog.text
+    assert "classify: пересчитать 2, без изменений 0" in caplog.text
+    assert "morph (принудительно), classify (пересчитывается предыдущий шаг)" in caplog.text
@@ -0,0 +1,55 @@
+"""Текстовый слой PDF: какие страницы берутся из него, а какие идут в OCR."""
+import shutil
+
+import pytest
+
+import minepdf_cli
+from benchmark_cli import CorpusParams, build_corpus
+from minepdf_cli import OcrOptions, is_usable_text_layer, process_pdf_folder, select_text_layer_pages
+
+LAYER_TEXT = "Распоряжение о выделении средств из резервного фонда Правительства. " * 3
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    return build_corpus(
+        tmp_path_factory.mktemp("corpus"),
+        CorpusParams(documents=1, min_pages=3, max_pages=3, scanned_share=0),
+    )
+
+
+@pytest.mark.parametrize("text, usable", [
+    (LAYER_TEXT, True),
+    ("Короткая строка", False),
+    ("Budget allocation for the regions of the federation. " * 5, False),
+    ("", False),
+])
+def test_usable_text_layer(text, usable):
+    assert is_usable_text_layer(text) is usable
+
+
+def test_select_pages_with_usable_layer(monkeypatch):
+    monkeypatch.setattr(minepdf_cli, "extract_text_layer", lambda pdf_path, pages: [LAYER_TEXT, "", LAYER_TEXT])
+    assert select_text_layer_pages("doc.pdf", 3) == {1: LAYER_TEXT, 3: LAYER_TEXT}
+
+
+def test_no_pdftotext_sends_every_page_to_ocr(monkeypatch):
+    monkeypatch.setattr(minepdf_cli, "extract_text_layer", lambda pdf_path, pages: None)
+    assert select_text_layer_pages("doc.pdf", 3) == {}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_only_pages_without_layer_are_recognized(corpus, tmp_path, monkeypatch, workers):
+    folder = tmp_path / "pdf"
+    folder.mkdir()
+    shutil.copy(corpus.pdf_path(corpus.documents[0]), folder)
+    monkeypatch.setattr(minepdf_cli, "extract_text_layer", lambda pdf_path, pages: [LAYER_TEXT, "", LAYER_TEXT])
+    monkeypatch.setattr(minepdf_cli, "ocr_image", lambda image, backend="pytesseract": "распознанный текст")
+
+    output = tmp_path / "txt"
+    options = OcrOptions(dpi=50, render="pymupdf")
+    assert process_pdf_folder(folder, output, options, workers) == (1, 1)
+    text = next(output.glob("*.txt")).read_text(encoding="utf-8")
+    assert text == "".join(
+        minepdf_cli.format_page(i, page) for i, page in enumerate([LAYER_TEXT, "распознанный текст", LAYER_TEXT], 1)
+    )
@@ -0,0 +1,91 @@
+"""Триаж по метаданным выдачи: решения, отложенное скачивание и сверка полноты."""
+import json
+
+import pytest
+
+from benchmark_cli import CorpusParams, CorpusServer, build_corpus
+from classifier_cli import load_rules
+from download_pdf_cli import DocumentIndex, download_documents
+from triage import DEFAULT_KEEP_KEYWORDS, MetadataTriage, read_decisions, triage_recall
+
+
+@pytest.fixture(scope="module")
+def triage():
+    return MetadataTriage(load_rules(), "log")
+
+
+@pytest.mark.parametrize("title, decision", [
+    ("О выделении бюджетных ассигнований из резервного фонда Правительства Российской Федерации", "relevant"),
+    ("О распределении субсидий из федерального бюджета бюджетам субъектов", "relevant"),
+    ("О награждении почётной грамотой Правительства Российской Федерации", "irrelevant"),
+    ("О назначении членов совета директоров", "irrelevant"),
+    ("О назначении ежемесячной выплаты", "borderline"),
+    ("Об утверждении правил ведения государственного реестра", "borderline"),
+])
+def test_decision_by_title(triage, title, decision):
+    assert triage.decide({"eoNumber": "1", "title": title})["decision"] == decision
+
+
+def test_signatory_authority_is_part_of_metadata(triage):
+    item = {"eoNumber": "1", "title": "О награждении", "signatoryAuthority": {"name": "Департамент финансового контроля"}}
+    assert MetadataTriage.metadata_text(item) == "О награждении Департамент финансового контроля"
+    record = triage.decide(item)
+    assert record["decision"] == "borderline"
+    assert record["keep"] == ["финансовый"] and record["irrelevant"] == ["награждение"]
+
+
+def test_only_defer_mode_defers(triage):
+    decision = triage.decide({"eoNumber": "1", "title": "О награждении почётной грамотой"})
+    assert not triage.deferred(decision)
+    assert MetadataTriage(load_rules(), "defer").deferred(decision)
+    with pytest.raises(ValueError):
+        MetadataTriage(load_rules(), "off")
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    corpus = build_corpus(
+        tmp_path_factory.mktemp("corpus"),
+        CorpusParams(documents=4, min_pages=1, max_pages=1, scanned_share=0),
+    )
+    with CorpusServer(corpus) as server:
+        yield server
+
+
+def test_defer_skips_irrelevant_downloads(server, tmp_path):
+    # В синтетическом корпусе нет награждений: нерелевантными считаются «правила ведения реестра»
+    rules = load_rules()
+    rules["triage"] = {"irrelevant": ["утверждение правило"], "keep": DEFAULT_KEEP_KEYWORDS}
+    log_path = tmp_path / "triage.jsonl"
+    folder, index_db = tmp_path / "week", tmp_path / "index.db"
+    result = download_documents(
+        "01.01.2026", "10.01.2026", str(folder), workers=2, base_url=server.url, index_db=str(index_db),
+        triage=MetadataTriage(rules, "defer", log_path),
+    )
+
+    decisions = read_decisions(log_path)
+    deferred = sorted(number for number, record in decisions.items() if record["action"] == "deferred")
+    assert deferred and all(decisions[number]["decision"] == "irrelevant" for number in deferred)
+    assert result == (4, 4 - len(deferred), 0)
+    assert len(list(folder.glob("*.pdf"))) == 4 - len(deferred)
+    index = DocumentIndex(index_db)
+    assert [index.get(number)["status"] for number in deferred] == ["deferred"] * len(deferred)
+    index.close()
+
+
+def test_recall_counts_budget_documents_triaged_away(tmp_path):
+    log_path, summary_path = tmp_path / "triage.jsonl", tmp_path / "summary.json"
+    log_path.write_text("".join(json.dumps(record) + "\n" for record in [
+        {"eoNumber": "1", "decision": "relevant", "action": "download"},
+        {"eoNumber": "2", "decision": "irrelevant", "action": "download"},
+        {"eoNumber": "3", "decision": "irrelevant", "action": "deferred"},
+        {"eoNumber": "4", "decision": "borderline", "action": "download"},
+    ]), encoding="utf-8")
+    summary_path.write_text(json.dumps({"documents": [
+        {"eoNumber": "1", "budget": True},
+        {"eoNumber": "2", "budget": True},
+        {"eoNumber": "4", "budget": False},
+    ]}), encoding="utf-8")
+    assert triage_recall(log_path, summary_path) == {
+        "items": 4, "irrelevant": 2, "deferred": 1, "budget": 2, "missed": ["2"], "recall": 0.5,
+    }
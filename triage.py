@@ -0,0 +1,127 @@
+"""Предварительный отбор документов по метаданным выдачи API.
+
+Название, номер и орган каждого элемента /api/Documents нормализуются так же,
+как тексты документов, и проверяются ключевыми словами бюджетной фазы из
+правил классификации. Документ считается заведомо нерелевантным, только если
+в метаданных нет бюджетных слов и слов-исключений (keep), но есть слова из
+списка irrelevant (награждения, назначения и т.п.); все остальные идут по
+полному пути. Решения пишутся в JSONL, чтобы сверять полноту с полными прогонами.
+"""
+import json
+from pathlib import Path
+
+from classifier_cli import keyword_matcher
+from morphy_cli import TextNormalizer
+
+TRIAGE_MODES = ("off", "log", "defer")
+
+# Слова в начальной форме; переопределяются секцией "triage" в JSON правил
+DEFAULT_IRRELEVANT_KEYWORDS = [
+    "награждение",
+    "почётный грамота",
+    "государственный награда",
+    "объявление благодарность",
+    "присвоение",
+    "почётный звание",
+    "назначение",
+    "освобождение",
+    "состав правительственный комиссия",
+]
+
+DEFAULT_KEEP_KEYWORDS = [
+    "бюджет",
+    "финансирование",
+    "финансовый",
+    "выплата",
+    "средство",
+    "грант",
+    "компенсация",
+]
+
+
+class MetadataTriage:
+    """Решение по элементу выдачи: relevant, borderline или irrelevant.
+
+    mode — log (только записать решения) или defer (нерелевантные не скачиваются
+    в этом запуске и помечаются в индексе как deferred). log_path — JSONL решений.
+    """
+
+    def __init__(self, rules, mode="log", log_path=None, normalizer=None):
+        if mode not in TRIAGE_MODES or mode == "off":
+            raise ValueError(f"Неизвестный режим триажа: {mode}")
+        self.mode = mode
+        self.log_path = Path(log_path) if log_path else None
+        self.normalizer = normalizer or TextNormalizer()
+        triage_rules = rules.get("triage", {})
+        self.matcher = keyword_matcher({
+            "budget": rules["budget"]["keywords"],
+            "keep": triage_rules.get("keep", DEFAULT_KEEP_KEYWORDS),
+            "irrelevant": triage_rules.get("irrelevant", DEFAULT_IRRELEVANT_KEYWORDS),
+        })
+
+    @staticmethod
+    def metadata_text(item) -> str:
+        authority = (item.get("signatoryAuthority") or {}).get("name") or ""
+        return " ".join(filter(None, [item.get("title"), item.get("number"), authority]))
+
+    def decide(self, item) -> dict:
+        matches = self.matcher.scan(self.normalizer.normalize_text(self.metadata_text(item)))
+        if matches["budget"]:
+            decision = "relevant"
+        elif matches["irrelevant"] and not matches["keep"]:
+            decision = "irrelevant"
+        else:
+            decision = "borderline"
+        return {
+            "eoNumber": item.get("eoNumber"),
+            "title": item.get("title"),
+            "decision": decision,
+            **{name: sorted(found) for name, found in matches.items() if found},
+        }
+
+    def deferred(self, decision) -> bool:
+        return self.mode == "defer" and decision["decision"] == "irrelevant"
+
+    def write_log(self, decisions):
+        if self.log_path is None:
+            return
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.log_path, "w", encoding="utf-8") as f:
+            for decision in decisions:
+                record = dict(decision, action="deferred" if self.deferred(decision) else "download")
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_decisions(log_path) -> dict:
+    """{eoNumber: решение} из JSONL триажа."""
+    decisions = {}
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                decisions[record["eoNumber"]] = record
+    return decisions
+
+
+def triage_recall(log_path, summary_path) -> dict:
+    """Сверка решений триажа со сводкой классификации того же запуска.
+
+    missed — бюджетные документы, которые триаж счёл нерелевантными (при
+    --triage log они всё равно прошли полный путь). recall — доля бюджетных
+    документов, не отсеянных триажем.
+    """
+    decisions = read_decisions(log_path)
+    documents = json.loads(Path(summary_path).read_text(encoding="utf-8"))["documents"]
+    budget = [document for document in documents if document["budget"] and document.get("eoNumber") in decisions]
+    missed = [
+        document["eoNumber"] for document in budget
+        if decisions[document["eoNumber"]]["decision"] == "irrelevant"
+    ]
+    return {
+        "items": len(decisions),
+        "irrelevant": sum(1 for decision in decisions.values() if decision["decision"] == "irrelevant"),
+        "deferred": sum(1 for decision in decisions.values() if decision.get("action") == "deferred"),
+        "budget": len(budget),
+        "missed": missed,
+        "recall": round(1 - len(missed) / len(budget), 4) if budget else None,
+    }